@@ -0,0 +1,99 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from nltk.metrics.agreement import AnnotationTask
+from data_processing.agreement_statistics import multi_pi, multi_kappa
+
+# Times multi_pi and multi_kappa against the previous pandas implementation and NLTK on random labels,
+# and checks they all give the same values
+# Usage: python agreement_benchmark.py [num_coders] [num_items] [num_labels] [num_repeats]
+
+# Number of coders labelling every item, items (utterances) labelled and labels the coders choose from
+num_coders = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+num_items = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+num_labels = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+# Number of times each statistic is calculated
+num_repeats = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+
+
+def previous_multi_pi(data):
+    """The previous pandas implementation of multi_pi(), looping over every item and label."""
+    # Need to get the cumulative labels for all coders in data
+    matrix = pd.DataFrame(columns=data[list(data.keys())[0]].columns)
+    for user_name, user_data in data.items():
+        matrix = matrix.add(user_data, fill_value=0)
+
+    num_raters = matrix.sum(axis=1).iloc[0]
+    num_items = len(matrix)
+    num_categories = len(matrix.columns)
+
+    # Calculate expected agreement from the proportion of assignments
+    pj = list(matrix.sum() / (num_raters * num_items))
+    exp_agr = sum([i ** 2 for i in pj])
+
+    # Calculate the extent that raters agree on each item
+    pi = []
+    for i in range(num_items):
+        curr_item = []
+        for j in range(num_categories):
+            curr_item.append(matrix.iloc[i, j] ** 2)
+        pi.append((1 / (num_raters * (num_raters - 1))) * (sum(curr_item) - num_raters))
+    obs_agr = (1 / num_items) * sum(pi)
+
+    return (obs_agr - exp_agr) / (1 - exp_agr)
+
+
+def previous_multi_kappa(data):
+    """The previous pandas implementation of multi_kappa(), looping over every coder pair."""
+    def observed_agreement(coder_a, coder_b):
+        total = 0
+        for item in range(len(coder_a)):
+            for label in range(len(coder_a.columns)):
+                if coder_a.iloc[item, label] == 1 and coder_b.iloc[item, label] == 1:
+                    total += 1
+        return total / len(coder_a)
+
+    def expected_agreement(coder_a, coder_b):
+        a_label_freq = coder_a.sum(axis=0)
+        b_label_freq = coder_b.sum(axis=0)
+        exp_agr = 0
+        for label in range(len(a_label_freq)):
+            exp_agr += (a_label_freq.iloc[label] / len(coder_a)) * (b_label_freq.iloc[label] / len(coder_b))
+        return exp_agr
+
+    # Average the observed and expected agreement over each coder pair
+    coder_pairs = [(a, b) for i, a in enumerate(data.keys()) for b in list(data.keys())[i + 1:]]
+    obs_agr = sum(observed_agreement(data[a], data[b]) for a, b in coder_pairs) / len(coder_pairs)
+    exp_agr = sum(expected_agreement(data[a], data[b]) for a, b in coder_pairs) / len(coder_pairs)
+
+    return (obs_agr - exp_agr) / (1.0 - exp_agr)
+
+
+def time_func(func):
+    start = time.perf_counter()
+    for i in range(num_repeats):
+        value = func()
+    return value, (time.perf_counter() - start) / num_repeats
+
+
+# Random labels, as the same user dictionaries used by the label data functions
+random = np.random.default_rng(0)
+labels = ['label_' + str(i) for i in range(num_labels)]
+assigned = random.integers(0, num_labels, size=(num_coders, num_items))
+example_users = {'coder_' + str(c): pd.DataFrame(np.eye(num_labels, dtype=int)[assigned[c]], columns=labels)
+                 for c in range(num_coders)}
+nltk_stats = AnnotationTask(data=[('coder_' + str(c), str(i), labels[assigned[c, i]])
+                                  for c in range(num_coders) for i in range(num_items)])
+
+print("Coders: " + str(num_coders) + ", items: " + str(num_items) + ", labels: " + str(num_labels))
+for name, func, previous_func, nltk_func in [("multi-Pi", multi_pi, previous_multi_pi, nltk_stats.pi),
+                                             ("multi-kappa", multi_kappa, previous_multi_kappa, nltk_stats.multi_kappa)]:
+    value, mine_time = time_func(lambda: func(example_users))
+    previous_value, previous_time = time_func(lambda: previous_func(example_users))
+    nltk_value, nltk_time = time_func(nltk_func)
+    assert np.isclose(value, previous_value) and np.isclose(value, nltk_value), name + " values do not match"
+
+    print(name + " - mine: {0:.4f} in {1:.2f}ms, previous: {2:.2f}ms ({3:.1f}x), nltk: {4:.2f}ms ({5:.1f}x)".format(
+        value, mine_time * 1000, previous_time * 1000, previous_time / mine_time,
+        nltk_time * 1000, nltk_time / mine_time))
@@ -1,7 +1,6 @@
-import itertools
 import os
+import numpy as np
 import pandas as pd
-from itertools import combinations
 from nltk.metrics.agreement import AnnotationTask
 
 
@@ -90,6 +89,11 @@ def test_agreement_statistics():
     print("beta - " + str(0.8163))
 
     # Test bias
+    print("Expected bias:")
+    print("Bias with example_users - " + str(0.0063))
+    print("Bias with uniform - " + str(0.0))
+    print("Bias with unequal - " + str(0.25))
+
     uniform_path = os.path.join("label_data", "bias_uniform.txt")
     unequal_path = os.path.join("label_data", "bias_unequal.txt")
     b_uniform = get_user_labels(uniform_path)
@@ -111,6 +115,31 @@ def test_agreement_statistics():
     print("beta - {0:.4f}".format(beta(b_unequal, test_distance_func)))
     print("Bias - {0:.4f}".format(bias(b_unequal, test_distance_func)))
 
+    # Check bias against the expected values, for both distance functions and distance matrices
+    for name, example, expected_bias in [("example_users", example_users, 0.0063),
+                                         ("uniform", b_uniform, 0.0), ("unequal", b_unequal, 0.25)]:
+        distance_matrix = create_distance_matrix(list(example[list(example.keys())[0]].columns), test_distance_func)
+        for distance in [test_distance_func, distance_matrix]:
+            assert round(bias(example, distance), 4) == expected_bias, "Bias with " + name + " is not " + str(expected_bias)
+    print("Bias matches expected values.")
+
+    # Check the running statistics give the same values, when coders are added and updated one at a time
+    stat_funcs = [("multi-Pi", multi_pi, AgreementStatistics.multi_pi),
+                  ("multi-kappa", multi_kappa, AgreementStatistics.multi_kappa),
+                  ("alpha", lambda data: alpha(data, test_distance_func),
+                   lambda stats: stats.alpha(test_distance_func)),
+                  ("alpha prime", lambda data: alpha_prime(data, test_distance_func),
+                   lambda stats: stats.alpha_prime(test_distance_func)),
+                  ("beta", lambda data: beta(data, test_distance_func), lambda stats: stats.beta(test_distance_func)),
+                  ("bias", lambda data: bias(data, test_distance_func), lambda stats: stats.bias(test_distance_func))]
+    stats = AgreementStatistics(example_users['a'].columns, len(example_users['a']))
+    for coders in [example_users, {'a': example_users['a'], 'b': b_unequal['b']}, b_unequal,
+                   {'a': b_unequal['a'], 'b': b_unequal['b'], 'c': b_uniform['a']}]:
+        stats.update(coders)
+        for name, func, stats_func in stat_funcs:
+            assert np.isclose(func(coders), stats_func(stats)), "Running " + name + " does not match " + name
+    print("Running statistics match agreement statistics.")
+
 
 def create_coder_cumulative_matrix(data):
     """Gets the sums of labels for all coders in data.
@@ -199,55 +228,65 @@ def create_coder_sum_matrix(data):
     return matrix
 
 
-def pariwise_average(user_data, function):
-    """Calculates an average of a given function over a set of coders pairs.
+def create_coder_tensor(data):
+    """Stacks the coders label dataframes into a single array.
+
+    Args:
+        data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
+                     dialogue and columns are label for coder (1 indicates assigned label).
+
+    Returns:
+        tensor (ndarray): Array of shape (coders x items x labels), items are the number of times the coder assigned
+                          the label to the item.
+    """
+    # Align the columns with the first coder, as adding the dataframes would
+    column_names = data[list(data.keys())[0]].columns
+    return np.stack([frame.reindex(columns=column_names, fill_value=0).to_numpy(dtype=float) for frame in data.values()])
+
+
+def pairwise_average(pair_matrix):
+    """Calculates the average of a (coders x coders) matrix of pairwise values over all coder pairs.
 
     Args:
-        user_data (dict): Dictionary of users dataframes.
-        function (func): The function to apply to all pairs, i.e. observed/expected agreement.
+        pair_matrix (ndarray): Array of shape (coders x coders), i.e. observed/expected agreement of each coder pair.
 
     Returns:
         average (float): The average of all the coder pairs.
     """
-    # Get all the pariwise combinations of users
-    user_combinations = list(combinations(user_data.keys(), 2))
+    # Each pair is only counted once, in the same order as combinations() of the coders
+    return pair_matrix[np.triu_indices(len(pair_matrix), k=1)].mean()
 
-    # Apply function and average
-    total = 0
-    n = 0
-    for pair in user_combinations:
-        total += function(user_data[pair[0]], user_data[pair[1]])
-        n += 1
 
-    return total / n
+def observed_agreement_kappa(tensor):
+    """Calculates the observed agreement between every pair of coders.
 
+    Args:
+        tensor (ndarray): Array of shape (coders x items x labels), from create_coder_tensor().
 
-def observed_agreement_kappa(coder_a, coder_b):
-    """Calculates the observed agreement between two coders."""
-    num_items = len(coder_a)
-    num_labels = len(coder_a.columns)
-    total = 0
-    for item in range(num_items):
-        for label in range(num_labels):
-            if coder_a.iloc[item, label] == 1 and coder_b.iloc[item, label] == 1:
-                total += 1
+    Returns:
+        obs_agr (ndarray): Array of shape (coders x coders), the proportion of items both coders assigned the same label.
+    """
+    num_items = tensor.shape[1]
 
-    return total / num_items
+    # Only labels the coder assigned once to an item count as agreement
+    assigned = (tensor == 1).astype(float)
+    return np.einsum('ail,bil->ab', assigned, assigned) / num_items
 
 
-def expected_agreement_kappa(coder_a, coder_b):
-    """Calculates the expected agreement between two coders label distributions."""
-    exp_agr = 0
-    num_items = len(coder_a)
+def expected_agreement_kappa(tensor):
+    """Calculates the expected agreement between every pair of coders label distributions.
 
-    # Get the frequency distribution of each coder
-    a_lable_freq = coder_a.sum(axis=0)
-    b_lable_freq = coder_b.sum(axis=0)
+    Args:
+        tensor (ndarray): Array of shape (coders x items x labels), from create_coder_tensor().
+
+    Returns:
+        exp_agr (ndarray): Array of shape (coders x coders), the sum of the product of each coders label proportions.
+    """
+    num_items = tensor.shape[1]
 
-    # Calculate the expected agreement for each label
-    for label in range(len(a_lable_freq)):
-        exp_agr += (a_lable_freq.iloc[label] / num_items) * (b_lable_freq.iloc[label] / num_items)
-    return exp_agr
+    # Get the frequency distribution of each coder
+    label_freq = tensor.sum(axis=1) / num_items
+    return label_freq @ label_freq.T
 
 
 def multi_kappa(data):
@@ -266,13 +305,15 @@ def multi_kappa(data):
     Returns:
         multi_kappa (float): The Multi-kappa stat for the given set or dialogue and label type.
     """
+    tensor = create_coder_tensor(data)
+
     # Calculate the pairwise observed agreement
-    obs_agr = pariwise_average(data, observed_agreement_kappa)
+    obs_agr = pairwise_average(observed_agreement_kappa(tensor))
 
     # Calculate the pairwise expected agreement
-    exp_agr = pariwise_average(data, expected_agreement_kappa)
+    exp_agr = pairwise_average(expected_agreement_kappa(tensor))
 
-    return (obs_agr - exp_agr) / (1.0 - exp_agr)
+    return float((obs_agr - exp_agr) / (1.0 - exp_agr))
 
 
 def multi_pi(data):
@@ -292,95 +333,120 @@ def multi_pi(data):
     Returns:
         multi_pi (float): The Multi-pi stat for the given set or dialogue and label type.
     """
-    # Need to get the cumulative labels for all coders in data
-    data = create_coder_cumulative_matrix(data)
+    # Need to get the cumulative labels for all coders in data (items x labels)
+    data = create_coder_tensor(data).sum(axis=0)
 
     # Get the number of annotators
-    num_raters = data.sum(axis=1)[0]
+    num_raters = data[0].sum()
 
     # Get the number of labeled items
     num_items = len(data)
 
-    # Get the number of labels
-    num_categories = len(data.columns)
-
     # Calculate the proportion of assignments
-    pj = list(data.sum() / (num_raters * num_items))
+    pj = data.sum(axis=0) / (num_raters * num_items)
 
     # Calculate expected agreement
-    exp_agr = sum([i ** 2 for i in pj])
+    exp_agr = (pj ** 2).sum()
 
     # Calculate the extent that raters agree on each item
-    pi = []
-    for i in range(num_items):
-        curr_item = []
-        for j in range(num_categories):
-            curr_item.append(data.iloc[i, j] ** 2)
-        pi.append((1 / (num_raters * (num_raters - 1))) * (sum(curr_item) - num_raters))
+    pi = (1 / (num_raters * (num_raters - 1))) * ((data ** 2).sum(axis=1) - num_raters)
 
     # Calculate observed agreements
-    obs_agr = (1 / num_items) * sum(pi)
+    obs_agr = (1 / num_items) * pi.sum()
 
-    return (obs_agr - exp_agr) / (1 - exp_agr)
+    return float((obs_agr - exp_agr) / (1 - exp_agr))
 
 
 def bias(data, dist_func):
-    """Calculates bias of weighted measures according to Artstein, R. and Poesio, M. (2005) Kappa 3 = Alpha (or Beta)"""
+    """Calculates bias of weighted measures according to Artstein, R. and Poesio, M. (2005) Kappa 3 = Alpha (or Beta)
+
+    For coder label probabilities P (coders x labels), C coders and distance matrix D:
+        bias = sum(|C * P^T P - outer(sum(P), sum(P))| * D) / C^2 / (C - 1)
 
-    # Get data as summary matrix
-    sum_matrix = create_coder_sum_matrix(data)
+    Args:
+        data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
+                     dialogue and columns are label for coder (1 indicates assigned label).
+        dist_func (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance),
+                          or a matrix of label distances (see create_distance_matrix()).
+
+    Returns:
+        bias (float): The bias for the given set or dialogue and label type.
+    """
+    # Get data as summary matrix (coders x labels)
+    sum_matrix = create_coder_tensor(data).sum(axis=1)
+    distance_matrix = create_distance_matrix(list(data[list(data.keys())[0]].columns), dist_func)
 
     # Get useful vars
     num_coders = len(sum_matrix)
-    labels = list(sum_matrix.columns.values)
-    num_items = sum_matrix.iloc[0].sum(axis=0)
-
-    # All values need to be divided by num_items, so easier to do it with the dataframe
-    sum_matrix = sum_matrix.apply(lambda x: x / num_items)
-
-    # Calculate bias
-    bias_val = 0
-    # For each label pair
-    for label_a in labels:
-        for label_b in labels:
-            label_pair = (label_a, label_b)
-
-            # Individual and paired coder probs
-            lhs, rhs, = 0, 0
-            # For each coder get sum of probs for all label pairs
-            for coder in sum_matrix.index.tolist():
-                lhs += num_coders * sum_matrix.loc[coder, label_pair[0]] * sum_matrix.loc[coder, label_pair[1]]
-            # lhs *= num_coders
-
-            # For each pair of coders get sum of probs for all label pairs
-            for coder_a in sum_matrix.index.tolist():
-                for coder_b in sum_matrix.index.tolist():
-                    rhs += sum_matrix.loc[coder_a, label_pair[0]] * sum_matrix.loc[coder_b, label_pair[1]]
-
-            # 1/num_coders^2 * (lhs - rhs) * distance for label pair
-            bias_val += (1 / num_coders**2) * (abs(lhs - rhs) * dist_func(label_pair[0], label_pair[1]))
+    num_items = sum_matrix[0].sum()
+
+    # All values need to be divided by num_items
+    probs = sum_matrix / num_items
+
+    # Individual coder probs for each label pair, summed over coders
+    lhs = num_coders * (probs.T @ probs)
+    # Paired coder probs for each label pair, summed over all pairs of coders
+    label_probs = probs.sum(axis=0)
+    rhs = np.outer(label_probs, label_probs)
+
+    # 1/num_coders^2 * (lhs - rhs) * distance for each label pair
+    bias_val = (np.abs(lhs - rhs) * distance_matrix).sum() / num_coders ** 2
 
     bias_val /= num_coders - 1
-    return bias_val
+    return float(bias_val)
 
 
-def observed_disagreement(items, num_ratings, distance):
-    """Observed disagreement for alpha/alpha prime and beta."""
-    obs_dis_agr = 0.0
-    for item in items:
+def create_item_label_counts(data):
+    """Counts the number of coders that assigned each label to each item.
+
+    Each coder is counted once per item, for the label create_reliability_matrix() would give them.
+
+    Args:
+        data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
+                     dialogue and columns are label for coder (1 indicates assigned label).
+
+    Returns:
+        item_counts (ndarray): Array of shape (items x labels), items are the number of coders that assigned the label.
+    """
+    tensor = create_coder_tensor(data)
+    num_labels = tensor.shape[2]
+
+    # Get the label each coder assigned to each item and count them
+    return np.eye(num_labels)[tensor.argmax(axis=2)].sum(axis=0)
+
+
+def create_distance_matrix(labels, distance):
+    """Creates a matrix of the distances between every pair of labels.
+
+    Args:
+        labels (list): List of labels, in the order of the returned matrix rows and columns.
+        distance (func, DataFrame or ndarray): Function which returns the distance between two labels, a DataFrame
+            of label distances with labels as the index and columns, or an array already in the order of labels.
+
+    Returns:
+        matrix (ndarray): Array of shape (labels x labels), items are the distance between the labels.
+    """
+    if isinstance(distance, pd.DataFrame):
+        return distance.loc[labels, labels].to_numpy(dtype=float)
+    if isinstance(distance, np.ndarray):
+        return distance.astype(float)
+    return np.array([[distance(label_a, label_b) for label_b in labels] for label_a in labels], dtype=float)
 
-        item_distances = sum(distance(i, j) for i in item for j in item)
-        obs_dis_agr += item_distances / float(len(item) - 1)
 
-    return obs_dis_agr / float(num_ratings)
+def observed_disagreement(item_counts, num_ratings, distance_matrix):
+    """Observed disagreement for alpha/alpha prime and beta."""
+    num_coders = item_counts[0].sum()
+
+    # Sum the distances between every pair of ratings within each item
+    item_distances = np.einsum('il,lm,im->i', item_counts, distance_matrix, item_counts)
+    return (item_distances / float(num_coders - 1)).sum() / float(num_ratings)
 
 
-def expected_disagreement_alpha(items, num_ratings, distance):
+def expected_disagreement_alpha(item_counts, num_ratings, distance_matrix):
     """Coder sums / num_ratings * (num_ratings - 1)."""
-    exp_dis_agr = 0.0
-    for item_a in items:
-        for item_b in items:
-            exp_dis_agr += sum(distance(i, j) for i in item_a for j in item_b)
+    # Sum the distances between every pair of ratings, without regard to items
+    label_counts = item_counts.sum(axis=0)
+    exp_dis_agr = label_counts @ distance_matrix @ label_counts
 
     exp_dis_agr /= float(num_ratings * (num_ratings - 1))
     return exp_dis_agr
@@ -396,37 +462,33 @@ def alpha(data, distance):
     Args:
         data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
                      dialogue and columns are label for coder (1 indicates assigned label).
-        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance).
+        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance),
+                         or a matrix of label distances (see create_distance_matrix()).
 
     Returns:
         alpha (float): The Alpha stat for the given set or dialogue and label type.
     """
-    # Create a matrix of all of the labels the coders selected (utterances x coders)
-    matrix = create_reliability_matrix(data)
-    # Convert to 2d array
-    items = matrix.values.tolist()
+    # Count the labels the coders selected for each item (utterances x labels)
+    item_counts = create_item_label_counts(data)
+    distance_matrix = create_distance_matrix(list(data[list(data.keys())[0]].columns), distance)
 
     # Number of pairable values (num utterances x num coders)
-    num_ratings = sum(len(item) for item in items)
+    num_ratings = item_counts.sum()
 
     # Calculate observed disagreement
-    obs_dis_agr = observed_disagreement(items, num_ratings, distance)
+    obs_dis_agr = observed_disagreement(item_counts, num_ratings, distance_matrix)
 
     # Calculate expected disagreement
-    exp_dis_agr = expected_disagreement_alpha(items, num_ratings, distance)
+    exp_dis_agr = expected_disagreement_alpha(item_counts, num_ratings, distance_matrix)
 
-    return 1.0 - obs_dis_agr / exp_dis_agr if (obs_dis_agr and exp_dis_agr) else 1.0
+    return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
 
 
-def expected_disagreement_alpha_prime(items, num_ratings, distance):
+def expected_disagreement_alpha_prime(item_counts, num_ratings, distance_matrix):
     """Coder sums / num_ratings."""
-    exp_dis_agr = 0.0
-    for item_a in items:
-        item_sum = 0.0
-        for item_b in items:
-            item_sum += sum(distance(i, j) for i in item_a for j in item_b)
-
-        exp_dis_agr += item_sum / float(num_ratings)
+    # Sum the distances between every pair of ratings, without regard to items
+    label_counts = item_counts.sum(axis=0)
+    exp_dis_agr = label_counts @ distance_matrix @ label_counts / float(num_ratings)
 
     exp_dis_agr /= float(num_ratings)
 
@@ -443,52 +505,36 @@ def alpha_prime(data, distance):
     Args:
         data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
                      dialogue and columns are label for coder (1 indicates assigned label).
-        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance).
+        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance),
+                         or a matrix of label distances (see create_distance_matrix()).
 
     Returns:
         alpha_prime (float): The Alpha stat for the given set or dialogue and label type.
     """
-    # Create a matrix of all of the labels the coders selected (items x coders)
-    matrix = create_reliability_matrix(data)
-    # Convert to 2d array
-    items = matrix.values.tolist()
+    # Count the labels the coders selected for each item (items x labels)
+    item_counts = create_item_label_counts(data)
+    distance_matrix = create_distance_matrix(list(data[list(data.keys())[0]].columns), distance)
 
     # Number of pairable values (coders x items)
-    num_ratings = sum(len(item) for item in items)
+    num_ratings = item_counts.sum()
 
     # Calculate observed disagreement
-    obs_dis_agr = observed_disagreement(items, num_ratings, distance)
+    obs_dis_agr = observed_disagreement(item_counts, num_ratings, distance_matrix)
 
     # Calculate expected disagreement
-    exp_dis_agr = expected_disagreement_alpha_prime(items, num_ratings, distance)
+    exp_dis_agr = expected_disagreement_alpha_prime(item_counts, num_ratings, distance_matrix)
 
-    return 1.0 - obs_dis_agr / exp_dis_agr if (obs_dis_agr and exp_dis_agr) else 1.0
+    return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
 
 
-def expected_disagreement_beta(items_matrix, num_items, distance):
+def expected_disagreement_beta(items_matrix, num_items, distance_matrix):
     """Coder sums / num_items."""
 
-    # Get a list of the labels so we can get the index
-    labels = list(items_matrix.columns.values)
-
-    # All values need to be divided by num_items, so easier to do it with the dataframe
-    items_matrix = items_matrix.apply(lambda x: x / num_items)
-
-    # Get the first row and then all other rows to lists
-    items = items_matrix.values.tolist()
-    first_row = items[0]
-    other_rows = [items[i][:] for i in range(1, len(items))]
-
-    # Iterate over first row and multiply by all other values (and distance between labels)
-    exp_dis_agr = 0.0
-    for curr in range(len(first_row)):
-        current_val = first_row[curr]
-        current_label = labels[curr]
-        for row in range(len(other_rows)):
-            for row_col in range(len(other_rows[row])):
-                exp_dis_agr += current_val * other_rows[row][row_col] * distance(current_label, labels[row_col])
+    # All values need to be divided by num_items
+    items = items_matrix / num_items
 
-    return exp_dis_agr
+    # Multiply the first coders values by all other coders values (and distance between labels)
+    return items[0] @ distance_matrix @ items[1:].sum(axis=0)
 
 
 def beta(data, distance):
@@ -500,26 +546,235 @@ def beta(data, distance):
     Args:
         data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
                      dialogue and columns are label for coder (1 indicates assigned label).
-        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance).
+        distance (func): Function which returns the distance between two labels (0=Min distance, 1=Max distance),
+                         or a matrix of label distances (see create_distance_matrix()).
 
     Returns:
         beta (float): The Alpha stat for the given set or dialogue and label type.
     """
 
-    # Create a matrix of all of the labels the coders selected (items x coders)
-    matrix = create_reliability_matrix(data)
-    # Convert to 2d array
-    items = matrix.values.tolist()
+    # Count the labels the coders selected for each item (items x labels)
+    item_counts = create_item_label_counts(data)
+    distance_matrix = create_distance_matrix(list(data[list(data.keys())[0]].columns), distance)
 
     # Number of pairable values (coders x items)
-    num_ratings = sum(len(item) for item in items)
+    num_ratings = item_counts.sum()
 
     # Calculate observed disagreement
-    obs_dis_agr = observed_disagreement(items, num_ratings, distance)
+    obs_dis_agr = observed_disagreement(item_counts, num_ratings, distance_matrix)
 
     # Calculate expected disagreement
-    sum_matrix = create_coder_sum_matrix(data)  # Easier to do with a summary matrix
+    sum_matrix = create_coder_tensor(data).sum(axis=1)  # Easier to do with a summary matrix (coders x labels)
+
+    exp_dis_agr = expected_disagreement_beta(sum_matrix, len(item_counts), distance_matrix)
+
+    return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
+
 
-    exp_dis_agr = expected_disagreement_beta(sum_matrix, len(matrix), distance)
+class AgreementStatistics:
+    """Running sufficient statistics of the coders labels for one set or dialogue and label type.
 
-    return 1.0 - obs_dis_agr / exp_dis_agr if (obs_dis_agr and exp_dis_agr) else 1.0
+    Coders can be added, updated or removed one at a time, in O(items x labels), and every agreement coefficient
+    is then derived from the statistics in O(labels x labels), without the coders label dataframes.
+    Gives the same values as multi_pi(), multi_kappa(), alpha(), alpha_prime(), beta() and bias().
+
+    Statistics kept:
+        label_sums (items x labels): Sum of the coders labels, for multi-pi.
+        assigned_sums (items x labels): Number of coders that assigned each label once, for multi-kappa.
+        item_counts (items x labels): Number of coders that assigned each label, as create_item_label_counts().
+        coincidences (labels x labels): Coincidence matrix of the item_counts (item_counts^T item_counts),
+                                        for the observed disagreement.
+        marginals (dict): Each coders sum of labels (labels), for multi-kappa, beta and bias.
+
+    Args:
+        labels (list): List of labels, the columns of each coders dataframe.
+        num_items (int): Number of items (utterances) in the set or dialogue.
+    """
+    def __init__(self, labels, num_items):
+        self.labels = list(labels)
+        self.num_items = num_items
+        num_labels = len(self.labels)
+
+        # Each coders labels (items x labels), so their statistics can be removed when they are updated
+        self.coders = dict()
+
+        self.label_sums = np.zeros((num_items, num_labels))
+        self.label_sums_sq = 0.0
+
+        self.assigned_sums = np.zeros((num_items, num_labels))
+        self.assigned_sums_sq = 0.0
+        self.assigned_sq = 0.0
+
+        self.item_counts = np.zeros((num_items, num_labels))
+        self.coincidences = np.zeros((num_labels, num_labels))
+
+        self.marginals = dict()
+        self.marginal_sums = np.zeros(num_labels)
+        self.marginals_sq = 0.0
+        self.marginal_outer_sums = np.zeros((num_labels, num_labels))
+
+    @classmethod
+    def from_data(cls, data):
+        """Creates the statistics for a dictionary of coders label dataframes, as used by multi_pi() etc."""
+        first = data[list(data.keys())[0]]
+        return cls(first.columns, len(first)).update(data)
+
+    @property
+    def num_coders(self):
+        return len(self.coders)
+
+    def add_coder(self, coder_id, frame):
+        """Adds a coders label dataframe (items x labels), replacing their previous labels if they were added.
+
+        Only the label columns of frame are used, and they are copied, so the frame can be changed and added again.
+        """
+        coder_labels = frame.reindex(columns=self.labels, fill_value=0).to_numpy(dtype=float)
+        if coder_labels.shape[0] != self.num_items:
+            raise ValueError("Coder " + str(coder_id) + " has " + str(coder_labels.shape[0]) + " items, expected " +
+                             str(self.num_items) + ".")
+
+        # Only update the statistics if their labels have changed
+        if coder_id in self.coders and np.array_equal(self.coders[coder_id], coder_labels):
+            return
+        if coder_id in self.coders:
+            self.remove_coder(coder_id)
+
+        self.coders[coder_id] = coder_labels
+        self._update_statistics(coder_labels, 1)
+
+    def remove_coder(self, coder_id):
+        """Removes a coders labels from the statistics."""
+        self._update_statistics(self.coders.pop(coder_id), -1)
+
+    def update(self, data):
+        """Updates the statistics to the coders in data, only adding or removing the coders that have changed.
+
+        Args:
+            data (dict): Dictionary of Dataframes where keys user_id. Dataframe rows are utterances for the set or
+                         dialogue and columns are label for coder (1 indicates assigned label).
+
+        Returns:
+            self (AgreementStatistics): The updated statistics.
+        """
+        for coder_id in [coder_id for coder_id in self.coders if coder_id not in data]:
+            self.remove_coder(coder_id)
+        for coder_id, frame in data.items():
+            self.add_coder(coder_id, frame)
+
+        # Beta and bias depend on which coder is first, so keep the same order as data
+        self.coders = {coder_id: self.coders[coder_id] for coder_id in data}
+        return self
+
+    def _update_statistics(self, coder_labels, sign):
+        """Adds (sign=1) or removes (sign=-1) one coders labels from the statistics in O(items x labels)."""
+        if sign < 0:
+            self.label_sums -= coder_labels
+        self.label_sums_sq += sign * (2 * (self.label_sums * coder_labels).sum() + (coder_labels ** 2).sum())
+        if sign > 0:
+            self.label_sums += coder_labels
+
+        # Only labels the coder assigned once to an item count as agreement
+        assigned = (coder_labels == 1).astype(float)
+        if sign < 0:
+            self.assigned_sums -= assigned
+        self.assigned_sums_sq += sign * (2 * (self.assigned_sums * assigned).sum() + assigned.sum())
+        self.assigned_sq += sign * assigned.sum()
+        if sign > 0:
+            self.assigned_sums += assigned
+
+        # The coder is counted once per item, for the label create_reliability_matrix() would give them
+        label_index = coder_labels.argmax(axis=1)
+        if sign < 0:
+            self.item_counts[np.arange(self.num_items), label_index] -= 1
+        # Coincidences with the other coders, (item_counts^T one_hot) is the sum of each labels item_counts rows
+        cross = np.zeros_like(self.coincidences)
+        np.add.at(cross, label_index, self.item_counts)
+        own = np.diag(np.bincount(label_index, minlength=len(self.labels)).astype(float))
+        self.coincidences += sign * (cross + cross.T + own)
+        if sign > 0:
+            self.item_counts[np.arange(self.num_items), label_index] += 1
+
+        marginal = coder_labels.sum(axis=0)
+        self.marginal_sums += sign * marginal
+        self.marginals_sq += sign * (marginal @ marginal)
+        self.marginal_outer_sums += sign * np.outer(marginal, marginal)
+
+    def _first_marginal(self):
+        return self.coders[next(iter(self.coders))].sum(axis=0)
+
+    def multi_pi(self):
+        """Multi-pi, see multi_pi()."""
+        num_raters = self.label_sums[0].sum()
+
+        # Calculate expected agreement from the proportion of assignments
+        pj = self.label_sums.sum(axis=0) / (num_raters * self.num_items)
+        exp_agr = (pj ** 2).sum()
+
+        # Calculate observed agreement, the extent that raters agree on each item
+        pi_sum = (self.label_sums_sq - num_raters * self.num_items) / (num_raters * (num_raters - 1))
+        obs_agr = pi_sum / self.num_items
+
+        return float((obs_agr - exp_agr) / (1 - exp_agr))
+
+    def multi_kappa(self):
+        """Multi-kappa, see multi_kappa()."""
+        num_pairs = self.num_coders * (self.num_coders - 1) / 2
+
+        # Sum over coder pairs is half the square of the sums, without each coder with themselves
+        obs_agr = (self.assigned_sums_sq - self.assigned_sq) / 2 / self.num_items / num_pairs
+        exp_agr = (self.marginal_sums @ self.marginal_sums - self.marginals_sq) / 2 / self.num_items ** 2 / num_pairs
+
+        return float((obs_agr - exp_agr) / (1.0 - exp_agr))
+
+    def observed_disagreement(self, distance_matrix):
+        """Observed disagreement for alpha/alpha prime and beta, see observed_disagreement()."""
+        num_coders = self.item_counts[0].sum()
+        num_ratings = self.item_counts.sum()
+        return (self.coincidences * distance_matrix).sum() / float(num_coders - 1) / float(num_ratings)
+
+    def alpha(self, distance):
+        """Krippendorff's alpha, see alpha()."""
+        distance_matrix = create_distance_matrix(self.labels, distance)
+        num_ratings = self.item_counts.sum()
+        label_counts = self.item_counts.sum(axis=0)
+
+        obs_dis_agr = self.observed_disagreement(distance_matrix)
+        exp_dis_agr = label_counts @ distance_matrix @ label_counts / float(num_ratings * (num_ratings - 1))
+
+        return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
+
+    def alpha_prime(self, distance):
+        """Alpha prime, see alpha_prime()."""
+        distance_matrix = create_distance_matrix(self.labels, distance)
+        num_ratings = self.item_counts.sum()
+        label_counts = self.item_counts.sum(axis=0)
+
+        obs_dis_agr = self.observed_disagreement(distance_matrix)
+        exp_dis_agr = label_counts @ distance_matrix @ label_counts / float(num_ratings) / float(num_ratings)
+
+        return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
+
+    def beta(self, distance):
+        """Beta, see beta()."""
+        distance_matrix = create_distance_matrix(self.labels, distance)
+
+        # The first coders proportions by all other coders proportions (and distance between labels)
+        first = self._first_marginal()
+        obs_dis_agr = self.observed_disagreement(distance_matrix)
+        exp_dis_agr = (first / self.num_items) @ distance_matrix @ ((self.marginal_sums - first) / self.num_items)
+
+        return float(1.0 - obs_dis_agr / exp_dis_agr) if (obs_dis_agr and exp_dis_agr) else 1.0
+
+    def bias(self, distance):
+        """Bias of the weighted measures, see bias()."""
+        distance_matrix = create_distance_matrix(self.labels, distance)
+        num_coders = self.num_coders
+        num_items = self._first_marginal().sum()
+
+        # Individual coder probs, and paired coder probs, for each label pair
+        lhs = num_coders * self.marginal_outer_sums / num_items ** 2
+        rhs = np.outer(self.marginal_sums, self.marginal_sums) / num_items ** 2
+
+        bias_val = (np.abs(lhs - rhs) * distance_matrix).sum() / num_coders ** 2
+        bias_val /= num_coders - 1
+        return float(bias_val)
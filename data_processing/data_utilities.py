@@ -1,7 +1,14 @@
 import os
 import json
+import hashlib
+import sqlite3
+import numpy as np
 import pandas as pd
 import pickle
+from array import array
+# The annotation tools storage, so users are loaded the same way the server saves them
+import storage
+import utilities as utils
 
 
 def load_json_data(path):
@@ -10,9 +17,12 @@ def load_json_data(path):
     return data
 
 
-def save_json_data(path, data):
+def save_json_data(path, data, pretty=False):
     with open(path, 'w+') as file:
-        json.dump(data, file, sort_keys=False, indent=4, separators=(',', ': '))
+        if pretty:
+            json.dump(data, file, sort_keys=False, indent=4, separators=(',', ': '))
+        else:
+            json.dump(data, file, separators=(',', ':'))
 
 
 def load_dataframe(path, multi_index=False, num_header_rows=1):
@@ -40,17 +50,119 @@ def save_pickle(path, data):
 
 def load_user_data(path):
     """Loads each of the user .json files as a dictionary and saves to a list."""
+    return list(iter_user_data(path))
+
+
+def iter_user_data(path):
+    """Yields each of the users in the user data directory as a dictionary, one user at a time.
+
+    Users are loaded from the same files, directories, journals and database as load_user_data(), and in the same order,
+    but only the current user is held in memory so large annotation sets can be processed in a single pass.
+
+    Args:
+        path (str): Path to the user data directory.
+
+    Yields:
+        user (dict): User data dictionary, in the same format as the user .json files.
+    """
+    # Users in the database replace any older .json file for the same user
+    database_path = os.path.join(path, 'user_dialogues.db')
+    database_ids = set()
+    if os.path.isfile(database_path):
+        connection = sqlite3.connect(database_path)
+        database_ids = set(storage.load_database_user_ids(connection))
+        connection.close()
+
     # Get all the user data file names
     user_files = os.listdir(path)
 
-    # Load the user json as dictionary and save to a list
-    user_data = []
+    # Load the user json as a dictionary
     for file in user_files:
+        # Users saved to the database are loaded below
+        if file.endswith('.db') or file.endswith('.db-wal') or file.endswith('.db-shm'):
+            continue
+
+        # Users saved per dialogue have a directory instead of a single file
+        if os.path.isdir(os.path.join(path, file)):
+            user = load_user_dialogues(os.path.join(path, file))
+            if user['user_id'] not in database_ids:
+                yield user
+            continue
+
+        # Only load the .json files, journals are applied to their user below
+        if not file.endswith('.json'):
+            continue
         file_name = file.split('.')[0]
-        file_name += ".json"
-        user_data.append(load_json_data(os.path.join(path, file_name)))
+        # Skip old single files for users that have since been migrated to a directory
+        if os.path.isdir(os.path.join(path, file_name)):
+            continue
+        user = load_json_data(os.path.join(path, file_name + ".json"))
+        if user['user_id'] in database_ids:
+            continue
+
+        # Apply any saves that have not yet been compacted into the users file
+        if os.path.isfile(os.path.join(path, file_name + ".journal")):
+            apply_user_journal(user, os.path.join(path, file_name + ".journal"))
+        yield user
+
+    if database_ids:
+        yield from iter_user_database(database_path)
+
 
-    return user_data
+def load_user_database(path, sets=None, dialogues=None):
+    """Loads users from the annotation tools SQLite database as a list of user dictionaries.
+
+    Only the required rows are read, so the analysis can query a subset of the data.
+
+    Args:
+        path (str): Path to the user_dialogues.db file.
+        sets (list): List of dialogue sets to load users for. Default=None loads all sets.
+        dialogues (list): List of dialogue ids to load for each user. Default=None loads all dialogues.
+
+    Returns:
+        user_data (list): List of user data dictionaries, in the same format as the user .json files.
+    """
+    return list(iter_user_database(path, sets, dialogues))
+
+
+def iter_user_database(path, sets=None, dialogues=None):
+    """Yields users from the annotation tools SQLite database one user dictionary at a time.
+
+    Args:
+        path (str): Path to the user_dialogues.db file.
+        sets (list): List of dialogue sets to load users for. Default=None loads all sets.
+        dialogues (list): List of dialogue ids to load for each user. Default=None loads all dialogues.
+
+    Yields:
+        user (dict): User data dictionary, in the same format as the user .json files.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        for user_id in storage.load_database_user_ids(connection, sets):
+            yield storage.load_database_user(connection, user_id, dialogues)
+    finally:
+        connection.close()
+
+
+def load_user_dialogues(path):
+    """Loads a users manifest and dialogue .json files into the same dictionary as a single user .json file."""
+    manifest = load_json_data(os.path.join(path, 'manifest.json'))
+
+    # Load the dialogues in the order they are listed in the manifest
+    user = {key: value for key, value in manifest.items() if key != 'dialogue_ids'}
+    user['dialogues'] = [load_json_data(os.path.join(path, dialogue_id + '.json')) for dialogue_id in manifest['dialogue_ids']]
+
+    return user
+
+
+def apply_user_journal(user, path):
+    """Applies the saved dialogue and navigation records in a users .journal file to their user dictionary."""
+    # Incomplete records, e.g. if the server stopped mid-write, are skipped the same way as when the user logs in
+    journal_dir, file_name = os.path.split(os.path.splitext(path)[0])
+    records = utils.load_journal_data(os.path.join(journal_dir, ''), file_name)
+    if records is False:
+        return user
+    return utils.apply_journal_records(user, records)
 
 
 def load_labels(labels_dir, user_data):
@@ -85,6 +197,218 @@ def load_labels(labels_dir, user_data):
     return labels
 
 
+class UserDataTable:
+    """Flattens user data into a single long-format table, with one row per (user, set, dialogue, utterance index).
+
+    Each user is added with add_user(), e.g. from iter_user_data(), and only the values needed for the analysis are kept.
+    The label, timing and rating data functions are groupby/pivot views over the table, so the users are only read once.
+
+    While users are added each row is only a few integers in compact arrays. The ids, speakers, texts and labels are
+    stored once each, with each row holding their code, so e.g. an utterance's text is stored once for all of the users
+    that annotated it, rather than once per user.
+
+    Table columns:
+        user_index (int): Order the user was added in.
+        user_id, dataset (category): The users id and the set they annotated.
+        dialogue_index (int): Order the user annotated the dialogue in.
+        dialogue_id (category): The dialogues id.
+        utterance_index (int): Index of the utterance in the dialogue.
+        speaker, text (category): The utterances speaker and text.
+        ap_label, da_label, ap_type (category): The assigned AP, DA and AP-type labels.
+        time (int): Time spent annotating the utterance in milliseconds.
+        da_rating, ap_rating, ap_type_rating (Int64): The dialogues question ratings, or <NA> if unanswered.
+    """
+    column_names = ['user_index', 'user_id', 'dataset', 'dialogue_index', 'dialogue_id', 'utterance_index', 'speaker',
+                    'text', 'ap_label', 'da_label', 'ap_type', 'time', 'da_rating', 'ap_rating', 'ap_type_rating']
+    category_columns = ['user_id', 'dataset', 'dialogue_id', 'speaker', 'text', 'ap_label', 'da_label', 'ap_type']
+    rating_columns = ['da_rating', 'ap_rating', 'ap_type_rating']
+
+    def __init__(self):
+        # Times can be larger than 32 bit, every other column is a small int or category code
+        self.columns = {name: array('q' if name == 'time' else 'i') for name in self.column_names}
+        # Code of each unique value of the category columns, in the order they were first added
+        self.categories = {name: dict() for name in self.category_columns}
+        self.num_users = 0
+        self.table = None
+
+    def get_code(self, name, value):
+        """Returns the code of a category column value, adding it if it is new."""
+        codes = self.categories[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def add_user(self, user):
+        """Adds a row for each of a user data dictionary's utterances."""
+        columns = self.columns
+        get_code = self.get_code
+        user_code = get_code('user_id', user['user_id'])
+        dataset_code = get_code('dataset', user['dataset'])
+        for dialogue_index, dialogue in enumerate(user['dialogues']):
+            dialogue_code = get_code('dialogue_id', dialogue['dialogue_id'])
+
+            # Dialogues that have not been rated have no questions, they are stored as -1 and are <NA> in the table
+            ratings = [int(question) for question in dialogue['questions'][:3]]
+            ratings += [-1] * (3 - len(ratings))
+
+            for utterance_index, utt in enumerate(dialogue['utterances']):
+                columns['user_index'].append(self.num_users)
+                columns['user_id'].append(user_code)
+                columns['dataset'].append(dataset_code)
+                columns['dialogue_index'].append(dialogue_index)
+                columns['dialogue_id'].append(dialogue_code)
+                columns['utterance_index'].append(utterance_index)
+                columns['speaker'].append(get_code('speaker', utt['speaker']))
+                columns['text'].append(get_code('text', utt['text']))
+                columns['ap_label'].append(get_code('ap_label', utt['ap_label']))
+                columns['da_label'].append(get_code('da_label', utt['da_label']))
+                columns['ap_type'].append(get_code('ap_type', utt['ap_label'] + '-' + utt['da_label']))
+                columns['time'].append(utt['time'])
+                columns['da_rating'].append(ratings[0])
+                columns['ap_rating'].append(ratings[1])
+                columns['ap_type_rating'].append(ratings[2])
+
+        self.num_users += 1
+        self.table = None
+
+    def add_users(self, user_data):
+        """Adds each user from an iterable of user data dictionaries, such as iter_user_data()."""
+        for user in user_data:
+            self.add_user(user)
+        return self
+
+    def get_categorical(self, name):
+        """Returns a category column as a Categorical, with its categories sorted so it sorts the same as strings."""
+        values = list(self.categories[name])
+        order = sorted(range(len(values)), key=values.__getitem__)
+        new_codes = np.empty(len(values), dtype='int64')
+        new_codes[order] = np.arange(len(values))
+        codes = new_codes[np.asarray(self.columns[name], dtype='int64')]
+        return pd.Categorical.from_codes(codes, [values[i] for i in order])
+
+    def get_table(self):
+        """Returns the table as a DataFrame, the strings are stored as categories."""
+        if self.table is None:
+            table = dict()
+            for name in self.column_names:
+                if name in self.categories:
+                    table[name] = self.get_categorical(name)
+                elif name in self.rating_columns:
+                    ratings = np.asarray(self.columns[name], dtype='int64')
+                    table[name] = pd.arrays.IntegerArray(ratings, ratings < 0)
+                else:
+                    table[name] = np.asarray(self.columns[name], dtype='int64')
+            self.table = pd.DataFrame(table)
+        return self.table
+
+    def get_labels(self, labels_dir):
+        """Returns the same labels dictionary as load_labels() for the users that have been added."""
+        labels = load_labels(labels_dir, [])
+        labels['ap_type'] = sorted(self.categories['ap_type'])
+        return labels
+
+
+def get_user_table(user_data):
+    """Returns the long-format user data table for a list of user data dictionaries, a UserDataTable or a table."""
+    if isinstance(user_data, pd.DataFrame):
+        return user_data
+    if isinstance(user_data, UserDataTable):
+        return user_data.get_table()
+    return UserDataTable().add_users(user_data).get_table()
+
+
+class FragmentCache:
+    """Content-addressed cache of the per-set and per-dialogue fragments of the label, timing and rating data.
+
+    Each fragment is saved as '<key>.pkl' in cache_dir, where the key is a hash of:
+        - the code version, i.e. the source of data_utilities.py and the modules in source_files,
+        - params (such as the labels) that every fragment depends on,
+        - the fragment's own key parts (e.g. its view and set or dialogue name),
+        - the rows of the user data table the fragment is created from.
+    So adding or changing an annotator's file only recomputes the sets and dialogues they annotated,
+    and a change to the code or labels never loads a stale fragment. The user_index column is not hashed,
+    so a new annotator does not change the fragments of the users added after them.
+    Fragments whose key changes are no longer used, so remove_unused() deletes any not used since the cache was
+    created, once all of the fragments have been got.
+
+    Args:
+        cache_dir (str): Directory to save the fragments in, created if it does not exist.
+        source_files (list): Paths to the source files of the modules that create the fragments.
+        params: Any other JSON serialisable values the fragments depend on.
+    """
+    def __init__(self, cache_dir, source_files, *params):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Every key starts from the code version and params
+        self.base_hash = hashlib.sha256()
+        for source_file in [__file__] + list(source_files):
+            with open(source_file, 'rb') as file:
+                self.base_hash.update(file.read())
+        self.base_hash.update(json.dumps(params, default=str).encode('utf-8'))
+
+        # Number of fragments loaded and computed, and the file names of the fragments used
+        self.hits = 0
+        self.misses = 0
+        self.used = set()
+
+    def get_key(self, rows, *key_parts):
+        """Returns the key for a fragment created from rows of the user data table."""
+        key_hash = self.base_hash.copy()
+        key_hash.update(json.dumps(key_parts, default=str).encode('utf-8'))
+
+        # Hash the rows content and order, but not the users position in the table
+        rows = rows.drop(columns='user_index', errors='ignore')
+        key_hash.update(json.dumps(list(rows.columns)).encode('utf-8'))
+        key_hash.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+        return key_hash.hexdigest()
+
+    def get(self, rows, compute, *key_parts):
+        """Returns the cached fragment for rows and key_parts, or computes it with compute(rows) and saves it."""
+        path = os.path.join(self.cache_dir, self.get_key(rows, *key_parts) + '.pkl')
+        self.used.add(os.path.basename(path))
+        if os.path.exists(path):
+            try:
+                fragment = load_pickle(path)
+                self.hits += 1
+                return fragment
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+        fragment = compute(rows)
+        self.misses += 1
+
+        # Write to a temporary file first, so a fragment is never partly written
+        temp_path = path + '.' + str(os.getpid()) + '.tmp'
+        save_pickle(temp_path, fragment)
+        os.replace(temp_path, path)
+        return fragment
+
+    def remove_unused(self):
+        """Deletes the fragments in cache_dir that have not been used since the cache was created.
+
+        Returns:
+            removed (int): Number of fragments deleted.
+        """
+        removed = 0
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.pkl') and file_name not in self.used:
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def get_cached_fragment(cache, rows, compute, *key_parts):
+    """Returns compute(rows) from cache, a FragmentCache, or computes it if cache is None."""
+    if cache is None:
+        return compute(rows)
+    return cache.get(rows, compute, *key_parts)
+
+
 def dataframe_wide_to_long(data):
     """Utility function for reshaping dataframes for plotting.
     Converts from 'wide' to 'long' format, where each observation is on a separate row.
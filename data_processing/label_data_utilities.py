@@ -1,39 +1,44 @@
 import os
+import numpy as np
 import pandas as pd
 import seaborn as sns
 from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from scipy.stats import levene, shapiro
-from data_processing.agreement_statistics import multi_pi, multi_kappa, alpha, alpha_prime, beta, bias
-from data_processing.data_utilities import load_dataframe, save_dataframe, load_pickle, save_pickle, dataframe_wide_to_long
+from data_processing.agreement_statistics import AgreementStatistics
+from data_processing.data_utilities import load_dataframe, save_dataframe, save_pickle, dataframe_wide_to_long, \
+    get_user_table, FragmentCache, get_cached_fragment, iter_user_data, UserDataTable
+from data_processing.label_distance_utilities import LabelRegistry
 from data_processing.plot_utilities import plot_facetgrid, plot_dist_chart
 from data_processing.stats_utilites import t_test, multi_t_test, anova_test, tukey_hsd, chi_squared, jensen_shannnon
 
 # Load the distance matrices for weighted agreement stats
 label_data_dir = 'label_data'
 try:
-    da_distance_matrix = load_dataframe(os.path.join(label_data_dir, "da_distance_matrix.csv"))
-    ap_distance_matrix = load_dataframe(os.path.join(label_data_dir, "ap_distance_matrix.csv"))
-    ap_type_distance_matrix = load_dataframe(os.path.join(label_data_dir, "ap_type_distance_matrix.csv"))
-    # Postfix only distance matrices
-    ap_postfix_only_distance_matrix = load_dataframe(os.path.join(label_data_dir, "ap_postfix_only_distance_matrix.csv"))
-    ap_type_postfix_only_distance_matrix = load_dataframe(os.path.join(label_data_dir, "ap_type_postfix_only_distance_matrix.csv"))
+    # Includes the postfix only distance matrices
+    label_registry = LabelRegistry(label_data_dir)
 except FileNotFoundError:
-    print("Unable to load on of: "
+    print("Unable to load one of: "
           "\'da_distance_matrix.csv\', \'ap_distance_matrix.csv\' or \'ap_type_distance_matrix.csv\'. "
           "If the files are not present in " + label_data_dir + " directory please generate them using "
           "the generate_label_distance_matrices() function in label_distance_utilities.py.")
 
 
 def get_user_label_data(path, user_data, labels, sets_list, dialogue_groups, load=True):
-    """Utility function either loads user_label_data dictionary or generates and saves it.
+    """Utility function generates the user_label_data dictionary from cached fragments and saves it.
+
+    Each set and dialogue is cached in a FragmentCache, in the 'cache' directory next to path,
+    so only the sets and dialogues with new or changed user data are recomputed,
+    and fragments that are no longer used are deleted.
 
     Args:
-        path (str): Path to load or save label_data.pkl.
-        user_data (list): List of user data dictionaries.
+        path (str): Path to save label_data.pkl.
+        user_data (list): List of user data dictionaries, a UserDataTable or its long-format table.
         labels (dict): Dictionary of all labels.
         sets_list (list): List of all dialogue sets.
         dialogue_groups (dict): Dictionary of all dialogue groups (task/non-task and corpora).
-        load (bool): Whether to try and load label data or force getting new set.
+        load (bool): Whether to try and load cached label data or force getting new set.
 
     Returns:
         label_data (dict): Dictionary of all dataframes created.
@@ -44,115 +49,92 @@ def get_user_label_data(path, user_data, labels, sets_list, dialogue_groups, loa
         Dictionary with set or dialogue names as keys and Dictionary of users as values.
         (values dict has user_names as keys and Dataframe of individual labels for set/dialogue).
     """
-    # If the file exists just load it, else generate the data and save
-    if os.path.exists(path) and load:
-        user_label_data = load_pickle(path)
-    else:
-        user_label_data = dict()
-        user_label_data['sets_labels'] = get_user_by_sets(user_data, labels, sets_list)
-        for group_key in dialogue_groups.keys():
-            user_label_data[group_key] = get_users_by_dialogues(user_data, labels, dialogue_groups[group_key])
-        save_pickle(path, user_label_data)
+    cache = None
+    if load:
+        cache = FragmentCache(os.path.join(os.path.dirname(path), 'cache'), [__file__], labels)
+
+    user_table = get_user_table(user_data)
+    user_label_data = dict()
+    user_label_data['sets_labels'] = get_user_by_sets(user_table, labels, sets_list, cache=cache)
+    for group_key in dialogue_groups.keys():
+        user_label_data[group_key] = get_users_by_dialogues(user_table, labels, dialogue_groups[group_key], cache=cache)
+    if cache is not None:
+        cache.remove_unused()
+    save_pickle(path, user_label_data)
 
     return user_label_data
 
 
-def get_user_by_sets(user_data, labels, sets):
+def get_user_by_sets(user_data, labels, sets, cache=None):
     """Returns dictionary of all user label dataframes for a list of sets."""
+    user_table = get_user_table(user_data)
+
     sets_dict = dict()
-    # Iterate over all dialogues and utterances and count all labels in each dialogue
+    # Count all labels for each users utterances in each set
     for set_name in sets:
-        user_counts = dict()
-        for user in user_data:
-
-            if user['dataset'] == set_name:
-                # Need to sort the user dialogues because they were shuffled during experiment
-                for user_dialogue in sorted(user['dialogues'], key=lambda k: k['dialogue_id']):
-
-                    # Create new user dictionary if this is the first time seeing it
-                    if user['user_id'] not in user_counts.keys():
-                        user_counts[user['user_id']] = dict()
-
-                    # Count the current dialogue labels
-                    current_user = user_counts[user['user_id']]
-                    count_dialogue_utterance_labels(current_user, user_dialogue, labels)
+        # Need to sort the user dialogues because they were shuffled during experiment
+        set_rows = user_table[user_table['dataset'] == set_name]
+        set_rows = set_rows.sort_values(['user_index', 'dialogue_id', 'utterance_index'], kind='stable')
 
         # Combine the users (per utterance) label counts into dataframes of label type
-        sets_dict[set_name] = label_counts_to_dataframes(user_counts, labels)
+        sets_dict[set_name] = get_cached_fragment(cache, set_rows, lambda rows: count_utterance_labels(rows, labels),
+                                                  'sets_labels', set_name)
     return sets_dict
 
 
-def get_users_by_dialogues(user_data, labels, dialogues):
+def get_users_by_dialogues(user_data, labels, dialogues, cache=None):
     """Returns dictionary of all user label dataframes for a list of dialogues."""
+    user_table = get_user_table(user_data)
+
     dialogue_dict = dict()
-    # Iterate over all dialogues and utterances and count all labels in each dialogue
+    # Count all labels for each users utterances in each dialogue
     for dialogue in dialogues:
-        user_counts = dict()
-        for user in user_data:
-
-            for user_dialogue in user['dialogues']:
-                if user_dialogue['dialogue_id'] == dialogue:
-
-                    # Create new user dictionary if this is the first time seeing it
-                    if user['user_id'] not in user_counts.keys():
-                        user_counts[user['user_id']] = dict()
-
-                    # Count the current dialogue labels
-                    current_user = user_counts[user['user_id']]
-                    count_dialogue_utterance_labels(current_user, user_dialogue, labels)
+        dialogue_rows = user_table[user_table['dialogue_id'] == dialogue]
 
         # Combine the users (per utterance) label counts into dataframes of label type
-        dialogue_dict[dialogue] = label_counts_to_dataframes(user_counts, labels)
+        dialogue_dict[dialogue] = get_cached_fragment(cache, dialogue_rows,
+                                                      lambda rows: count_utterance_labels(rows, labels),
+                                                      'dialogue_labels', dialogue)
     return dialogue_dict
 
 
-def count_dialogue_utterance_labels(current_item, dialogue, labels):
-    """Count labels for each utterance of a dialogue. current_item could be a set, dialogue or user."""
-    for i, utt in enumerate(dialogue['utterances']):
-        # Concatenate the index so we don't count identical utterances the same
-        curr_utt = str(i) + "_" + utt['text']
-        # Create new lists if this is the first time seeing this utterance
-        if curr_utt not in current_item.keys():
-            current_item[curr_utt] = dict()
-            current_item[curr_utt]['ap'] = [0] * len(labels['ap'])
-            current_item[curr_utt]['da'] = [0] * len(labels['da'])
-            current_item[curr_utt]['ap_type'] = [0] * len(labels['ap_type'])
-
-        # Increase counts for each type of label
-        current_item[curr_utt]['ap'][labels['ap'].index(utt['ap_label'])] += 1
-        current_item[curr_utt]['da'][labels['da'].index(utt['da_label'])] += 1
-        current_item[curr_utt]['ap_type'][labels['ap_type'].index(utt['ap_label'] + '-' + utt['da_label'])] += 1
-
-
-def label_counts_to_dataframes(label_counts, labels):
-    """Converts users dictionary of label counts (per utterance) into one dictionary of dataframes."""
-    # Iterate over each set and create dataframe of label counts
-    set_dict = dict()
-    for item in label_counts.keys():
-        current_item = label_counts[item]
-
-        # Create a dataframe for AP
-        ap_counts = [current_item[utt]['ap'] for utt in current_item]
-        ap_frame = pd.DataFrame(ap_counts, columns=labels['ap'])
-
-        # Create a dataframe for DA
-        da_counts = [current_item[utt]['da'] for utt in current_item]
-        da_frame = pd.DataFrame(da_counts, columns=labels['da'])
+def count_utterance_labels(rows, labels):
+    """Counts each users labels for each utterance in rows of the user data table.
 
-        # Create a dataframe for AP-Types
-        ap_type_counts = [current_item[utt]['ap_type'] for utt in current_item]
-        ap_type_frame = pd.DataFrame(ap_type_counts, columns=labels['ap_type'])
+    Utterances are keyed by 'index_text' so identical utterances are not counted the same,
+    and rows with the same key for a user (e.g. from different dialogues in a set) are counted together.
 
-        # Concatenate
-        set_frame = pd.concat([ap_frame, da_frame, ap_type_frame], axis=1)
-
-        # Add the utterance text column
-        set_frame.insert(0, 'text', current_item.keys())
-
-        # Add to sets dictionary
-        set_dict[item] = set_frame
+    Args:
+        rows (DataFrame): Rows of the long-format user data table.
+        labels (dict): Dictionary of all labels.
 
-    return set_dict
+    Returns:
+        user_dict (dict): Dictionary with user_names as keys and Dataframe of label counts, with a 'text' column,
+        for each of their utterances.
+    """
+    # Concatenate the index so we don't count identical utterances the same
+    utterance_keys = rows['utterance_index'].astype(str) + "_" + rows['text'].astype(str)
+    group_keys = [rows['user_id'], utterance_keys.rename('text')]
+
+    # One-hot encode each type of label and sum the counts for each user and utterance (in order of first appearance)
+    label_counts = []
+    for label_type, column in [('ap', 'ap_label'), ('da', 'da_label'), ('ap_type', 'ap_type')]:
+        # Labels that are not in labels would otherwise be dropped, leaving the utterance without a label
+        unknown_labels = set(rows[column].unique()) - set(labels[label_type])
+        if unknown_labels:
+            raise ValueError("Unknown " + label_type + " labels: " + ", ".join(sorted(map(str, unknown_labels))) +
+                             ". Must be one of the labels in labels['" + label_type + "'].")
+        one_hot = pd.get_dummies(rows[column]).reindex(columns=labels[label_type], fill_value=False).astype('int64')
+        label_counts.append(one_hot.groupby(group_keys, sort=False, observed=True).sum())
+    label_counts = pd.concat(label_counts, axis=1)
+
+    # Create a dataframe for each user, with the utterance text column first
+    user_dict = dict()
+    for user_id, user_counts in label_counts.groupby(level='user_id', sort=False, observed=True):
+        user_frame = user_counts.reset_index(level='text').reset_index(drop=True)
+        user_frame.columns.name = None
+        user_dict[user_id] = user_frame
+    return user_dict
 
 
 def get_label_type(data, label_type, labels):
@@ -169,28 +151,78 @@ def get_label_type(data, label_type, labels):
     return result_dict
 
 
+def get_agreement_statistics(item, users_dict, label_type, labels, agreement_cache=None):
+    """Returns the AgreementStatistics for a set or dialogue and label type, for the users in users_dict.
+
+    If agreement_cache is given the statistics are kept in it, so calculating several stats for the same data only
+    creates them once, and later calls only add the users that are new or whose labels have changed.
+
+    Args:
+        item (str): Set or dialogue name.
+        users_dict (dict): Dictionary with user_names as keys and Dataframe of individual labels for the set/dialogue.
+        label_type (str): Label type, one of 'ap', 'da' or 'ap_type'.
+        labels (dict): Dictionary of all labels.
+        agreement_cache (dict): Dictionary with (item, label_type) as keys and AgreementStatistics as values.
+                                Default=None, creates new statistics.
+
+    Returns:
+        stats (AgreementStatistics): The statistics for the users label_type labels.
+    """
+    num_items = len(next(iter(users_dict.values())))
+    if agreement_cache is None:
+        return AgreementStatistics(labels[label_type], num_items).update(users_dict)
+
+    # Start again if the labels or utterances have changed
+    stats = agreement_cache.get((item, label_type))
+    if stats is None or stats.labels != list(labels[label_type]) or stats.num_items != num_items:
+        stats = AgreementStatistics(labels[label_type], num_items)
+        agreement_cache[(item, label_type)] = stats
+    return stats.update(users_dict)
+
+
 def da_distance(label_a, label_b):
-    return da_distance_matrix.loc[label_a, label_b]
+    return label_registry.distance('da', label_a, label_b)
 
 
 def ap_distance(label_a, label_b):
-    return ap_distance_matrix.loc[label_a, label_b]
+    return label_registry.distance('ap', label_a, label_b)
 
 
 def ap_type_distance(label_a, label_b):
-    return ap_type_distance_matrix.loc[label_a, label_b]
+    return label_registry.distance('ap_type', label_a, label_b)
 
 
 # Postfix only distance functions
 def ap_postfix_only_distance(label_a, label_b):
-    return ap_postfix_only_distance_matrix.loc[label_a, label_b]
+    return label_registry.distance('ap_postfix_only', label_a, label_b)
 
 
 def ap_type_postfix_only_distance(label_a, label_b):
-    return ap_type_postfix_only_distance_matrix.loc[label_a, label_b]
+    return label_registry.distance('ap_type_postfix_only', label_a, label_b)
+
+
+def get_distance_matrices(labels, postfix_only=False):
+    """Returns the distance matrix for each label type, with rows and columns in the order of the labels.
 
+    Args:
+        labels (dict): Dictionary of all labels.
+        postfix_only (bool): Whether to use the postfix only distance matrices. Default=False.
 
-def get_multi_pi(data, labels, add_mean=True):
+    Returns:
+        distance_matrices (dict): Label types as keys and distance matrix arrays (labels x labels) as values.
+    """
+    distance_matrices = dict()
+    distance_matrices['da'] = label_registry.distance_matrix('da', labels['da'])
+    if not postfix_only:
+        distance_matrices['ap'] = label_registry.distance_matrix('ap', labels['ap'])
+        distance_matrices['ap_type'] = label_registry.distance_matrix('ap_type', labels['ap_type'])
+    else:
+        distance_matrices['ap'] = label_registry.distance_matrix('ap_postfix_only', labels['ap'])
+        distance_matrices['ap_type'] = label_registry.distance_matrix('ap_type_postfix_only', labels['ap_type'])
+    return distance_matrices
+
+
+def get_multi_pi(data, labels, add_mean=True, agreement_cache=None):
     """Gets Multi-pi for each label type of a given set or dialogue set.
 
     Multi-pi is calculated using cumulative/sum of coder labels for a given utterance.
@@ -200,6 +232,7 @@ def get_multi_pi(data, labels, add_mean=True):
                     (values dict has user_names as keys and Dataframe of individual labels for set/dialogue).
         labels (dict): Dictionary of all labels.
         add_mean (bool): Whether to add a mean row to the resulting dataframe. Default=True.
+        agreement_cache (dict): Statistics to reuse, see get_agreement_statistics(). Default=None.
 
     Returns:
         multi_pi_df (DataFrame): Rows are set or dialogue id, columns are label type and items are multi-kappa.
@@ -210,28 +243,19 @@ def get_multi_pi(data, labels, add_mean=True):
         current = dict()
         users_dict = data[item]
 
-        # Get each label type as a dataframe
-        da = get_label_type(users_dict, 'da', labels)
-        ap = get_label_type(users_dict, 'ap', labels)
-        ap_type = get_label_type(users_dict, 'ap_type', labels)
-
-        # Get the multi-pi stat for each label type
-        current['da'] = multi_pi(da)
-        current['ap'] = multi_pi(ap)
-        current['ap type'] = multi_pi(ap_type)
+        # Get the multi-pi stat for each label type, from its statistics
+        current['da'] = get_agreement_statistics(item, users_dict, 'da', labels, agreement_cache).multi_pi()
+        current['ap'] = get_agreement_statistics(item, users_dict, 'ap', labels, agreement_cache).multi_pi()
+        current['ap type'] = get_agreement_statistics(item, users_dict, 'ap_type', labels, agreement_cache).multi_pi()
 
         # Remove '_' from names
         multi_pi_dict[item.replace("_", " ")] = current
 
     # Create multi_pi_df dataframe and add mean for each row
-    multi_pi_df = pd.DataFrame.from_dict(multi_pi_dict, orient='index')
-    if add_mean:
-        multi_pi_df.loc['mean'] = multi_pi_df.mean()
-    multi_pi_df.columns = pd.MultiIndex.from_product([['Multi-Pi'], multi_pi_df.columns])
-    return multi_pi_df
+    return create_agreement_frame(multi_pi_dict, 'Multi-Pi', add_mean=add_mean)
 
 
-def get_multi_kappa(data, labels, add_mean=True):
+def get_multi_kappa(data, labels, add_mean=True, agreement_cache=None):
     """Gets Multi-kappa for each label type of a given set or dialogue set.
 
     Multi-kappa is calculated using the pairwise average of each coder-pair.
@@ -241,6 +265,7 @@ def get_multi_kappa(data, labels, add_mean=True):
                     (values dict has user_names as keys and Dataframe of individual labels for set/dialogue).
         labels (dict): Dictionary of all labels.
         add_mean (bool): Whether to add a mean row to the resulting dataframe. Default=True.
+        agreement_cache (dict): Statistics to reuse, see get_agreement_statistics(). Default=None.
 
     Returns:
         multi_kappa_df (DataFrame): Rows are set or dialogue id, columns are label type and items are multi-kappa.
@@ -251,28 +276,20 @@ def get_multi_kappa(data, labels, add_mean=True):
         current = dict()
         users_dict = data[item]
 
-        # Get each label type as a dataframe
-        da = get_label_type(users_dict, 'da', labels)
-        ap = get_label_type(users_dict, 'ap', labels)
-        ap_type = get_label_type(users_dict, 'ap_type', labels)
-
-        # Get the multi-kappa stat for each label type
-        current['da'] = multi_kappa(da)
-        current['ap'] = multi_kappa(ap)
-        current['ap type'] = multi_kappa(ap_type)
+        # Get the multi-kappa stat for each label type, from its statistics
+        current['da'] = get_agreement_statistics(item, users_dict, 'da', labels, agreement_cache).multi_kappa()
+        current['ap'] = get_agreement_statistics(item, users_dict, 'ap', labels, agreement_cache).multi_kappa()
+        current['ap type'] = get_agreement_statistics(item, users_dict, 'ap_type', labels,
+                                                      agreement_cache).multi_kappa()
 
         # Remove '_' from names
         multi_kappa_dict[item.replace("_", " ")] = current
 
     # Create multi_kappa_df dataframe and add mean for each row
-    multi_kappa_df = pd.DataFrame.from_dict(multi_kappa_dict, orient='index')
-    if add_mean:
-        multi_kappa_df.loc['mean'] = multi_kappa_df.mean()
-    multi_kappa_df.columns = pd.MultiIndex.from_product([['Multi-Kappa'], multi_kappa_df.columns])
-    return multi_kappa_df
+    return create_agreement_frame(multi_kappa_dict, 'Multi-Kappa', add_mean=add_mean)
 
 
-def get_bias(data, labels, add_mean=True, postfix_only=False):
+def get_bias(data, labels, add_mean=True, postfix_only=False, agreement_cache=None):
     """Calculates bias of weighted measures according to Artstein, R. and Poesio, M. (2005) Kappa 3 = Alpha (or Beta)
 
     Args:
@@ -281,10 +298,13 @@ def get_bias(data, labels, add_mean=True, postfix_only=False):
         labels (dict): Dictionary of all labels.
         add_mean (bool): Whether to add a mean row to the resulting dataframe. Default=True.
         postfix_only (bool): Whether to use the postfix only distance function. Default=False.
+        agreement_cache (dict): Statistics to reuse, see get_agreement_statistics(). Default=None.
 
     Returns:
         bias_df (DataFrame): Rows are set or dialogue id, columns are label type and items are bias.
     """
+    # The distance matrices are in the same order as the label columns
+    distance_matrices = get_distance_matrices(labels, postfix_only)
 
     bias_dict = dict()
     # For each set or dialogue in items list
@@ -292,32 +312,32 @@ def get_bias(data, labels, add_mean=True, postfix_only=False):
         current = dict()
         users_dict = data[item]
 
-        # Get each label type data as a dataframe
-        da = get_label_type(users_dict, 'da', labels)
-        ap = get_label_type(users_dict, 'ap', labels)
-        ap_type = get_label_type(users_dict, 'ap_type', labels)
-
-        # Get the bias for each label type
-        current['da'] = bias(da, da_distance)
-        if not postfix_only:
-            current['ap'] = bias(ap, ap_distance)
-            current['ap type'] = bias(ap_type, ap_type_distance)
-        else:
-            current['ap'] = bias(ap, ap_postfix_only_distance)
-            current['ap type'] = bias(ap_type, ap_type_postfix_only_distance)
+        # Get the bias for each label type, from its statistics
+        for label_type, column in [('da', 'da'), ('ap', 'ap'), ('ap_type', 'ap type')]:
+            stats = get_agreement_statistics(item, users_dict, label_type, labels, agreement_cache)
+            current[column] = stats.bias(distance_matrices[label_type])
 
         # Remove '_' from names and add to exp_dis dict
         bias_dict[item.replace("_", " ")] = current
 
     # Create bias_df dataframe and add mean for each row
-    bias_df = pd.DataFrame.from_dict(bias_dict, orient='index')
-    if add_mean:
-        bias_df.loc['mean'] = bias_df.mean()
+    return create_agreement_frame(bias_dict, 'bias', add_mean=add_mean)
+
 
-    return bias_df
+def get_weighted_agreement_func(stat_type):
+    """Returns the AgreementStatistics method for Alpha, Alpha Prime (Alpha') or Beta."""
+    if stat_type.lower() == 'alpha':
+        return AgreementStatistics.alpha
+    elif stat_type.lower() == 'alpha\'' or stat_type.lower() == 'alpha prime':
+        return AgreementStatistics.alpha_prime
+    elif stat_type.lower() == 'beta':
+        return AgreementStatistics.beta
+    else:
+        raise ValueError("Invalid weighted agreement type: \"" + stat_type + "\". "
+                         "Must be one of \"Alpha\", \"Alpha Prime\", \"Alpha\'\" or \"Beta\".")
 
 
-def get_weighted_agreement(data, labels, stat_type, add_mean=True, postfix_only=False):
+def get_weighted_agreement(data, labels, stat_type, add_mean=True, postfix_only=False, agreement_cache=None):
     """Gets Alpha, Alpha Prime or Beta for each label type of a given set or dialogue set.
 
     Weighted agreement is calculated using the pairwise average of each coder-pair.
@@ -329,20 +349,16 @@ def get_weighted_agreement(data, labels, stat_type, add_mean=True, postfix_only=
         stat_type (str): Which agreement statistic to use. Must be one of Alpha, Alpha Prime (Alpha') or Beta.
         add_mean (bool): Whether to add a mean row to the resulting dataframe. Default=True.
         postfix_only (bool): Whether to use the postfix only distance function. Default=False.
+        agreement_cache (dict): Statistics to reuse, see get_agreement_statistics(). Default=None.
 
     Returns:
         weighted_df (DataFrame): Rows are set or dialogue id, columns are label type and items are stat_type.
     """
     # Get the desired agreement function
-    if stat_type.lower() == 'alpha':
-        weighted_agreement_func = alpha
-    elif stat_type.lower() == 'alpha\'' or stat_type.lower() == 'alpha prime':
-        weighted_agreement_func = alpha_prime
-    elif stat_type.lower() == 'beta':
-        weighted_agreement_func = beta
-    else:
-        raise ValueError("Invalid weighted agreement type: \"" + stat_type + "\". "
-                         "Must be one of \"Alpha\", \"Alpha Prime\", \"Alpha\'\" or \"Beta\".")
+    weighted_agreement_func = get_weighted_agreement_func(stat_type)
+
+    # The distance matrices are in the same order as the label columns
+    distance_matrices = get_distance_matrices(labels, postfix_only)
 
     weighted_dict = dict()
     # For each set or dialogue in items list
@@ -350,32 +366,191 @@ def get_weighted_agreement(data, labels, stat_type, add_mean=True, postfix_only=
         current = dict()
         users_dict = data[item]
 
-        # Get each label type as a dataframe
-        da = get_label_type(users_dict, 'da', labels)
-        ap = get_label_type(users_dict, 'ap', labels)
-        ap_type = get_label_type(users_dict, 'ap_type', labels)
-
-        # Get the weighted agreement stat for each label type
-        current['da'] = weighted_agreement_func(da, da_distance)
-        if not postfix_only:
-            current['ap'] = weighted_agreement_func(ap, ap_distance)
-            current['ap type'] = weighted_agreement_func(ap_type, ap_type_distance)
-        else:
-            current['ap'] = weighted_agreement_func(ap, ap_postfix_only_distance)
-            current['ap type'] = weighted_agreement_func(ap_type, ap_type_postfix_only_distance)
+        # Get the weighted agreement stat for each label type, from its statistics
+        for label_type, column in [('da', 'da'), ('ap', 'ap'), ('ap_type', 'ap type')]:
+            stats = get_agreement_statistics(item, users_dict, label_type, labels, agreement_cache)
+            current[column] = weighted_agreement_func(stats, distance_matrices[label_type])
 
         # Remove '_' from names
         weighted_dict[item.replace("_", " ")] = current
 
     # Create weighted_df dataframe and add mean for each row
-    weighted_df = pd.DataFrame.from_dict(weighted_dict, orient='index')
+    return create_agreement_frame(weighted_dict, stat_type, add_mean=add_mean)
+
+
+# Distance matrices shared with the agreement pool processes, label types as keys and arrays as values
+shared_distance_matrices = dict()
+
+
+def share_distance_matrices(distance_matrices):
+    """Copies the distance matrices to shared memory, so the agreement pool processes do not each need a copy.
+
+    Args:
+        distance_matrices (dict): Label types as keys and distance matrix arrays as values.
+
+    Returns:
+        blocks (list): The SharedMemory blocks, which must be closed and unlinked when the pool has finished.
+        specs (dict): Label types as keys and (shared memory name, shape, dtype) as values, for attach_distance_matrices().
+    """
+    blocks = []
+    specs = dict()
+    for label_type, matrix in distance_matrices.items():
+        block = shared_memory.SharedMemory(create=True, size=max(matrix.nbytes, 1))
+        np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=block.buf)[:] = matrix
+        blocks.append(block)
+        specs[label_type] = (block.name, matrix.shape, matrix.dtype.str)
+    return blocks, specs
+
+
+def attach_distance_matrices(specs):
+    """Runs in each agreement pool process, attaches to the shared distance matrices."""
+    for label_type, (name, shape, dtype) in specs.items():
+        # The pool processes share the resource tracker of the process that created (and unlinks) the block
+        block = shared_memory.SharedMemory(name=name)
+        shared_distance_matrices[label_type] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def get_agreement_value(item, label_type, stat_type, users_dict, labels, distance_matrices=None,
+                        agreement_cache=None):
+    """Calculates one agreement stat for one label type of a set or dialogue.
+
+    Args:
+        item (str): Set or dialogue name.
+        label_type (str): Label type, one of 'ap', 'da' or 'ap_type'.
+        stat_type (str): One of Multi-Pi, Multi-Kappa, Alpha, Alpha Prime (Alpha'), Beta or bias.
+        users_dict (dict): Dictionary with user_names as keys and Dataframe of individual labels for the set/dialogue.
+        labels (dict): Dictionary of all labels.
+        distance_matrices (dict): Label types as keys and distance matrix arrays as values,
+                                  default is the shared distance matrices of this pool process.
+        agreement_cache (dict): Statistics to reuse, see get_agreement_statistics(). Default=None.
+
+    Returns:
+        value (float): The agreement stat.
+    """
+    stats = get_agreement_statistics(item, users_dict, label_type, labels, agreement_cache)
+    if stat_type == 'Multi-Pi':
+        return stats.multi_pi()
+    elif stat_type == 'Multi-Kappa':
+        return stats.multi_kappa()
+
+    if distance_matrices is None:
+        distance_matrix = shared_distance_matrices[label_type][1]
+    else:
+        distance_matrix = distance_matrices[label_type]
+    if stat_type == 'bias':
+        return stats.bias(distance_matrix)
+    return get_weighted_agreement_func(stat_type)(stats, distance_matrix)
+
+
+def get_agreement_values(tasks, labels):
+    """Calculates the agreement stats for a list of (item, label_type, stat_type, users_dict) in a pool process."""
+    # The statistics are only kept for this list of tasks, so the stats of each item are only created once
+    agreement_cache = dict()
+    return [get_agreement_value(item, label_type, stat_type, users_dict, labels, agreement_cache=agreement_cache)
+            for item, label_type, stat_type, users_dict in tasks]
+
+
+def create_agreement_frame(agreement_dict, stat_type, add_mean=True):
+    """Creates the dataframe of agreement stats for each set or dialogue, as get_multi_pi() etc.
+
+    Args:
+        agreement_dict (dict): Set or dialogue names as keys and dictionary of label types and stats as values.
+        stat_type (str): Name of the stat, the top level of the columns, or 'bias' for no top level (as get_bias()).
+        add_mean (bool): Whether to add a mean row to the resulting dataframe. Default=True.
+
+    Returns:
+        agreement_df (DataFrame): Rows are set or dialogue id, columns are label type and items are stat_type.
+    """
+    agreement_df = pd.DataFrame.from_dict(agreement_dict, orient='index')
     if add_mean:
-        weighted_df.loc['mean'] = weighted_df.mean()
-    weighted_df.columns = pd.MultiIndex.from_product([[stat_type], weighted_df.columns])
-    return weighted_df
+        agreement_df.loc['mean'] = agreement_df.mean()
+    if stat_type != 'bias':
+        agreement_df.columns = pd.MultiIndex.from_product([[stat_type], agreement_df.columns])
+    return agreement_df
+
+
+def get_parallel_agreement(groups_data, labels, stat_types, add_mean=True, postfix_only=False, jobs=None):
+    """Gets agreement stats for each label type of the sets or dialogues in groups of data, on a pool of processes.
+
+    Each (set or dialogue, label type, stat) is calculated separately, the distance matrices are shared with the
+    pool processes in shared memory. The results are the same dataframes as the get_multi_pi(), get_multi_kappa(),
+    get_weighted_agreement() and get_bias() functions.
+
+    Args:
+        groups_data (dict): Dictionary with group names as keys and data as values (data dict has set or dialogue names
+                            as keys and Dictionary of users as values, as get_multi_pi() etc.).
+        labels (dict): Dictionary of all labels.
+        stat_types (list): Stats to calculate, any of Multi-Pi, Multi-Kappa, Alpha, Alpha Prime (Alpha'), Beta or bias.
+        add_mean (bool): Whether to add a mean row to the resulting dataframes. Default=True.
+        postfix_only (bool): Whether to use the postfix only distance matrices. Default=False.
+        jobs (int): Number of processes, default is the number of CPUs. If 1 the stats are calculated in this process.
+
+    Returns:
+        agreement_frames (dict): Group names as keys and Dictionary of stat_types and their dataframes as values.
+    """
+    # Check the stat types before starting the pool
+    for stat_type in stat_types:
+        if stat_type not in ['Multi-Pi', 'Multi-Kappa', 'bias']:
+            get_weighted_agreement_func(stat_type)
+
+    # Each process calculates every stat for one label type of a set or dialogue, so its statistics are only created once
+    cells = []
+    tasks = []
+    for group, data in groups_data.items():
+        for item, users_dict in data.items():
+            for label_type in ['da', 'ap', 'ap_type']:
+                label_data = get_label_type(users_dict, label_type, labels)
+                cells.append((group, item, label_type))
+                tasks.append([(item, label_type, stat_type, label_data) for stat_type in stat_types])
+
+    distance_matrices = get_distance_matrices(labels, postfix_only)
+    if jobs == 1:
+        agreement_cache = dict()
+        values = [[get_agreement_value(*task, labels, distance_matrices, agreement_cache) for task in cell_tasks]
+                  for cell_tasks in tasks]
+    else:
+        blocks, specs = share_distance_matrices(distance_matrices)
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=attach_distance_matrices, initargs=(specs,)) as executor:
+                values = list(executor.map(get_agreement_values, tasks, [labels] * len(tasks)))
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    # Reassemble the stats into a dataframe for each group and stat
+    agreement_dicts = {group: {stat_type: dict() for stat_type in stat_types} for group in groups_data}
+    for (group, item, label_type), cell_values in zip(cells, values):
+        for stat_type, value in zip(stat_types, cell_values):
+            # Remove '_' from names
+            agreement_dicts[group][stat_type].setdefault(item.replace("_", " "), dict())[label_type.replace("_", " ")] = value
+
+    return {group: {stat_type: create_agreement_frame(agreement_dicts[group][stat_type], stat_type, add_mean=add_mean)
+                    for stat_type in stat_types} for group in groups_data}
+
+
+def test_parallel_agreement():
+    """Tests get_parallel_agreement() gives the same dataframes on a pool of processes as in this process,
+    and as the get_weighted_agreement() and get_bias() functions.
+
+    Usage: python -m pytest label_data_utilities.py (from the data_processing directory).
+    """
+    data_dir = os.path.join('..', 'static', 'data')
+    user_table = UserDataTable().add_users(iter_user_data(os.path.join(data_dir, 'user_dialogues')))
+    labels = user_table.get_labels(os.path.join(data_dir, 'labels'))
+    groups_data = {'sets': get_user_by_sets(user_table, labels, ['set_1', 'set_2'])}
+
+    stat_types = ['Multi-Pi', 'Multi-Kappa', 'Alpha', 'Alpha Prime', 'Beta', 'bias']
+    serial = get_parallel_agreement(groups_data, labels, stat_types, jobs=1)['sets']
+    parallel = get_parallel_agreement(groups_data, labels, stat_types, jobs=2)['sets']
+    for stat_type in stat_types:
+        pd.testing.assert_frame_equal(parallel[stat_type], serial[stat_type])
 
+    pd.testing.assert_frame_equal(serial['Alpha'], get_weighted_agreement(groups_data['sets'], labels, 'Alpha'))
+    pd.testing.assert_frame_equal(serial['bias'], get_bias(groups_data['sets'], labels))
 
-def generate_set_agreement_data(users_data, labels, group_name, save_dir, save=True, show=True, add_mean=True, add_bias=False, postfix_only=False):
+
+def generate_set_agreement_data(users_data, labels, group_name, save_dir, save=True, show=True, add_mean=True, add_bias=False, postfix_only=False, jobs=1):
     """Utility function that generates all agreement statistics for dialogue sets.
 
     Creates a DataFrame of the results and saves to .csv and creates a multi-graph plot and saves to .png.
@@ -391,10 +566,21 @@ def generate_set_agreement_data(users_data, labels, group_name, save_dir, save=T
         add_mean (bool): Whether to add a mean row to the data. Default=True.
         add_bias (bool): Whether to calculate and add bias to data and plot. Default=False.
         postfix_only (bool): Whether to use the postfix only distance function. Default=False.
+        jobs (int): Number of processes to calculate the agreement on (see get_parallel_agreement()). Default=1.
     """
+    # Alpha, Beta and bias are calculated from the same statistics
+    agreement_cache = dict()
+
     # Create dataframe of agreement by set
-    alpha_df = get_weighted_agreement(users_data, labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only)
-    beta_df = get_weighted_agreement(users_data, labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only)
+    if jobs == 1:
+        alpha_df = get_weighted_agreement(users_data, labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only,
+                                          agreement_cache=agreement_cache)
+        beta_df = get_weighted_agreement(users_data, labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only,
+                                         agreement_cache=agreement_cache)
+    else:
+        agreement_frames = get_parallel_agreement({group_name: users_data}, labels, ['Alpha', 'Beta'],
+                                                  add_mean=add_mean, postfix_only=postfix_only, jobs=jobs)[group_name]
+        alpha_df, beta_df = agreement_frames['Alpha'], agreement_frames['Beta']
 
     # Group stats into one dataframe
     group_frame = pd.concat([alpha_df, beta_df], axis=1)
@@ -407,7 +593,7 @@ def generate_set_agreement_data(users_data, labels, group_name, save_dir, save=T
 
     # Calculate bias and add to groups frame and plot
     if add_bias:
-        bias_df = get_bias(users_data, labels)
+        bias_df = get_bias(users_data, labels, agreement_cache=agreement_cache)
 
         # Sort data for plotting
         bias_plt_df = dataframe_wide_to_long(bias_df)
@@ -429,7 +615,7 @@ def generate_set_agreement_data(users_data, labels, group_name, save_dir, save=T
     return group_frame, plt
 
 
-def generate_group_agreement_data(group_data, groups,  labels, group_name, save_dir, save=True, show=True, add_mean=True, add_bias=False, postfix_only=False):
+def generate_group_agreement_data(group_data, groups,  labels, group_name, save_dir, save=True, show=True, add_mean=True, add_bias=False, postfix_only=False, jobs=1):
     """Utility function that generates all mean agreement statistics for a given group of data.
 
     Creates a DataFrame of the results and saves to .csv and creates a multi-graph plot and saves to .png.
@@ -446,14 +632,29 @@ def generate_group_agreement_data(group_data, groups,  labels, group_name, save_
         add_mean (bool): Whether to add a mean row to the data. Default=True.
         add_bias (bool): Whether to calculate and add bias to data and plot. Default=False.
         postfix_only (bool): Whether to use the postfix only distance function. Default=False.
+        jobs (int): Number of processes to calculate the agreement on (see get_parallel_agreement()). Default=1.
     """
+    # Calculate agreement for all groups at once on a pool of processes
+    if jobs != 1:
+        groups_agreement = get_parallel_agreement({group: group_data[group] for group in groups}, labels,
+                                                  ['Alpha', 'Beta'], add_mean=add_mean, postfix_only=postfix_only,
+                                                  jobs=jobs)
+
+    # Alpha, Beta and bias are calculated from the same statistics
+    agreement_cache = dict()
+
     # Create dataframe of agreement by group
     groups_frame = pd.DataFrame()
     bias_frame = pd.DataFrame()
     for group in groups:
         # Get alpha and beta
-        alpha_df = get_weighted_agreement(group_data[group], labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only)
-        beta_df = get_weighted_agreement(group_data[group], labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only)
+        if jobs == 1:
+            alpha_df = get_weighted_agreement(group_data[group], labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only,
+                                              agreement_cache=agreement_cache)
+            beta_df = get_weighted_agreement(group_data[group], labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only,
+                                             agreement_cache=agreement_cache)
+        else:
+            alpha_df, beta_df = groups_agreement[group]['Alpha'], groups_agreement[group]['Beta']
 
         # Create a frame for this group
         group_frame = pd.concat([alpha_df, beta_df], axis=1)
@@ -463,7 +664,7 @@ def generate_group_agreement_data(group_data, groups,  labels, group_name, save_
 
         # Calculate bias too
         if add_bias:
-            bias_df = get_bias(group_data[group], labels, add_mean=True)
+            bias_df = get_bias(group_data[group], labels, add_mean=True, agreement_cache=agreement_cache)
             # Add to groups frame
             bias_df.insert(loc=0, column='group', value=group.replace("_", " ").split()[0])
             bias_frame = pd.concat([bias_frame, bias_df], axis=0)
@@ -499,7 +700,7 @@ def generate_group_agreement_data(group_data, groups,  labels, group_name, save_
     return groups_frame, plt
 
 
-def generate_full_agreement_data(group_data, groups,  labels, group_name, save_dir, save=True, show=True, add_mean=True, postfix_only=False):
+def generate_full_agreement_data(group_data, groups,  labels, group_name, save_dir, save=True, show=True, add_mean=True, postfix_only=False, jobs=1):
     """Utility function that generates all agreement statistics for a given group of data.
 
     Creates a DataFrame of the results and saves to .csv and creates a multi-graph plot and saves to .png.
@@ -515,13 +716,28 @@ def generate_full_agreement_data(group_data, groups,  labels, group_name, save_d
         show (bool): Whether to print/show the resulting graphs and dataframes. Default=True.
         add_mean (bool): Whether to add a mean row to the data. Default=True.
         postfix_only (bool): Whether to use the postfix only distance function. Default=False.
+        jobs (int): Number of processes to calculate the agreement on (see get_parallel_agreement()). Default=1.
     """
+    # Calculate agreement for all groups at once on a pool of processes
+    if jobs != 1:
+        groups_agreement = get_parallel_agreement({group: group_data[group] for group in groups}, labels,
+                                                  ['Alpha', 'Beta'], add_mean=add_mean, postfix_only=postfix_only,
+                                                  jobs=jobs)
+
+    # Alpha, Beta and bias are calculated from the same statistics
+    agreement_cache = dict()
+
     # Create dataframe of agreement by group
     groups_frame = pd.DataFrame()
     for group in groups:
         # Get alpha and Beta
-        alpha_df = get_weighted_agreement(group_data[group], labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only)
-        beta_df = get_weighted_agreement(group_data[group], labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only)
+        if jobs == 1:
+            alpha_df = get_weighted_agreement(group_data[group], labels, 'Alpha', add_mean=add_mean, postfix_only=postfix_only,
+                                              agreement_cache=agreement_cache)
+            beta_df = get_weighted_agreement(group_data[group], labels, 'Beta', add_mean=add_mean, postfix_only=postfix_only,
+                                             agreement_cache=agreement_cache)
+        else:
+            alpha_df, beta_df = groups_agreement[group]['Alpha'], groups_agreement[group]['Beta']
 
         # Create a frame for this group
         group_frame = pd.concat([alpha_df, beta_df], axis=1)
@@ -1252,6 +1468,8 @@ def add_bias_plot(data, g, plt):
 
 def get_user_label_assignments(user_data, user_label_data, groups, dialogue_groups):
     """Gets all user label assignments in text form and saves as dictionary with dialogue name as keys."""
+    user_table = get_user_table(user_data)
+
     assingments = {}
     for group in groups:
         for target_dialogue in dialogue_groups[group]:
@@ -1262,24 +1480,19 @@ def get_user_label_assignments(user_data, user_label_data, groups, dialogue_grou
 
             # Get each users assignments
             frame = None
+            dialogue_rows = user_table[user_table['dialogue_id'] == target_dialogue]
             for user in users:
-                # Get the user and their target dialogue
-                for i in range(len(user_data)):
-                    if user_data[i]['user_id'] == user:
-                        user_dialogues = user_data[i]['dialogues']
-                        for j in range(len(user_dialogues)):
-                            if user_dialogues[j]['dialogue_id'] == target_dialogue:
-                                user_dialogue = user_dialogues[j]
-
-                                # If this is the first time seeing this dialogue create the frame
-                                if frame is None:
-                                    frame = pd.DataFrame(user_dialogue['utterances'], columns=['speaker', 'text'])
-                                    frame.insert(loc=0, column='dialogue', value=target_dialogue)
-
-                                # Add the users assignments
-                                label_assignments = []
-                                for utt in user_dialogue['utterances']:
-                                    label_assignments.append(utt['ap_label'] + ' ' + utt['da_label'])
-                                frame[user] = label_assignments
+                # Get the users utterances for the target dialogue
+                user_rows = dialogue_rows[dialogue_rows['user_id'] == user]
+                if len(user_rows) == 0:
+                    continue
+
+                # If this is the first time seeing this dialogue create the frame
+                if frame is None:
+                    frame = user_rows[['speaker', 'text']].astype(str).reset_index(drop=True)
+                    frame.insert(loc=0, column='dialogue', value=target_dialogue)
+
+                # Add the users assignments
+                frame[user] = (user_rows['ap_label'].astype(str) + ' ' + user_rows['da_label'].astype(str)).to_list()
             assingments[target_dialogue] = frame
     save_pickle(os.path.join('results', 'agreement_data', 'user_label_assignments.pkl'), assingments)
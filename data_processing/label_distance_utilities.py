@@ -1,4 +1,5 @@
 import os
+import numpy as np
 import pandas as pd
 from data_processing.data_utilities import save_dataframe, load_dataframe, load_json_data
 from data_processing.plot_utilities import plot_table
@@ -7,6 +8,108 @@ from anytree.importer import DictImporter
 from anytree.exporter import DotExporter
 
 
+# Names of the distance matrices, each is saved as '<name>_distance_matrix.csv'
+distance_matrix_names = ['da', 'ap', 'ap_type', 'ap_postfix_only', 'ap_type_postfix_only']
+
+
+class LabelRegistry:
+    """Maps every DA, AP and AP-type label to a dense integer code and holds the label distance matrices as arrays.
+
+    The matrices are loaded from the binary .npy copies of the distance matrix .csv files in label_data_dir,
+    which are created the first time the .csv is loaded, and again whenever the .csv is newer.
+
+    Attributes:
+        labels (dict): Distance matrix names as keys and list of labels, in code order, as values.
+        codes (dict): Distance matrix names as keys and dictionary of label -> integer code as values.
+        matrices (dict): Distance matrix names as keys and contiguous float array (labels x labels) as values.
+    """
+    def __init__(self, label_data_dir, names=None):
+        self.labels = dict()
+        self.codes = dict()
+        self.matrices = dict()
+        for name in names if names is not None else distance_matrix_names:
+            labels, matrix = load_distance_matrix(label_data_dir, name)
+            self.labels[name] = labels
+            self.codes[name] = {label: code for code, label in enumerate(labels)}
+            self.matrices[name] = matrix
+
+    def encode(self, name, labels):
+        """Returns an array of the integer codes for a list of labels."""
+        codes = self.codes[name]
+        return np.array([codes[label] for label in labels], dtype=np.intp)
+
+    def distance(self, name, label_a, label_b):
+        """Returns the distance between two labels."""
+        return self.matrices[name][self.codes[name][label_a], self.codes[name][label_b]]
+
+    def distance_matrix(self, name, labels):
+        """Returns a contiguous array of the distances between a list of labels, in the order of the list."""
+        codes = self.encode(name, labels)
+        return np.ascontiguousarray(self.matrices[name][np.ix_(codes, codes)])
+
+    def distance_frame(self, name):
+        """Returns the distance matrix as a dataframe with the labels as the index and columns."""
+        return pd.DataFrame(self.matrices[name], index=self.labels[name], columns=self.labels[name])
+
+
+def load_distance_matrix(label_data_dir, name):
+    """Loads a distance matrix and its labels, from the .npy files if they are newer than the .csv.
+
+    Args:
+        label_data_dir (str): Directory to the distance matrix files.
+        name (str): Name of the distance matrix i.e. 'da' for 'da_distance_matrix.csv'.
+
+    Returns:
+        labels (list): List of the matrix labels.
+        matrix (ndarray): Contiguous float array of the distances between each label.
+    """
+    csv_path = os.path.join(label_data_dir, name + "_distance_matrix.csv")
+    matrix_path = os.path.join(label_data_dir, name + "_distance_matrix.npy")
+    labels_path = os.path.join(label_data_dir, name + "_distance_matrix_labels.npy")
+
+    # Use the binary copy unless the .csv has changed since it was saved
+    if os.path.exists(matrix_path) and os.path.exists(labels_path) and \
+            os.path.getmtime(matrix_path) >= os.path.getmtime(csv_path):
+        return np.load(labels_path).tolist(), np.load(matrix_path)
+
+    matrix_frame = load_dataframe(csv_path)
+    return save_distance_matrix_arrays(label_data_dir, matrix_frame, name)
+
+
+def save_distance_matrix_arrays(save_dir, matrix, name):
+    """Saves a distance matrix dataframe, and its labels, as .npy files and returns them.
+
+    Args:
+        save_dir (str): Directory to the save the files.
+        matrix (DataFrame): Distance matrix to save.
+        name (str): Name of the distance matrix i.e. 'da' for 'da_distance_matrix.npy'.
+
+    Returns:
+        labels (list): List of the matrix labels.
+        matrix (ndarray): Contiguous float array of the distances between each label.
+    """
+    labels = [str(label) for label in matrix.index]
+    matrix = np.ascontiguousarray(matrix.loc[labels, labels].to_numpy(dtype=float))
+
+    # The .npy files are only a cache, so the matrix can still be used if they can't be written
+    # The labels are saved first, as the matrix file's time is used to check both are up to date
+    try:
+        save_npy(os.path.join(save_dir, name + "_distance_matrix_labels.npy"), np.array(labels))
+        save_npy(os.path.join(save_dir, name + "_distance_matrix.npy"), matrix)
+    except OSError:
+        print("Unable to save " + name + "_distance_matrix.npy to " + save_dir + ".")
+    return labels, matrix
+
+
+def save_npy(path, array):
+    """Saves an array as a .npy file, other processes (e.g. pool processes importing this module) never see it
+    partly written as it is written to a temporary file first."""
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.save(file, array)
+    os.replace(temp_path, path)
+
+
 def load_labels_tree(data_path):
     """Loads a tree from json format."""
     data = load_json_data(data_path)
@@ -60,6 +163,74 @@ def get_walk_distance(tree, name_a, name_b):
     return distance
 
 
+class LabelTreeIndex:
+    """Index of a labels tree for finding the distance between any pairs of nodes with array operations.
+
+    Holds each nodes depth and a binary lifting table of ancestors, so the lowest common ancestor of two nodes is found
+    in O(log depth) steps. The distance between two nodes is then depth_a + depth_b - 2 * depth_lowest_common_ancestor,
+    the same number of steps as the walk between them.
+
+    Attributes:
+        names (list): Node names, in pre-order.
+        node_indexes (dict): Node names as keys and their index in names as values.
+        depths (ndarray): Depth of each node, the root has depth 0.
+        ancestors (list): Arrays of the 2^k-th ancestor of each node, for k = 0, 1, ..., the root is its own ancestor.
+    """
+    def __init__(self, tree):
+        nodes = list(PreOrderIter(tree))
+        self.names = [node.name for node in nodes]
+        self.node_indexes = dict()
+        for i, name in enumerate(self.names):
+            if name in self.node_indexes:
+                raise ValueError("Labels tree has more than one node named " + name + ".")
+            self.node_indexes[name] = i
+
+        # The first ancestor is the parent, then each ancestor table is the previous one applied twice
+        positions = {id(node): i for i, node in enumerate(nodes)}
+        parents = np.array([positions[id(node.parent)] if node.parent is not None else i for i, node in enumerate(nodes)],
+                           dtype=np.intp)
+
+        # Parents come before their children in pre-order, so their depth is already known
+        self.depths = np.zeros(len(nodes), dtype=np.intp)
+        for i in range(1, len(nodes)):
+            self.depths[i] = self.depths[parents[i]] + 1
+
+        self.ancestors = [parents]
+        while (1 << len(self.ancestors)) <= self.depths.max():
+            self.ancestors.append(self.ancestors[-1][self.ancestors[-1]])
+
+    def encode(self, names):
+        """Returns an array of the node indexes for a list of node names."""
+        return np.array([self.node_indexes[name] for name in names], dtype=np.intp)
+
+    def lowest_common_ancestors(self, nodes_a, nodes_b):
+        """Returns the lowest common ancestor of each pair of node indexes (arrays are broadcast together)."""
+        nodes_a, nodes_b = [nodes.copy() for nodes in np.broadcast_arrays(nodes_a, nodes_b)]
+
+        # Make nodes_a the deeper node of each pair, then lift it to the same depth as nodes_b
+        swap = self.depths[nodes_a] < self.depths[nodes_b]
+        nodes_a[swap], nodes_b[swap] = nodes_b[swap], nodes_a[swap]
+        depth_difference = self.depths[nodes_a] - self.depths[nodes_b]
+        for k, ancestors in enumerate(self.ancestors):
+            lift = (depth_difference >> k) & 1 == 1
+            nodes_a[lift] = ancestors[nodes_a[lift]]
+
+        # Lift both nodes to just below their lowest common ancestor
+        for ancestors in reversed(self.ancestors):
+            lift = ancestors[nodes_a] != ancestors[nodes_b]
+            nodes_a[lift] = ancestors[nodes_a[lift]]
+            nodes_b[lift] = ancestors[nodes_b[lift]]
+
+        return np.where(nodes_a == nodes_b, nodes_a, self.ancestors[0][nodes_a])
+
+    def distance_matrix(self, names):
+        """Returns an array (names x names) of the walk distance between every pair of named nodes."""
+        nodes = self.encode(names)
+        common_ancestors = self.lowest_common_ancestors(nodes[:, None], nodes[None, :])
+        depths = self.depths[nodes]
+        return depths[:, None] + depths[None, :] - 2 * self.depths[common_ancestors]
+
+
 def generate_da_distance_matrix(label_data_dir, labels, normalise=True):
     """Calculates distances between all DA label pairs and returns dataframe.
         Converts da_labels_tree.json to anytree object and calculate distance matrix.
@@ -73,14 +244,12 @@ def generate_da_distance_matrix(label_data_dir, labels, normalise=True):
         matrix_frame (DataFrame): Matrix with distances between each label.
     """
 
-    # Create the labels anytree from the json
+    # Create the labels anytree from the json, and index it
     labels_tree = load_labels_tree(os.path.join(label_data_dir, 'da_labels_tree.json'))
+    tree_index = LabelTreeIndex(labels_tree)
 
     # Calculate the distance between each label pair
-    matrix_arr = []
-    for label_a in labels:
-        row = [get_walk_distance(labels_tree, label_a, label_b) for label_b in labels]
-        matrix_arr.append(row)
+    matrix_arr = tree_index.distance_matrix(labels)
 
     # Create dataframe
     matrix_frame = pd.DataFrame(data=matrix_arr, index=labels, columns=labels)
@@ -180,9 +349,35 @@ def get_ap_distance_postfix_only(label_a, label_b):
     return distance
 
 
+def get_ap_label_features(labels):
+    """Splits each AP label into the features used to compare them.
+
+    Args:
+        labels (list): List of all AP labels.
+
+    Returns:
+        features (DataFrame): Rows are labels, columns are 'prefix' (FPP/SPP, or '' for minimal expansions),
+                              'postfix' (base/pre/insert/post, lower case for minimal expansions) and 'is_expansion'.
+    """
+    features = []
+    for label in labels:
+        pieces = label.split('-')
+        # FPP/SPP labels have a prefix and postfix, minimal expansion labels are the same type as a postfix
+        if len(pieces) == 2:
+            features.append([pieces[0], pieces[1], False])
+        elif len(pieces) == 1:
+            features.append(['', pieces[0].lower(), True])
+        else:
+            raise ValueError("Error when calculating distance between  " + label + " and other AP labels.")
+
+    return pd.DataFrame(features, index=labels, columns=['prefix', 'postfix', 'is_expansion'])
+
+
 def generate_ap_distance_matrix(labels, postfix_only=False):
     """Calculates distances between all AP label pairs and returns dataframe.
 
+    Gives the same distances as get_ap_distance(), or get_ap_distance_postfix_only(), for every label pair.
+
     Args:
         labels (list): List of all AP labels.
         postfix_only (bool): Whether to ignore AP FPP and SPP
@@ -190,14 +385,28 @@ def generate_ap_distance_matrix(labels, postfix_only=False):
     Returns:
         matrix_frame (DataFrame): Matrix with distances between each label.
     """
-    # Calculate the distance between each label pair
-    matrix_arr = []
-    for label_a in labels:
-        if postfix_only:
-            row = [get_ap_distance_postfix_only(label_a, label_b) for label_b in labels]
-        else:
-            row = [get_ap_distance(label_a, label_b) for label_b in labels]
-        matrix_arr.append(row)
+    # Compare the features of every label pair
+    features = get_ap_label_features(labels)
+    prefix = features['prefix'].to_numpy()
+    postfix = features['postfix'].to_numpy()
+    is_expansion = features['is_expansion'].to_numpy(dtype=bool)
+    label_array = np.array(labels, dtype=object)
+
+    same_label = label_array[:, None] == label_array[None, :]
+    different_prefix = prefix[:, None] != prefix[None, :]
+    different_postfix = postfix[:, None] != postfix[None, :]
+    both_pairs = ~is_expansion[:, None] & ~is_expansion[None, :]
+    both_expansions = is_expansion[:, None] & is_expansion[None, :]
+
+    if postfix_only:
+        # Only different postfixes (or expansion types), and different minimal expansions, count
+        matrix_arr = np.where(both_expansions, 1, different_postfix.astype(int))
+    else:
+        # FPP/SPP pairs are 0.5 for each different piece, minimal expansions are 0.5 from pairs with the same postfix
+        pair_distance = 0.5 * different_prefix + 0.5 * different_postfix
+        mixed_distance = np.where(different_postfix, 1.0, 0.5)
+        matrix_arr = np.where(both_pairs, pair_distance, np.where(both_expansions, 1.0, mixed_distance))
+    matrix_arr = np.where(same_label, 0, matrix_arr)
 
     # Create dataframe
     matrix_frame = pd.DataFrame(data=matrix_arr, index=labels, columns=labels)
@@ -234,25 +443,19 @@ def generate_ap_type_distance_matrix(label_data_dir, labels, postfix_only=False,
     else:
         raise FileNotFoundError("Cannot find AP distance matrix in " + ap_matrix_path)
 
-    # Calculate the distance between each label pair
-    matrix_arr = []
-    for label_a in labels:
-        row = []
-        for label_b in labels:
-            distance = 0
-
-            # Get the da label distance
-            label_a_da = label_a.split('-')[-1]
-            label_b_da = label_b.split('-')[-1]
-            distance += da_distance_matrix.loc[label_a_da, label_b_da]
-
-            # Get the ap label distance
-            label_a_ap = '-'.join(label_a.split('-')[:-1])
-            label_b_ap = '-'.join(label_b.split('-')[:-1])
-            distance += ap_distance_matrix.loc[label_a_ap, label_b_ap]
+    # Split each AP-type label into its AP and DA label once, as indexes into the matrices
+    da_labels = [label.split('-')[-1] for label in labels]
+    ap_labels = ['-'.join(label.split('-')[:-1]) for label in labels]
+    da_codes = da_distance_matrix.index.get_indexer(da_labels)
+    ap_codes = ap_distance_matrix.index.get_indexer(ap_labels)
+    if (da_codes < 0).any() or (ap_codes < 0).any():
+        missing = [label for label, da_code, ap_code in zip(labels, da_codes, ap_codes) if da_code < 0 or ap_code < 0]
+        raise KeyError("AP-type labels not in the DA or AP distance matrix: " + ", ".join(missing))
 
-            row.append(distance)
-        matrix_arr.append(row)
+    # Calculate the distance between each label pair, from the da and ap label distances
+    da_matrix = da_distance_matrix.loc[:, da_distance_matrix.index].to_numpy(dtype=float)
+    ap_matrix = ap_distance_matrix.loc[:, ap_distance_matrix.index].to_numpy(dtype=float)
+    matrix_arr = da_matrix[np.ix_(da_codes, da_codes)] + ap_matrix[np.ix_(ap_codes, ap_codes)]
 
     # Create dataframe
     matrix_frame = pd.DataFrame(data=matrix_arr, index=labels, columns=labels)
@@ -273,8 +476,9 @@ def save_distance_matrix(save_dir, matrix, name):
         matrix (DataFrame): Distance matrix to save.
         name (str): What to name the matrix.
     """
-    # Save dataframe
+    # Save dataframe, and the binary copy loaded by LabelRegistry
     save_dataframe(os.path.join(save_dir, name + ".csv"), matrix, index_label='labels')
+    save_distance_matrix_arrays(save_dir, matrix, name.replace("_distance_matrix", ""))
 
     # Create the dataframe as table image
     fig = plot_table(matrix, title='')
@@ -2,6 +2,9 @@ from data_processing.data_utilities import *
 from data_processing.label_data_utilities import *
 from data_processing.timing_data_utilities import *
 from data_processing.rating_data_utilities import *
+from data_processing.stage_utilities import Stage, run_stages
+import argparse
+import sys
 
 # Show full pandas Dataframes
 pd.options.display.width = 0
@@ -23,10 +26,8 @@ if postfix_only:
 timing_data_dir = os.path.join(results_dir, 'timing_data')
 rating_data_dir = os.path.join(results_dir, 'rating_data')
 distr_data_dir = os.path.join(results_dir, 'distribution_data')
-
-# Load the user data and labels
-user_data = load_user_data(user_data_dir)
-labels = load_labels(labels_dir, user_data)
+# Key of each stage when it was last run, so up to date stages are skipped
+stage_keys_path = os.path.join(results_dir, 'stage_keys.json')
 
 # List of sets
 sets_list = ['set_1', 'set_2', 'set_3', 'set_4', 'set_5']
@@ -45,85 +46,184 @@ dialogue_groups['non-task-oriented_dialogues'] = dialogue_groups['scose_dialogue
 dialogue_type_groups = ['task-oriented_dialogues', 'non-task-oriented_dialogues']
 dialogue_corpora_groups = ['kvret_dialogues', 'babl_dialogues', 'scose_dialogues', 'cabnc_dialogues']
 
-print("========================= Agreement Values =========================")
-# If user label data has already been generated then load, else create it
-user_label_data = get_user_label_data(os.path.join(agreement_data_dir, 'user_label_data.pkl'), user_data, labels, sets_list, dialogue_groups)
-
-print("========================= Set:")
-generate_set_agreement_data(user_label_data['sets_labels'], labels, 'Dialogue Set Agreement', agreement_data_dir, postfix_only=postfix_only)
-
-print("========================= Type:")
-generate_group_agreement_data(user_label_data, dialogue_type_groups + ['practice_dialogue'], labels, 'Dialogue Type Agreement', agreement_data_dir, postfix_only=postfix_only)
-
-print("========================= Corpus:")
-generate_group_agreement_data(user_label_data, dialogue_corpora_groups, labels, 'Dialogue Corpora Agreement', agreement_data_dir, postfix_only=postfix_only)
-
-print("========================= Full:")
-generate_full_agreement_data(user_label_data, dialogue_type_groups, labels, 'Dialogue Agreement', agreement_data_dir, postfix_only=postfix_only)
-
-print("========================= Dialogue Times =========================")
-# If user timing data has already been generated then load, else create it
-user_timing_data = get_user_timing_data(os.path.join(timing_data_dir, 'timing_data.pkl'), user_data, sets_list, dialogue_groups)
-
-print("========================= Set:")
-generate_set_time_data(user_timing_data['sets_times'], 'Dialogue Set Times', timing_data_dir)
-
-print("========================= Ordered:")
-generate_ordered_time_data(user_timing_data['ordered_times'], 'Ordered Dialogue Times', timing_data_dir)
-
-print("========================= Type:")
-generate_group_time_data(user_timing_data, dialogue_type_groups + ['practice_dialogue'], 'Dialogue Type Times', timing_data_dir)
-
-print("========================= Corpus:")
-generate_group_time_data(user_timing_data, dialogue_corpora_groups, 'Dialogue Corpora Times', timing_data_dir)
-
-print("========================= Dialogue Ratings =========================")
-# If user confidence data has already been generated then load, else create it
-user_rating_data = get_user_rating_data(os.path.join(rating_data_dir, 'rating_data.pkl'), user_data, sets_list, dialogue_groups)
-
-print("========================= Set:")
-generate_set_rating_data(user_rating_data['sets_ratings'], 'Dialogue Set Confidence Scores', rating_data_dir)
-
-print("========================= Ordered:")
-generate_ordered_rating_data(user_rating_data['ordered_ratings'], 'Ordered Dialogue Confidence Scores', rating_data_dir)
-
-print("========================= Set and Ordered:")
-generate_combined_rating_data(user_rating_data['sets_ratings'], user_rating_data['ordered_ratings'], 'Dialogue Confidence Scores', rating_data_dir)
-
-print("========================= Type:")
-generate_group_rating_data(user_rating_data, dialogue_type_groups + ['practice_dialogue'], 'Dialogue Type Confidence Scores', rating_data_dir)
-
-print("========================= Corpus:")
-generate_group_rating_data(user_rating_data, dialogue_corpora_groups, 'Dialogue Corpora Confidence Scores', rating_data_dir)
-
-print("========================= Statistics =========================")
-print("========================= Agreement Stats:")
-generate_dialogue_type_agreement_statistics('Dialogue Type Agreement Statistics', agreement_data_dir)
-generate_corpora_agreement_statistics('Dialogue Corpora Agreement Statistics', agreement_data_dir)
-generate_label_type_agreement_statistics('Label Type Agreement Statistics', agreement_data_dir)
-generate_coefficient_agreement_statistics('Coefficient Agreement Statistics', agreement_data_dir)
-
-print("========================= Dialogue Times:")
-generate_dialogue_type_timing_statistics(user_timing_data, dialogue_type_groups, 'Dialogue Type Timing Statistics', timing_data_dir)
-generate_corpora_timing_statistics(user_timing_data, dialogue_corpora_groups, 'Dialogue Corpora Timing Statistics', timing_data_dir)
-
-print("========================= Dialogue Ratings:")
-generate_dialogue_type_rating_statistics(user_rating_data, dialogue_type_groups, 'Dialogue Type Rating Statistics', rating_data_dir)
-generate_corpora_rating_statistics(user_rating_data, dialogue_corpora_groups, 'Dialogue Corpora Rating Statistics', rating_data_dir)
-generate_label_type_rating_statistics(user_rating_data, dialogue_type_groups, 'Label Type Rating Statistics', rating_data_dir)
-
-print("========================= Label Distributions =========================")
-print("========================= Type Distributions:")
-generate_group_label_distributions(user_label_data, dialogue_type_groups, labels, 'Dialogue Type', distr_data_dir)
-
-print("========================= Corpora Distributions:")
-generate_group_label_distributions(user_label_data, dialogue_corpora_groups, labels, 'Dialogue Corpora', distr_data_dir)
-
-print("========================= User Distributions:")
-generate_user_label_distributions(user_label_data['sets_labels'], sets_list, labels, 'User', distr_data_dir)
-
-print("========================= Postfix Only Plot =========================")
-generate_postfix_only_plot(agreement_data_dir)
 
-print("========================= Label assignments =========================")
-get_user_label_assignments(user_data, user_label_data, dialogue_corpora_groups + ['practice_dialogue'], dialogue_groups)
+def load_user_data_table(user_data_dir):
+    """Loads the user data into a single long-format table."""
+    return UserDataTable().add_users(iter_user_data(user_data_dir))
+
+
+def get_user_data_labels(user_data, labels_dir):
+    """Gets the labels for the users in the table."""
+    return user_data.get_labels(labels_dir)
+
+
+def generate_from_key(generate_func, data, key, **kwargs):
+    """Calls generate_func with data[key], e.g. the 'sets_labels' of the user label data, as its first argument."""
+    return generate_func(data[key], **kwargs)
+
+
+def generate_combined_ratings(user_rating_data, **kwargs):
+    return generate_combined_rating_data(user_rating_data['sets_ratings'], user_rating_data['ordered_ratings'], **kwargs)
+
+
+def create_stages():
+    """Creates the stages of the data processing, each stage declares the stages and files it depends on and saves."""
+    label_data_path = os.path.join(agreement_data_dir, 'user_label_data.pkl')
+    timing_data_path = os.path.join(timing_data_dir, 'timing_data.pkl')
+    rating_data_path = os.path.join(rating_data_dir, 'rating_data.pkl')
+
+    def csv(save_dir, group_name):
+        return [os.path.join(save_dir, group_name + ".csv")]
+
+    stages = []
+    # User data and labels
+    stages.append(Stage('User Data', load_user_data_table, input_files=[user_data_dir],
+                        args=dict(user_data_dir=user_data_dir)))
+    stages.append(Stage('Labels', get_user_data_labels, inputs=dict(user_data='User Data'), input_files=[labels_dir],
+                        args=dict(labels_dir=labels_dir)))
+    data_inputs = dict(user_data='User Data')
+    label_inputs = dict(labels='Labels')
+
+    # Agreement values, the user label data is generated from cached fragments
+    stages.append(Stage('Label Data', get_user_label_data, inputs=dict(data_inputs, **label_inputs),
+                        outputs=[label_data_path],
+                        args=dict(path=label_data_path, sets_list=sets_list, dialogue_groups=dialogue_groups)))
+    # The agreement stages also calculate their stats on a pool of processes, passed as their jobs argument
+    agreement_args = dict(save_dir=agreement_data_dir, postfix_only=postfix_only)
+    stages.append(Stage('Agreement Set', generate_from_key, inputs=dict(data='Label Data', **label_inputs),
+                        outputs=csv(agreement_data_dir, 'Dialogue Set Agreement'),
+                        args=dict(generate_func=generate_set_agreement_data, key='sets_labels',
+                                  group_name='Dialogue Set Agreement', **agreement_args),
+                        jobs_arg='jobs'))
+    stages.append(Stage('Agreement Type', generate_group_agreement_data,
+                        inputs=dict(group_data='Label Data', **label_inputs),
+                        outputs=csv(agreement_data_dir, 'Dialogue Type Agreement'),
+                        args=dict(groups=dialogue_type_groups + ['practice_dialogue'],
+                                  group_name='Dialogue Type Agreement', **agreement_args),
+                        jobs_arg='jobs'))
+    stages.append(Stage('Agreement Corpus', generate_group_agreement_data,
+                        inputs=dict(group_data='Label Data', **label_inputs),
+                        outputs=csv(agreement_data_dir, 'Dialogue Corpora Agreement'),
+                        args=dict(groups=dialogue_corpora_groups, group_name='Dialogue Corpora Agreement',
+                                  **agreement_args),
+                        jobs_arg='jobs'))
+    stages.append(Stage('Agreement Full', generate_full_agreement_data,
+                        inputs=dict(group_data='Label Data', **label_inputs),
+                        outputs=csv(agreement_data_dir, 'Dialogue Agreement'),
+                        args=dict(groups=dialogue_type_groups, group_name='Dialogue Agreement', **agreement_args),
+                        jobs_arg='jobs'))
+
+    # Dialogue times
+    stages.append(Stage('Timing Data', get_user_timing_data, inputs=data_inputs, outputs=[timing_data_path],
+                        args=dict(path=timing_data_path, sets_list=sets_list, dialogue_groups=dialogue_groups)))
+    timing_inputs = dict(data='Timing Data')
+    stages.append(Stage('Times Set', generate_from_key, inputs=timing_inputs,
+                        outputs=csv(timing_data_dir, 'Dialogue Set Times'),
+                        args=dict(generate_func=generate_set_time_data, key='sets_times',
+                                  group_name='Dialogue Set Times', save_dir=timing_data_dir)))
+    stages.append(Stage('Times Ordered', generate_from_key, inputs=timing_inputs,
+                        outputs=csv(timing_data_dir, 'Ordered Dialogue Times'),
+                        args=dict(generate_func=generate_ordered_time_data, key='ordered_times',
+                                  group_name='Ordered Dialogue Times', save_dir=timing_data_dir)))
+    stages.append(Stage('Times Type', generate_group_time_data, inputs=dict(group_data='Timing Data'),
+                        outputs=csv(timing_data_dir, 'Dialogue Type Times'),
+                        args=dict(groups=dialogue_type_groups + ['practice_dialogue'],
+                                  group_name='Dialogue Type Times', save_dir=timing_data_dir)))
+    stages.append(Stage('Times Corpus', generate_group_time_data, inputs=dict(group_data='Timing Data'),
+                        outputs=csv(timing_data_dir, 'Dialogue Corpora Times'),
+                        args=dict(groups=dialogue_corpora_groups, group_name='Dialogue Corpora Times',
+                                  save_dir=timing_data_dir)))
+
+    # Dialogue ratings
+    stages.append(Stage('Rating Data', get_user_rating_data, inputs=data_inputs, outputs=[rating_data_path],
+                        args=dict(path=rating_data_path, sets_list=sets_list, dialogue_groups=dialogue_groups)))
+    rating_inputs = dict(data='Rating Data')
+    stages.append(Stage('Ratings Set', generate_from_key, inputs=rating_inputs,
+                        outputs=csv(rating_data_dir, 'Dialogue Set Confidence Scores'),
+                        args=dict(generate_func=generate_set_rating_data, key='sets_ratings',
+                                  group_name='Dialogue Set Confidence Scores', save_dir=rating_data_dir)))
+    stages.append(Stage('Ratings Ordered', generate_from_key, inputs=rating_inputs,
+                        outputs=csv(rating_data_dir, 'Ordered Dialogue Confidence Scores'),
+                        args=dict(generate_func=generate_ordered_rating_data, key='ordered_ratings',
+                                  group_name='Ordered Dialogue Confidence Scores', save_dir=rating_data_dir)))
+    stages.append(Stage('Ratings Set and Ordered', generate_combined_ratings,
+                        inputs=dict(user_rating_data='Rating Data'),
+                        outputs=csv(rating_data_dir, 'Dialogue Confidence Scores'),
+                        args=dict(group_name='Dialogue Confidence Scores', save_dir=rating_data_dir)))
+    stages.append(Stage('Ratings Type', generate_group_rating_data, inputs=dict(groups_data='Rating Data'),
+                        outputs=csv(rating_data_dir, 'Dialogue Type Confidence Scores'),
+                        args=dict(groups=dialogue_type_groups + ['practice_dialogue'],
+                                  group_name='Dialogue Type Confidence Scores', save_dir=rating_data_dir)))
+    stages.append(Stage('Ratings Corpus', generate_group_rating_data, inputs=dict(groups_data='Rating Data'),
+                        outputs=csv(rating_data_dir, 'Dialogue Corpora Confidence Scores'),
+                        args=dict(groups=dialogue_corpora_groups, group_name='Dialogue Corpora Confidence Scores',
+                                  save_dir=rating_data_dir)))
+
+    # Statistics, the agreement statistics load the agreement .csv files
+    for name, func, after in [('Dialogue Type Agreement Statistics', generate_dialogue_type_agreement_statistics,
+                               ['Agreement Full']),
+                              ('Dialogue Corpora Agreement Statistics', generate_corpora_agreement_statistics,
+                               ['Agreement Corpus']),
+                              ('Label Type Agreement Statistics', generate_label_type_agreement_statistics,
+                               ['Agreement Full']),
+                              ('Coefficient Agreement Statistics', generate_coefficient_agreement_statistics,
+                               ['Agreement Full'])]:
+        stages.append(Stage(name, func, after=after, outputs=csv(agreement_data_dir, name),
+                            args=dict(group_name=name, save_dir=agreement_data_dir)))
+
+    for name, func, groups in [('Dialogue Type Timing Statistics', generate_dialogue_type_timing_statistics,
+                                dialogue_type_groups),
+                               ('Dialogue Corpora Timing Statistics', generate_corpora_timing_statistics,
+                                dialogue_corpora_groups)]:
+        stages.append(Stage(name, func, inputs=dict(group_data='Timing Data'), outputs=csv(timing_data_dir, name),
+                            args=dict(groups=groups, group_name=name, save_dir=timing_data_dir)))
+
+    for name, func, groups in [('Dialogue Type Rating Statistics', generate_dialogue_type_rating_statistics,
+                                dialogue_type_groups),
+                               ('Dialogue Corpora Rating Statistics', generate_corpora_rating_statistics,
+                                dialogue_corpora_groups),
+                               ('Label Type Rating Statistics', generate_label_type_rating_statistics,
+                                dialogue_type_groups)]:
+        stages.append(Stage(name, func, inputs=dict(group_data='Rating Data'), outputs=csv(rating_data_dir, name),
+                            args=dict(groups=groups, group_name=name, save_dir=rating_data_dir)))
+
+    # Label distributions
+    stages.append(Stage('Type Distributions', generate_group_label_distributions,
+                        inputs=dict(group_data='Label Data', **label_inputs),
+                        outputs=csv(distr_data_dir, 'Dialogue Type Label Distributions'),
+                        args=dict(groups=dialogue_type_groups, group_name='Dialogue Type', save_dir=distr_data_dir)))
+    stages.append(Stage('Corpora Distributions', generate_group_label_distributions,
+                        inputs=dict(group_data='Label Data', **label_inputs),
+                        outputs=csv(distr_data_dir, 'Dialogue Corpora Label Distributions'),
+                        args=dict(groups=dialogue_corpora_groups, group_name='Dialogue Corpora',
+                                  save_dir=distr_data_dir)))
+    stages.append(Stage('User Distributions', generate_from_key, inputs=dict(data='Label Data', **label_inputs),
+                        outputs=csv(distr_data_dir, 'User Label Distributions'),
+                        args=dict(generate_func=generate_user_label_distributions, key='sets_labels',
+                                  groups=sets_list, group_name='User', save_dir=distr_data_dir)))
+
+    # Postfix only plot, loads the full and postfix only corpora agreement .csv files
+    stages.append(Stage('Postfix Only Plot', generate_postfix_only_plot, after=['Agreement Corpus'],
+                        outputs=[os.path.join(agreement_data_dir, "Dialogue Corpora Agreement Postfix-only.png")],
+                        input_files=[os.path.join(agreement_data_dir, 'postfix_only', 'Dialogue Corpora Agreement.csv')],
+                        args=dict(agreement_data_dir=agreement_data_dir)))
+
+    # Label assignments
+    stages.append(Stage('Label Assignments', get_user_label_assignments,
+                        inputs=dict(user_data='User Data', user_label_data='Label Data'),
+                        outputs=[os.path.join('results', 'agreement_data', 'user_label_assignments.pkl')],
+                        args=dict(groups=dialogue_corpora_groups + ['practice_dialogue'],
+                                  dialogue_groups=dialogue_groups)))
+    return stages
+
+
+if __name__ == '__main__':
+    # Usage: python process_data.py [--jobs N] [--force]
+    parser = argparse.ArgumentParser(description="Runs the data analysis and saves to the results directory.")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="Number of processes to run independent stages on, 1 runs them in order and shows plots.")
+    parser.add_argument('--force', action='store_true', help="Run every stage, even if its outputs are up to date.")
+    arguments = parser.parse_args()
+
+    if not run_stages(create_stages(), stage_keys_path, jobs=arguments.jobs, force=arguments.force):
+        sys.exit(1)
@@ -1,17 +1,22 @@
 import os
 import pandas as pd
 from scipy.stats import levene, shapiro
-from data_processing.data_utilities import load_pickle, save_pickle, save_dataframe, dataframe_wide_to_long
+from data_processing.data_utilities import save_pickle, save_dataframe, dataframe_wide_to_long, get_user_table, \
+    FragmentCache, get_cached_fragment
 from data_processing.plot_utilities import plot_facetgrid, plot_violin_chart
 from data_processing.stats_utilites import t_test, multi_t_test, anova_test, tukey_hsd
 
 
 def get_user_rating_data(path, user_data, sets_list, dialogue_groups):
-    """Utility function either loads rating_data dictionary or generates and saves it.
+    """Utility function generates the rating_data dictionary from cached fragments and saves it.
+
+    Each set and dialogue is cached in a FragmentCache, in the 'cache' directory next to path,
+    so only the sets and dialogues with new or changed user data are recomputed,
+    and fragments that are no longer used are deleted.
 
     Args:
-        path (str): Path to load or save timing_data .pkl.
-        user_data (list): List of user data dictionaries.
+        path (str): Path to save rating_data .pkl.
+        user_data (list): List of user data dictionaries, a UserDataTable or its long-format table.
         sets_list (list): List of all dialogue sets.
         dialogue_groups (dict): Dictionary of all dialogue groups (task/non-task and corpora).
 
@@ -21,146 +26,134 @@ def get_user_rating_data(path, user_data, sets_list, dialogue_groups):
               'scose_dialogues', 'cabnc_dialogues', 'non_task_oriented_dialogues']
         values: Dictionary with set or dialogue names as keys and Dataframe of user rating by dialogue.
     """
-    # If the file exists just load it, else generate the data and save
-    if os.path.exists(path):
-        rating_data = pd.read_pickle(path)
-    else:
-        rating_data = dict()
-        rating_data['sets_ratings'] = get_user_ratings_by_sets(user_data, sets_list)
-        rating_data['ordered_ratings'] = get_ordered_user_ratings_by_sets(user_data, sets_list)
-        for group_key in dialogue_groups.keys():
-            group_dict = get_user_ratings_by_dialogues(user_data, dialogue_groups[group_key])
-            group_frame = pd.concat(group_dict.values(), axis=0, sort=False)
-            group_frame.index = group_dict.keys()
-            rating_data[group_key] = group_frame
-        save_pickle(path, rating_data)
+    cache = FragmentCache(os.path.join(os.path.dirname(path), 'cache'), [__file__])
+
+    dialogue_ratings = get_dialogue_ratings(user_data)
+    rating_data = dict()
+    rating_data['sets_ratings'] = get_user_ratings_by_sets(dialogue_ratings, sets_list, cache=cache)
+    rating_data['ordered_ratings'] = get_ordered_user_ratings_by_sets(dialogue_ratings, sets_list, cache=cache)
+    for group_key in dialogue_groups.keys():
+        group_dict = get_user_ratings_by_dialogues(dialogue_ratings, dialogue_groups[group_key], cache=cache)
+        group_frame = pd.concat(group_dict.values(), axis=0, sort=False)
+        group_frame.index = group_dict.keys()
+        rating_data[group_key] = group_frame
+    cache.remove_unused()
+    save_pickle(path, rating_data)
 
     return rating_data
 
 
-def get_user_ratings_by_sets(user_data, sets):
+def get_user_ratings_by_sets(user_data, sets, cache=None):
     """Returns dictionary of all user dialogue rating dataframes for a list of sets."""
+    dialogue_ratings = get_dialogue_ratings(user_data)
 
     sets_dict = dict()
-    # Iterate over all sets and users and get the ratings for each dialogue
+    # Get the ratings for each users dialogues in each set
     for set_name in sets:
-        users_dict = dict()
-        for user in user_data:
-            user_ratings = dict()
-
-            # If the user labeled this set
-            if user['dataset'] == set_name:
-
-                # Get the dialogue ratings
-                for dialogue in user['dialogues']:
-                    # Create new dialogue dictionary if this is the first time seeing it
-                    if dialogue['dialogue_id'] not in user_ratings.keys():
-                        user_ratings[dialogue['dialogue_id']] = dict()
-
-                    # Get the current dialogue ratings
-                    current_dialogue = user_ratings[dialogue['dialogue_id']]
-
-                    # Get the relevant value from the dialogues questions
-                    current_dialogue['da'] = int(dialogue['questions'][0])
-                    current_dialogue['ap'] = int(dialogue['questions'][1])
-                    current_dialogue['ap type'] = int(dialogue['questions'][2])
-
-                # Create dataframe for this user
-                user_frame = pd.DataFrame.from_dict(user_ratings, orient='index')
-                # Set practice as first dialogue
-                practice = pd.Series(user_frame.loc['practice']).to_frame().T
-                user_frame = user_frame.drop('practice')
-                user_frame = pd.concat([practice, user_frame], axis=0)
-                user_frame.columns = pd.MultiIndex.from_product([[user['user_id']], user_frame.columns])
-                # Add to users dict
-                users_dict[user['user_id']] = user_frame
-
-        # Create a dataframe for this set
-        set_frame = pd.concat(users_dict.values(), axis=1)
-
         # Add to set dict
-        sets_dict[set_name.replace("_", " ")] = set_frame
+        set_ratings = dialogue_ratings[dialogue_ratings['dataset'] == set_name]
+        sets_dict[set_name.replace("_", " ")] = get_cached_fragment(cache, set_ratings, get_set_ratings,
+                                                                    'sets_ratings', set_name)
 
     return sets_dict
 
 
-def get_ordered_user_ratings_by_sets(user_data, sets):
+def get_set_ratings(set_ratings):
+    """Returns dataframe of user dialogue ratings for the dialogue rating rows of one set, with practice first."""
+    users_dict = dict()
+    for user_id, user_ratings in set_ratings.groupby('user_id', sort=False, observed=True):
+
+        # Create dataframe for this user
+        user_frame = ratings_to_frame(user_ratings, index=user_ratings['dialogue_id'].to_list())
+        # Set practice as first dialogue
+        practice = pd.Series(user_frame.loc['practice']).to_frame().T
+        user_frame = user_frame.drop('practice')
+        user_frame = pd.concat([practice, user_frame], axis=0)
+        user_frame.columns = pd.MultiIndex.from_product([[user_id], user_frame.columns])
+        # Add to users dict
+        users_dict[user_id] = user_frame
+
+    # Create a dataframe for this set
+    return pd.concat(users_dict.values(), axis=1)
+
+
+def get_ordered_user_ratings_by_sets(user_data, sets, cache=None):
     """Returns dictionary of all user dialogue rating dataframes in the order they were annotated for a list of sets."""
+    dialogue_ratings = get_dialogue_ratings(user_data)
 
     sets_dict = dict()
-    # Iterate over all sets and users and get the ratings for each dialogue
+    # Get the ratings for each users dialogues in each set
     for set_name in sets:
-        users_dict = dict()
-        for user in user_data:
-
-            # If the user labeled this set
-            if user['dataset'] == set_name:
-
-                user_ratings = []
-                # Get the dialogue times
-                for i, dialogue in enumerate(user['dialogues']):
+        # Add to set dict
+        set_ratings = dialogue_ratings[dialogue_ratings['dataset'] == set_name]
+        sets_dict[set_name.replace("_", " ")] = get_cached_fragment(cache, set_ratings, get_ordered_set_ratings,
+                                                                    'ordered_ratings', set_name)
 
-                    # Get the relevant value from the dialogues questions
-                    user_ratings.append([int(i) for i in dialogue['questions']])
+    return sets_dict
 
-                # Create dataframe for this user
-                user_frame = pd.DataFrame(user_ratings,
-                                          index=['Practice', 'Dialogue 1', 'Dialogue 2', 'Dialogue 3', 'Dialogue 4'],
-                                          columns=['da', 'ap', 'ap type'])
-                user_frame.columns = pd.MultiIndex.from_product([[user['user_id']], user_frame.columns])
 
-                # Add to users dict
-                users_dict[user['user_id']] = user_frame
+def get_ordered_set_ratings(set_ratings):
+    """Returns dataframe of user dialogue ratings for the dialogue rating rows of one set, in annotation order."""
+    users_dict = dict()
+    for user_id, user_ratings in set_ratings.groupby('user_id', sort=False, observed=True):
 
-        # Create a dataframe for this set
-        set_frame = pd.concat(users_dict.values(), axis=1)
+        # Create dataframe for this user
+        user_frame = ratings_to_frame(user_ratings,
+                                      index=['Practice', 'Dialogue 1', 'Dialogue 2', 'Dialogue 3', 'Dialogue 4'])
+        user_frame.columns = pd.MultiIndex.from_product([[user_id], user_frame.columns])
 
-        # Add to set dict
-        sets_dict[set_name.replace("_", " ")] = set_frame
+        # Add to users dict
+        users_dict[user_id] = user_frame
 
-    return sets_dict
+    # Create a dataframe for this set
+    return pd.concat(users_dict.values(), axis=1)
 
 
-def get_user_ratings_by_dialogues(user_data, dialogues):
+def get_user_ratings_by_dialogues(user_data, dialogues, cache=None):
     """Returns dictionary of all user dialogue rating dataframes for a list of dialogues."""
+    dialogue_ratings = get_dialogue_ratings(user_data)
 
     dialogues_dict = dict()
-    # Iterate over all dialogues and users and get the ratings for each dialogue
+    # Get the ratings for each user that labeled each dialogue
     for dialogue_id in dialogues:
-        users_dict = dict()
-        for user in user_data:
-            user_ratings = dict()
+        # Add to set dict
+        user_ratings = dialogue_ratings[dialogue_ratings['dialogue_id'] == dialogue_id]
+        dialogues_dict[dialogue_id.replace("_", " ")] = get_cached_fragment(cache, user_ratings,
+                                                                            get_dialogue_user_ratings,
+                                                                            'dialogue_ratings', dialogue_id)
 
-            # For each of the users dialogues
-            for dialogue in user['dialogues']:
-                # If the user labeled this dialogue
-                if dialogue_id == dialogue['dialogue_id']:
+    return dialogues_dict
 
-                    # Create new dialogue dictionary if this is the first time seeing it
-                    if dialogue['dialogue_id'] not in user_ratings.keys():
-                        user_ratings[dialogue['dialogue_id']] = dict()
 
-                    # Get the current dialogue ratings
-                    current_dialogue = user_ratings[dialogue['dialogue_id']]
+def get_dialogue_user_ratings(user_ratings):
+    """Returns dataframe of each users ratings for the dialogue rating rows of one dialogue."""
+    users_dict = dict()
+    for user_id, user_rating in user_ratings.groupby('user_id', sort=False, observed=True):
 
-                    # Get the relevant value from the dialogues questions
-                    current_dialogue['da'] = int(dialogue['questions'][0])
-                    current_dialogue['ap'] = int(dialogue['questions'][1])
-                    current_dialogue['ap type'] = int(dialogue['questions'][2])
+        # Create dataframe for this user
+        dialogue_id = user_rating['dialogue_id'].iloc[0]
+        user_frame = ratings_to_frame(user_rating, index=[dialogue_id])
+        user_frame.columns = pd.MultiIndex.from_product([[user_id], user_frame.columns])
+        # Add to users dict
+        users_dict[user_id] = user_frame
 
-                # Create dataframe for this user
-                user_frame = pd.DataFrame.from_dict(user_ratings, orient='index')
-                user_frame.columns = pd.MultiIndex.from_product([[user['user_id']], user_frame.columns])
-                # Add to users dict
-                users_dict[user['user_id']] = user_frame
+    # Create a dataframe for this dialogue
+    return pd.concat(users_dict.values(), axis=1)
 
-        # Create a dataframe for this dialogue
-        dialogue_frame = pd.concat(users_dict.values(), axis=1)
 
-        # Add to set dict
-        dialogues_dict[dialogue_id.replace("_", " ")] = dialogue_frame
+def get_dialogue_ratings(user_data):
+    """Returns the rows of the long-format user data table with each users dialogue ratings, one row per dialogue."""
+    user_table = get_user_table(user_data)
 
-    return dialogues_dict
+    # Every utterance of a dialogue has the same ratings, so keep the first
+    return user_table.drop_duplicates(['user_index', 'dialogue_index'])
+
+
+def ratings_to_frame(dialogue_ratings, index):
+    """Returns a dataframe of the da, ap and ap type ratings in rows of the user data table."""
+    return pd.DataFrame({'da': dialogue_ratings['da_rating'].astype('int64').to_list(),
+                         'ap': dialogue_ratings['ap_rating'].astype('int64').to_list(),
+                         'ap type': dialogue_ratings['ap_type_rating'].astype('int64').to_list()}, index=index)
 
 
 def generate_set_rating_data(set_data, group_name, save_dir, save=True, show=True):
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import glob
+import hashlib
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Stage:
+    """A stage of the data processing, run by run_stages() once the stages it depends on have finished.
+
+    Args:
+        name (str): Unique name of the stage.
+        func (func): Module level function that runs the stage, so that it can be run in another process.
+        inputs (dict): Keyword argument names of func as keys and stage names as values,
+                       the values returned by those stages are passed to func.
+        after (list): Names of stages that must finish first, e.g. because they save files this stage loads.
+        outputs (list): Paths of the files the stage saves. Stages without outputs are only run when a stage that
+                        needs their value is run.
+        input_files (list): Paths of files or directories the stage reads, that are not created by other stages.
+        args (dict): Any other keyword arguments for func.
+        jobs_arg (str): Keyword argument of func that is passed the number of processes, for stages that run their own
+                        pool of processes. It is not part of the stage key, as the results do not depend on it.
+    """
+    def __init__(self, name, func, inputs=None, after=None, outputs=None, input_files=None, args=None, jobs_arg=None):
+        self.name = name
+        self.func = func
+        self.inputs = inputs or dict()
+        self.after = after or list()
+        self.outputs = outputs or list()
+        self.input_files = input_files or list()
+        self.args = args or dict()
+        self.jobs_arg = jobs_arg
+
+    @property
+    def dependencies(self):
+        return list(self.inputs.values()) + list(self.after)
+
+
+def hash_files(paths):
+    """Returns a hash of the contents of a list of files and directories (including their sub-directories)."""
+    file_hash = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True))
+        else:
+            files = [path]
+        for file_path in files:
+            if not os.path.isfile(file_path):
+                continue
+            file_hash.update(file_path.encode('utf-8'))
+            with open(file_path, 'rb') as file:
+                file_hash.update(file.read())
+    return file_hash.hexdigest()
+
+
+def key_default(value):
+    """JSON encodes functions by name for stage keys, as their default str() changes every run."""
+    if callable(value):
+        return value.__module__ + '.' + value.__qualname__
+    return str(value)
+
+
+def get_stage_keys(stages, code_files):
+    """Returns a key for each stage, a hash of the code, its arguments, input files and the keys of its dependencies."""
+    code_hash = hash_files(code_files)
+
+    stage_keys = dict()
+    for stage in stages:
+        key_hash = hashlib.sha256(code_hash.encode('utf-8'))
+        key_hash.update(json.dumps([stage.name, stage.func, stage.outputs], default=key_default).encode('utf-8'))
+        key_hash.update(json.dumps(stage.args, sort_keys=True, default=key_default).encode('utf-8'))
+        key_hash.update(hash_files(stage.input_files).encode('utf-8'))
+        for dependency in sorted(stage.dependencies):
+            key_hash.update(stage_keys[dependency].encode('utf-8'))
+        stage_keys[stage.name] = key_hash.hexdigest()
+    return stage_keys
+
+
+def sort_stages(stages):
+    """Returns the stages in an order where every stage is after the stages it depends on."""
+    stage_dict = {stage.name: stage for stage in stages}
+    if len(stage_dict) != len(stages):
+        raise ValueError("Stage names must be unique.")
+
+    sorted_stages = []
+    visiting = set()
+    visited = set()
+
+    def visit(stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError("Stage \"" + stage.name + "\" depends on itself.")
+        visiting.add(stage.name)
+        for dependency in stage.dependencies:
+            if dependency not in stage_dict:
+                raise ValueError("Stage \"" + stage.name + "\" depends on unknown stage \"" + dependency + "\".")
+            visit(stage_dict[dependency])
+        visiting.remove(stage.name)
+        visited.add(stage.name)
+        sorted_stages.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return sorted_stages
+
+
+def load_stage_keys(path):
+    if os.path.exists(path):
+        with open(path) as file:
+            return json.load(file)
+    return dict()
+
+
+def save_stage_keys(path, stage_keys):
+    # Write to a temporary file first, so the keys are never partly written
+    with open(path + '.tmp', 'w') as file:
+        json.dump(stage_keys, file, indent=4, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def init_stage_process():
+    """Runs in each pool process, plots are only saved so use a non-interactive backend."""
+    import matplotlib
+    matplotlib.use('Agg')
+    warnings.filterwarnings('ignore', message='.*non-interactive.*')
+
+
+def run_stage(stage, input_values, return_value=True, jobs=1):
+    """Runs a stage, returns (value, None) or (None, error message).
+
+    Only values other stages need are returned, as they are sent back from the pool processes (and plots are not).
+    """
+    if stage.jobs_arg is not None:
+        input_values = dict(input_values, **{stage.jobs_arg: jobs})
+    try:
+        value = stage.func(**stage.args, **input_values)
+        return (value if return_value else None), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run_stages(stages, keys_path, jobs=1, force=False, code_files=None):
+    """Runs each stage whose outputs are not up to date, and the stages they need values from.
+
+    A stage is up to date if all its outputs exist and its key (see get_stage_keys()) is the same as when it was last
+    run. Stages that do not depend on each other are run at the same time on a pool of jobs processes,
+    if jobs is 1 they are run in order in this process.
+
+    Args:
+        stages (list): List of Stage.
+        keys_path (str): Path of the .json file with the key of each stage when it was last run.
+        jobs (int): Number of processes to run stages on, also passed to the stages with a jobs_arg.
+        force (bool): Whether to run every stage, even if it is up to date.
+        code_files (list): Source files the stages depend on, default is the data_processing .py files.
+
+    Returns:
+        success (bool): False if any stage failed.
+    """
+    stages = sort_stages(stages)
+    stage_dict = {stage.name: stage for stage in stages}
+    if code_files is None:
+        code_files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')))
+    stage_keys = get_stage_keys(stages, code_files)
+    saved_keys = load_stage_keys(keys_path)
+
+    # Run stages that are out of date, and (in reverse order) the stages whose values they need
+    to_run = set()
+    for stage in stages:
+        if stage.outputs and (force or saved_keys.get(stage.name) != stage_keys[stage.name] or
+                              not all(os.path.exists(path) for path in stage.outputs)):
+            to_run.add(stage.name)
+    for stage in reversed(stages):
+        if stage.name in to_run:
+            to_run.update(stage.inputs.values())
+    for stage in stages:
+        if stage.outputs and stage.name not in to_run:
+            print("Skipping " + stage.name + ", outputs are up to date.")
+
+    # Names of the stages whose values are passed to other stages
+    needed_values = set(name for stage in stages for name in stage.inputs.values())
+
+    values = dict()
+    failed = set()
+    finished = set(name for name in stage_dict if name not in to_run)
+
+    def ready(stage):
+        return all(dependency in finished for dependency in stage.dependencies)
+
+    def finish(stage, value, error):
+        if error is not None:
+            print("Error! Stage " + stage.name + " failed:\n" + error)
+            failed.add(stage.name)
+        else:
+            values[stage.name] = value
+            if stage.outputs:
+                saved_keys[stage.name] = stage_keys[stage.name]
+                save_stage_keys(keys_path, saved_keys)
+        finished.add(stage.name)
+
+    def skip_failed(pending):
+        # Stages that depend on a failed stage are not run
+        for stage in list(pending):
+            if any(dependency in failed for dependency in stage.dependencies):
+                print("Error! Stage " + stage.name + " not run, a stage it depends on failed.")
+                failed.add(stage.name)
+                finished.add(stage.name)
+                pending.remove(stage)
+
+    pending = [stage for stage in stages if stage.name in to_run]
+    if jobs <= 1:
+        for stage in list(pending):
+            skip_failed(pending)
+            if stage not in pending:
+                continue
+            pending.remove(stage)
+            print("========================= " + stage.name)
+            input_values = {arg: values[name] for arg, name in stage.inputs.items()}
+            finish(stage, *run_stage(stage, input_values, stage.name in needed_values))
+        return not failed
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_stage_process) as executor:
+        running = dict()
+        while pending or running:
+            skip_failed(pending)
+
+            # Submit every stage whose dependencies have finished
+            for stage in [stage for stage in pending if ready(stage)]:
+                pending.remove(stage)
+                print("========================= Started " + stage.name)
+                sys.stdout.flush()
+                input_values = {arg: values[name] for arg, name in stage.inputs.items()}
+                running[executor.submit(run_stage, stage, input_values, stage.name in needed_values, jobs)] = stage
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                finish(stage, *future.result())
+                print("========================= Finished " + stage.name)
+
+    return not failed
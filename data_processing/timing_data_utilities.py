@@ -1,17 +1,22 @@
 import os
 import pandas as pd
 from scipy.stats import levene, shapiro
-from data_processing.data_utilities import load_pickle, save_pickle, save_dataframe, dataframe_wide_to_long
+from data_processing.data_utilities import save_pickle, save_dataframe, dataframe_wide_to_long, get_user_table, \
+    FragmentCache, get_cached_fragment
 from data_processing.plot_utilities import plot_bar_chart, plot_violin_chart, plot_facetgrid
 from data_processing.stats_utilites import t_test, anova_test, tukey_hsd
 
 
 def get_user_timing_data(path, user_data, sets_list, dialogue_groups, mean_utt=False):
-    """Utility function either loads timing_data dictionary or generates and saves it.
+    """Utility function generates the timing_data dictionary from cached fragments and saves it.
+
+    Each set and dialogue is cached in a FragmentCache, in the 'cache' directory next to path,
+    so only the sets and dialogues with new or changed user data are recomputed,
+    and fragments that are no longer used are deleted.
 
     Args:
-        path (str): Path to load or save timing_data .pkl.
-        user_data (list): List of user data dictionaries.
+        path (str): Path to save timing_data .pkl.
+        user_data (list): List of user data dictionaries, a UserDataTable or its long-format table.
         sets_list (list): List of all dialogue sets.
         dialogue_groups (dict): Dictionary of all dialogue groups (task/non-task and corpora).
         mean_utt (bool): Determines if times are the average utterance time, or sum of utterance times.
@@ -22,155 +27,128 @@ def get_user_timing_data(path, user_data, sets_list, dialogue_groups, mean_utt=F
               'scose_dialogues', 'cabnc_dialogues', 'non_task_oriented_dialogues']
         values: Dictionary with set or dialogue names as keys and Dataframe of user times by dialogue.
     """
-    # If the file exists just load it, else generate the data and save
-    if os.path.exists(path):
-        timing_data = load_pickle(path)
-    else:
-        timing_data = dict()
-        timing_data['sets_times'] = get_user_timings_by_sets(user_data, sets_list, mean_utt=mean_utt)
-        timing_data['ordered_times'] = get_ordered_user_timings_by_sets(user_data, sets_list, mean_utt=True)
-        for group_key in dialogue_groups.keys():
-            group_dict = get_user_timings_by_dialogues(user_data, dialogue_groups[group_key], mean_utt=True)
-            group_frame = pd.concat(group_dict.values(), axis=0, sort=False)
-            group_frame.index = group_dict.keys()
-            timing_data[group_key] = group_frame
-        save_pickle(path, timing_data)
+    cache = FragmentCache(os.path.join(os.path.dirname(path), 'cache'), [__file__])
+
+    user_table = get_user_table(user_data)
+    timing_data = dict()
+    timing_data['sets_times'] = get_user_timings_by_sets(user_table, sets_list, mean_utt=mean_utt, cache=cache)
+    timing_data['ordered_times'] = get_ordered_user_timings_by_sets(user_table, sets_list, mean_utt=True, cache=cache)
+    for group_key in dialogue_groups.keys():
+        group_dict = get_user_timings_by_dialogues(user_table, dialogue_groups[group_key], mean_utt=True, cache=cache)
+        group_frame = pd.concat(group_dict.values(), axis=0, sort=False)
+        group_frame.index = group_dict.keys()
+        timing_data[group_key] = group_frame
+    cache.remove_unused()
+    save_pickle(path, timing_data)
 
     return timing_data
 
 
-def get_user_timings_by_sets(user_data, sets, mean_utt=False):
+def get_user_timings_by_sets(user_data, sets, mean_utt=False, cache=None):
     """Returns dictionary of all user dialogue timing dataframes for a list of sets."""
+    user_table = get_user_table(user_data)
 
     sets_dict = dict()
-    # Iterate over all sets and users and get the times for each dialogue
+    # Get the times for each users dialogues in each set
     for set_name in sets:
-        dialogue_times = dict()
-        for user in user_data:
-
-            # If the user labeled this set
-            if user['dataset'] == set_name:
-
-                # Get the dialogue times
-                for dialogue in user['dialogues']:
-                    # Create new dialogue dictionary if this is the first time seeing it
-                    if dialogue['dialogue_id'] not in dialogue_times.keys():
-                        dialogue_times[dialogue['dialogue_id']] = dict()
-
-                    # Set the current dialogue
-                    current_dialogue = dialogue_times[dialogue['dialogue_id']]
-
-                    # TODO Don't use dialogue total as usr6-1 "KB7RE015" is very wrong
-                    # current_dialogue[user['user_id']] = dialogue['time']
-
-                    # Get the sum of all the utterance times
-                    utt_time_sum = 0
-                    for utterance in dialogue['utterances']:
-                        utt_time_sum += utterance['time']
-
-                    # Divide by the number of utterances if we want the mean utterance time
-                    if mean_utt:
-                        utt_time_sum /= len(dialogue['utterances'])
+        # Add to dict
+        sets_dict[set_name.replace("_", " ")] = get_cached_fragment(cache, user_table[user_table['dataset'] == set_name],
+                                                                    lambda rows: get_set_times(rows, mean_utt),
+                                                                    'sets_times', set_name, mean_utt)
 
-                    # Divide by 1k to convert milliseconds to seconds
-                    current_dialogue[user['user_id']] = utt_time_sum / 1000
+    return sets_dict
 
-        # Create a dataframe for this set
-        set_frame = pd.DataFrame.from_dict(dialogue_times, orient='index')
 
-        # Set practice as first dialogue
-        practice = pd.Series(set_frame.loc['practice']).to_frame().T
-        set_frame = set_frame.drop('practice')
-        set_frame = pd.concat([practice, set_frame], axis=0)
+def get_set_times(set_rows, mean_utt=False):
+    """Returns dataframe of user dialogue times for the rows of one set, with the practice dialogue first."""
+    # TODO Don't use dialogue total as usr6-1 "KB7RE015" is very wrong
+    set_times = get_dialogue_times(set_rows, mean_utt)
 
-        # Add to dict
-        sets_dict[set_name.replace("_", " ")] = set_frame
+    # Create a dataframe for this set, with dialogues and users in the order they are first seen
+    set_frame = pivot_in_order(set_times, 'dialogue_id', 'user_id')
 
-    return sets_dict
+    # Set practice as first dialogue
+    practice = pd.Series(set_frame.loc['practice']).to_frame().T
+    set_frame = set_frame.drop('practice')
+    return pd.concat([practice, set_frame], axis=0)
 
 
-def get_ordered_user_timings_by_sets(user_data, sets, mean_utt=False):
+def get_ordered_user_timings_by_sets(user_data, sets, mean_utt=False, cache=None):
     """Returns dictionary of all user dialogue timing dataframes in the order they were annotated for a list of sets."""
+    user_table = get_user_table(user_data)
 
     sets_dict = dict()
-    # Iterate over all sets and users and get the times for each dialogue
+    # Get the times for each users dialogues in each set
     for set_name in sets:
-        users_dict = dict()
-        for user in user_data:
-
-            # If the user labeled this set
-            if user['dataset'] == set_name:
-
-                user_times = []
-                # Get the dialogue times
-                for i, dialogue in enumerate(user['dialogues']):
-
-                    # Get the sum of all the utterance times
-                    utt_time_sum = 0
-                    for utterance in dialogue['utterances']:
-                        utt_time_sum += utterance['time']
-
-                    # Divide by the number of utterances if we want the mean utterance time
-                    if mean_utt:
-                        utt_time_sum /= len(dialogue['utterances'])
-
-                    # Add to users times (Divide by 1k to convert milliseconds to seconds)
-                    user_times.append(utt_time_sum / 1000)
+        # Add to dict
+        sets_dict[set_name.replace("_", " ")] = get_cached_fragment(cache, user_table[user_table['dataset'] == set_name],
+                                                                    lambda rows: get_ordered_set_times(rows, mean_utt),
+                                                                    'ordered_times', set_name, mean_utt)
 
-                # Add user to set
-                users_dict[user['user_id']] = user_times
+    return sets_dict
 
-        # Create a dataframe for this set
-        set_frame = pd.DataFrame(users_dict, index=['Practice', 'Dialogue 1', 'Dialogue 2', 'Dialogue 3', 'Dialogue 4'])
 
-        # Add to dict
-        sets_dict[set_name.replace("_", " ")] = set_frame
+def get_ordered_set_times(set_rows, mean_utt=False):
+    """Returns dataframe of user dialogue times for the rows of one set, in the order the users annotated them."""
+    set_times = get_dialogue_times(set_rows, mean_utt)
 
-    return sets_dict
+    # Create a dataframe for this set, with the dialogues in the order the users annotated them
+    set_frame = pivot_in_order(set_times, 'dialogue_index', 'user_id')
+    set_frame.index = ['Practice', 'Dialogue 1', 'Dialogue 2', 'Dialogue 3', 'Dialogue 4']
+    return set_frame
 
 
-def get_user_timings_by_dialogues(user_data, dialogues, mean_utt=False):
+def get_user_timings_by_dialogues(user_data, dialogues, mean_utt=False, cache=None):
     """Returns dictionary of all user dialogue timing dataframes for a list of dialogues."""
+    user_table = get_user_table(user_data)
 
     dialogues_dict = dict()
-    # Iterate over all dialogues and users and get the times for each dialogue
+    # Get the times for each user that labeled each dialogue
     for dialogue_id in dialogues:
-        dialogue_times = dict()
-        for user in user_data:
-
-            for dialogue in user['dialogues']:
-
-                # If the user labeled this dialogue
-                if dialogue['dialogue_id'] == dialogue_id:
-                    # Create new dialogue dictionary if this is the first time seeing it
-                    if dialogue['dialogue_id'] not in dialogue_times.keys():
-                        dialogue_times[dialogue['dialogue_id']] = dict()
-
-                    # Set the current dialogue
-                    current_dialogue = dialogue_times[dialogue['dialogue_id']]
-
-                    # TODO Don't use dialogue total as usr6-1 "KB7RE015" is very wrong
-                    # current_dialogue[user['user_id']] = dialogue['time']
+        # TODO Don't use dialogue total as usr6-1 "KB7RE015" is very wrong
+        # Create a dataframe for this dialogue and add to dict
+        dialogue_rows = user_table[user_table['dialogue_id'] == dialogue_id]
+        dialogues_dict[dialogue_id.replace("_", " ")] = get_cached_fragment(
+            cache, dialogue_rows, lambda rows: pivot_in_order(get_dialogue_times(rows, mean_utt), 'dialogue_id', 'user_id'),
+            'dialogue_times', dialogue_id, mean_utt)
 
-                    # Get the sum of all the utterance times
-                    utt_time_sum = 0
-                    for utterance in dialogue['utterances']:
-                        utt_time_sum += utterance['time']
-
-                    # Divide by the number of utterances if we want the mean utterance time
-                    if mean_utt:
-                        utt_time_sum /= len(dialogue['utterances'])
+    return dialogues_dict
 
-                    # Divide by 1k to convert milliseconds to seconds
-                    current_dialogue[user['user_id']] = utt_time_sum / 1000
 
-        # Create a dataframe for this set
-        dialogue_frame = pd.DataFrame.from_dict(dialogue_times, orient='index')
+def get_dialogue_times(rows, mean_utt=False):
+    """Returns the sum, or mean if mean_utt=True, of each users dialogue utterance times in seconds.
 
-        # Add to dict
-        dialogues_dict[dialogue_id.replace("_", " ")] = dialogue_frame
+    Args:
+        rows (DataFrame): Rows of the long-format user data table.
+        mean_utt (bool): Determines if times are the average utterance time, or sum of utterance times.
 
-    return dialogues_dict
+    Returns:
+        dialogue_times (DataFrame): One row per user and dialogue, in the order they are first seen,
+        with 'user_id', 'dialogue_id', 'dialogue_index' and 'time' columns.
+    """
+    # Get the sum of all the utterance times
+    dialogue_times = rows.groupby(['user_index', 'user_id', 'dialogue_index', 'dialogue_id'], sort=False, observed=True)
+    dialogue_times = dialogue_times['time'].agg(['sum', 'count']).reset_index()
+    dialogue_times[['user_id', 'dialogue_id']] = dialogue_times[['user_id', 'dialogue_id']].astype(str)
+
+    # Divide by the number of utterances if we want the mean utterance time
+    utt_times = dialogue_times['sum']
+    if mean_utt:
+        utt_times = utt_times / dialogue_times['count']
+
+    # Divide by 1k to convert milliseconds to seconds
+    dialogue_times['time'] = utt_times / 1000
+    return dialogue_times[['user_id', 'dialogue_id', 'dialogue_index', 'time']]
+
+
+def pivot_in_order(dialogue_times, index, columns):
+    """Pivots dialogue times into a dataframe, keeping the index and columns in the order they are first seen."""
+    if len(dialogue_times) == 0:
+        return pd.DataFrame()
+    frame = dialogue_times.pivot(index=index, columns=columns, values='time')
+    frame = frame.reindex(index=dialogue_times[index].unique(), columns=dialogue_times[columns].unique())
+    frame.index.name, frame.columns.name = None, None
+    return frame
 
 
 def generate_set_time_data(set_data, group_name, save_dir, save=True, show=True):
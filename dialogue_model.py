@@ -1,3 +1,5 @@
+from sys import intern
+
 
 class DialogueModel:
     def __init__(self, dataset, dialogues, current_dialogue_index,  user_id):
@@ -12,6 +14,9 @@ class DialogueModel:
         self.dialogues = dialogues
         self.num_dialogues = len(self.dialogues)
 
+        # Index of each dialogue id in the dialogues list
+        self.dialogue_indexes = {dialogue.dialogue_id: i for i, dialogue in enumerate(self.dialogues)}
+
         # Current dialogue
         self.current_dialogue_index = current_dialogue_index
 
@@ -21,6 +26,9 @@ class DialogueModel:
         self.num_complete = 0
         self.num_incomplete = 0
 
+        # Labelled and completed state of each dialogue when it was last counted
+        self.dialogue_states = dict()
+
         # Count labelled and unlabelled dialogues
         self.update_labelled_dialogue_counts()
 
@@ -42,21 +50,21 @@ class DialogueModel:
 
     def get_dialogue(self, dialogue_id):
         # Find the matching dialogue
-        for dialogue in self.dialogues:
-            if dialogue.dialogue_id == dialogue_id:
-                return dialogue
-            else:
-                return False
+        if dialogue_id in self.dialogue_indexes:
+            return self.dialogues[self.dialogue_indexes[dialogue_id]]
+        else:
+            return False
 
     def set_dialogue(self, new_dialogue):
         # Find the matching dialogue
-        for i, dialogue in enumerate(self.dialogues):
-            if dialogue.dialogue_id == new_dialogue.dialogue_id:
-                # Update dialogue with new data
-                self.dialogues[i] = new_dialogue
-                # Update dialogue states
-                self.update_labelled_dialogue_counts()
-                return True
+        if new_dialogue.dialogue_id not in self.dialogue_indexes:
+            return False
+
+        # Update dialogue with new data
+        self.dialogues[self.dialogue_indexes[new_dialogue.dialogue_id]] = new_dialogue
+        # Update dialogue states
+        self.update_dialogue_counts(new_dialogue)
+        return True
 
     def update_labelled_dialogue_counts(self):
 
@@ -65,20 +73,41 @@ class DialogueModel:
         self.num_unlabelled = 0
         self.num_complete = 0
         self.num_incomplete = 0
+        self.dialogue_states = dict()
 
         # Update counts
         for dialogue in self.dialogues:
+            self.update_dialogue_counts(dialogue)
 
-            # Labelled
-            if dialogue.check_labels():
-                self.num_labelled += 1
+    def update_dialogue_counts(self, dialogue):
+
+        # Remove the dialogues previous state from the counts
+        if dialogue.dialogue_id in self.dialogue_states:
+            is_labelled, is_complete = self.dialogue_states[dialogue.dialogue_id]
+            if is_labelled:
+                self.num_labelled -= 1
             else:
-                self.num_unlabelled += 1
-            # Completed
-            if dialogue.is_complete:
-                self.num_complete += 1
+                self.num_unlabelled -= 1
+            if is_complete:
+                self.num_complete -= 1
             else:
-                self.num_incomplete += 1
+                self.num_incomplete -= 1
+
+        # Add its current state
+        is_labelled = dialogue.check_labels()
+        is_complete = dialogue.is_complete
+        # Labelled
+        if is_labelled:
+            self.num_labelled += 1
+        else:
+            self.num_unlabelled += 1
+        # Completed
+        if is_complete:
+            self.num_complete += 1
+        else:
+            self.num_incomplete += 1
+
+        self.dialogue_states[dialogue.dialogue_id] = (is_labelled, is_complete)
 
     def inc_current_dialogue(self):
 
@@ -102,15 +131,25 @@ class DialogueModel:
 
 
 class Dialogue:
+    # Fixed attributes, so each dialogue does not need an attribute dictionary
+    __slots__ = ('dialogue_id', 'utterances', 'num_utterances', 'is_labelled', 'is_complete', 'time', 'questions',
+                 'version', 'json_bytes')
 
     def __init__(self, dialogue_id, utterances, num_utterances):
-        self.dialogue_id = dialogue_id
+        self.dialogue_id = intern(dialogue_id)
         self.utterances = utterances
         self.num_utterances = num_utterances
         self.is_labelled = False
         self.is_complete = False
         self.time = 0
         self.questions = []
+        # Incremented each time the dialogue is saved, clients send it back so changes to an old version are rejected
+        self.version = 0
+        # Encoded JSON of the dialogue, cleared whenever the dialogue or its utterances change
+        self.json_bytes = None
+        # Each utterance clears the encoded JSON when it is changed
+        for utt in self.utterances:
+            utt.dialogue = self
         self.check_labels()
 
     def __repr__(self):
@@ -125,48 +164,60 @@ class Dialogue:
     def set_is_labelled(self, value):
         if isinstance(value, bool):
             self.is_labelled = value
+            self.json_bytes = None
         else:
             print("Error! " + value + " is not a bool!")
 
     def set_is_complete(self, value):
         if isinstance(value, bool):
             self.is_complete = value
+            self.json_bytes = None
         else:
             print("Error! " + value + " is not a bool!")
 
     def set_time(self, value):
         if isinstance(value, int):
             self.time = value
+            self.json_bytes = None
         else:
             print("Error! " + value + " is not an int!")
 
     def set_questions(self, value):
         if isinstance(value, list):
             self.questions = value
+            self.json_bytes = None
         else:
             print("Error! " + value + " is not a list!")
 
+    def clear_json_bytes(self):
+        # Called by the utterance setters when they are changed, so the dialogue is encoded again
+        self.json_bytes = None
+
     def check_labels(self):
         # Check if any utterances still have default labels
-        for utt in self.utterances:
-            if not utt.check_labels():
-                self.is_labelled = False
-                return self.is_labelled
-
-        self.is_labelled = True
+        is_labelled = all(utt.check_labels() for utt in self.utterances)
+        if is_labelled != self.is_labelled:
+            self.is_labelled = is_labelled
+            self.json_bytes = None
         return self.is_labelled
 
 
 class Utterance:
+    # Fixed attributes, so each utterance does not need an attribute dictionary
+    __slots__ = ('text', 'speaker', 'ap_label', 'da_label', 'is_labelled', 'ap_flag', 'da_flag', 'time', 'dialogue')
+
     def __init__(self, text, speaker='', ap_label='AP-Label', da_label='DA-Label'):
         self.text = text
-        self.speaker = speaker
-        self.ap_label = ap_label
-        self.da_label = da_label
+        # Speakers and labels are interned so every user shares one copy of each string
+        self.speaker = intern(speaker)
+        self.ap_label = intern(ap_label)
+        self.da_label = intern(da_label)
         self.is_labelled = False
         self.ap_flag = False
         self.da_flag = False
         self.time = 0
+        # The dialogue this utterance belongs to, set by the dialogue
+        self.dialogue = None
         self.check_labels()
 
     def __repr__(self):
@@ -177,47 +228,57 @@ class Utterance:
 
     def set_ap_label(self, label):
         if isinstance(label, str):
-            self.ap_label = label
+            self.ap_label = intern(label)
             self.check_labels()
+            self.clear_json_bytes()
         else:
             print("Error! " + label + " is not a string!")
 
     def set_da_label(self, label):
         if isinstance(label, str):
-            self.da_label = label
+            self.da_label = intern(label)
             self.check_labels()
+            self.clear_json_bytes()
         else:
             print("Error! " + label + " is not a string!")
 
     def set_is_labelled(self, value):
         if isinstance(value, bool):
             self.is_labelled = value
+            self.clear_json_bytes()
         else:
             print("Error! " + value + " is not a bool!")
 
     def set_ap_flag(self, value):
         if isinstance(value, bool):
             self.ap_flag = value
+            self.clear_json_bytes()
         else:
             print("Error! " + value + " is not a bool!")
 
     def set_da_flag(self, value):
         if isinstance(value, bool):
             self.da_flag = value
+            self.clear_json_bytes()
         else:
             print("Error! " + value + " is not a bool!")
 
     def set_time(self, value):
         if isinstance(value, int):
             self.time = value
+            self.clear_json_bytes()
         else:
             print("Error! " + value + " is not an int!")
 
+    def clear_json_bytes(self):
+        # The dialogues encoded JSON includes this utterance, so it must be encoded again
+        if self.dialogue is not None:
+            self.dialogue.clear_json_bytes()
+
     def check_labels(self):
         # Check if utterance still has default labels
-        if self.ap_label == 'AP-Label' or self.da_label == 'DA-Label':
-            self.is_labelled = False
-            return self.is_labelled
-
-        self.is_labelled = True
+        is_labelled = self.ap_label != 'AP-Label' and self.da_label != 'DA-Label'
+        if is_labelled != self.is_labelled:
+            self.is_labelled = is_labelled
+            self.clear_json_bytes()
         return self.is_labelled
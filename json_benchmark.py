@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import utilities as utils
+
+# Measures the load and save throughput of the user dialogue files with each JSON encoding
+# Usage: python json_benchmark.py [num_repeats]
+
+# Data paths
+user_data_path = "static/data/user_dialogues/"
+
+# Number of times each user is loaded/saved
+num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+# Load the bundled users and create their models
+user_ids = sorted(file.split('.')[0] for file in os.listdir(user_data_path) if file.endswith('.json'))
+models = [utils.create_model(None, utils.load_json_data(user_data_path, user_id), user_id, user_data=True)
+          for user_id in user_ids]
+output_path = tempfile.mkdtemp() + "/"
+
+
+def report(name, total_bytes, total_time):
+    print(name.ljust(40) + str(round(total_bytes / total_time / 1024 / 1024, 1)).rjust(8) + " MiB/s" +
+          str(round(total_time / (len(user_ids) * num_repeats) * 1000, 3)).rjust(10) + " ms/user")
+
+
+def benchmark_save(name, encode):
+    # Encode and save every user, as JsonStorage does on each save
+    total_bytes = 0
+    start = time.perf_counter()
+    for i in range(num_repeats):
+        for model in models:
+            body = encode(model)
+            utils.save_json_data(output_path, model.user_id, body)
+            total_bytes += len(body)
+    report(name, total_bytes, time.perf_counter() - start)
+
+
+def benchmark_load(name, decode):
+    # Read and decode every user saved in the last format
+    total_bytes = 0
+    start = time.perf_counter()
+    for i in range(num_repeats):
+        for user_id in user_ids:
+            with open(output_path + user_id + ".json", 'rb') as file:
+                body = file.read()
+            decode(body)
+            total_bytes += len(body)
+    report(name, total_bytes, time.perf_counter() - start)
+
+
+def changed_model_to_json(model):
+    # One dialogue changes between saves, so the others use their cached bytes
+    model.dialogues[model.current_dialogue_index].clear_json_bytes()
+    return utils.model_to_json(model)
+
+
+print("Users: " + str(len(user_ids)) + ", repeats: " + str(num_repeats) +
+      ", orjson: " + ("installed" if utils.orjson is not None else "not installed"))
+print("Pretty size: " + str(sum(len(utils.model_to_json(model, pretty=True)) for model in models)) + " bytes, "
+      "compact size: " + str(sum(len(utils.model_to_json(model)) for model in models)) + " bytes")
+
+print("\nSave:")
+benchmark_save("pretty json (previous)", lambda model: utils.to_json_bytes(utils.model_to_dict(model), pretty=True))
+benchmark_save("compact json", lambda model: json.dumps(utils.model_to_dict(model), separators=(',', ':'),
+                                                      ensure_ascii=False).encode('utf-8'))
+benchmark_save("compact (default codec)", lambda model: utils.to_json_bytes(utils.model_to_dict(model)))
+benchmark_save("compact, cached dialogues", changed_model_to_json)
+
+print("\nLoad:")
+benchmark_load("json", json.loads)
+benchmark_load("default codec", utils.from_json_bytes)
+
+# Check the compact files decode to the same data as the original files
+for user_id in user_ids:
+    if utils.load_json_data(output_path, user_id) != utils.model_to_dict(models[user_ids.index(user_id)]):
+        print("Error! Saved user " + user_id + " does not match their model!")
+        sys.exit(1)
+print("\nSaved users match their models.")
+
+shutil.rmtree(output_path)
@@ -1,12 +1,15 @@
 import json
 import os
 import utilities as utils
+from storage import create_storage, WriteBehindStorage
+from sessions import create_session_store
 from user import User
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
 from flask import Flask, render_template, request
 
 app = Flask(__name__)
-app.secret_key = os.urandom(32)
+# Every server process must use the same key to share login sessions, so set SECRET_KEY if running more than one
+app.secret_key = os.environ.get('SECRET_KEY', os.urandom(32))
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -17,9 +20,29 @@ label_data_path = os.path.join(data_path, "labels/")
 dialogue_data_path = os.path.join(data_path, "dialogues/")
 user_data_path = os.path.join(data_path, "user_dialogues/")
 
+# How users dialogues are saved, one of:
+# 'sqlite' - SQLite database of users, dialogues, utterances and labels (user_dialogues/user_dialogues.db)
+# 'journal' - Saves are appended to a journal, which is periodically compacted into the users JSON file
+# 'dialogue' - Each dialogue is saved to its own JSON file in a directory for the user
+# 'json' - The whole model is saved to the users JSON file
+storage_type = 'sqlite'
+user_storage = create_storage(storage_type, user_data_path)
+
+# Seconds to wait before saving a users changes in the background, changes made in that time are saved together
+# 0 saves the changes during each request, which the 'sqlite' session_type (below) requires
+flush_interval = 2
+if flush_interval > 0:
+    user_storage = WriteBehindStorage(user_storage, flush_interval)
+
+# Where logged in users and their models are kept, one of:
+# 'local' - In this process only, so the server must run as a single process
+# 'sqlite' - Shared by all server processes (user_dialogues/sessions.db), models are loaded from user_storage
+# by whichever process serves the request, use with 'sqlite' storage_type
+session_type = 'local'
+current_users = create_session_store(session_type, user_data_path, user_storage, dialogue_data_path)
+
 # Load the valid user list
 valid_users = utils.load_txt_data(data_path, "user_id_list")
-current_users = dict()
 
 
 @app.route('/')
@@ -55,10 +78,7 @@ def annotate_page():
 @login_manager.user_loader
 def load_user(user_id):
 
-    if user_id in current_users:
-        return current_users[user_id]
-    else:
-        return None
+    return current_users.get_user(user_id)
 
 
 @app.route('/login.do', methods=['POST'])
@@ -68,20 +88,16 @@ def login():
 
         user_name = request.get_data(as_text=True)
         # If the user is valid and not already logged in
-        if user_name in valid_users and user_name not in current_users.keys():
-
-            # Create user and add to list
-            user = User(user_name)
-            current_users[user_name] = user
+        user = User(user_name)
+        if user_name in valid_users and current_users.add_user(user):
 
             # Login the user
             login_user(user, remember=True)
 
             # Get the relevant dialogue file and create a model for the user
-            # If the user already has a file return that
-            if os.path.isfile(user_data_path + user.get_id() + ".json"):
-                dialogue_file = user.get_id()
-                json_data = utils.load_json_data(user_data_path, dialogue_file)
+            # If the user already has saved dialogues return those
+            if user_storage.has_user(user.get_id()):
+                json_data = user_storage.load_user(user.get_id())
                 model = utils.create_model(dialogue_data_path, json_data, user.get_id(), user_data=True)
                 success = user.set_model(model)
 
@@ -89,9 +105,18 @@ def login():
             else:
                 user_dataset = user.get_id().split('-')[1]
                 dialogue_file = "set_" + user_dataset
-                json_data = utils.load_json_data(dialogue_data_path, dialogue_file)
-                model = utils.create_model(dialogue_data_path, json_data, user.get_id(), user_data=False)
-                success = user.set_model(model)
+                corpus = utils.load_corpus_data(dialogue_data_path, dialogue_file)
+                if corpus:
+                    model = utils.create_model(dialogue_data_path, corpus['data'], user.get_id(), user_data=False)
+                    # Save the shuffled dialogues so later saves only need to write the changed dialogue
+                    # If they can't be saved the login fails, as later saves would not be stored
+                    success = user.set_model(model) and user_storage.save_model(model)
+
+            # Share the users model, or free their login if it could not be loaded
+            if success:
+                current_users.save_user(user)
+            else:
+                current_users.remove_user(user_name)
 
     return json.dumps({'success': success}), 200, {'ContentType': 'application/json'}
 
@@ -100,9 +125,12 @@ def login():
 @login_required
 def logout():
 
-    # Get the user to be logged out and remove from current users
+    # Get the user to be logged out
     user_name = current_user.user_name
-    del current_users[user_name]
+
+    # Write any queued saves and fold them into the users file, then remove from current users
+    user_storage.close_user(user_name)
+    current_users.remove_user(user_name)
 
     # Log them out
     success = logout_user()
@@ -113,114 +141,257 @@ def logout():
 # Dialogue View
 @app.route('/get_current_dialogue.do')
 def get_current_dialogue():
-    # Get the current users model
-    user = current_users[current_user.get_id()]
-    model = user.get_model()
+    with current_users.user_lock(current_user.get_id()):
+        # Get the current users model
+        user = current_users.get_user(current_user.get_id())
+        model = user.get_model()
 
-    # Get the current dialogue from the model
-    dialogue = model.get_current_dialogue()
-
-    # Convert it to a dictionary
-    current_dialogue = utils.dialogue_to_dict(dialogue)
-
-    # Build the response object
-    dialogue_data = dict({'dataset': model.dataset,
-                          'num_dialogues': model.num_dialogues,
-                          'num_complete': model.num_complete,
-                          'current_dialogue': current_dialogue,
-                          'current_dialogue_index': model.current_dialogue_index})
+        # Build the response object
+        dialogue_data = get_dialogue_data(model, request.args.get('prefetch') == 'true')
 
     return json.dumps(dialogue_data), 200, {'ContentType': 'application/json'}
 
 
 @app.route('/save_current_dialogue.do', methods=['POST'])
 def save_current_dialogue():
-    # Get the current users model
-    user = current_users[current_user.get_id()]
-    model = user.get_model()
+    with current_users.user_lock(current_user.get_id()):
+        # Get the current users model
+        user = current_users.get_user(current_user.get_id())
+        model = user.get_model()
 
-    # Parse the request JSON
-    dialogue_data = request.get_json()
+        # Parse the request JSON
+        dialogue_data = request.get_json()
 
-    # Convert dialogue JSON/Dict to dialogue object
-    dialogue = utils.dialogue_from_dict(dialogue_data)
+        # Reject the dialogue if it was changed since the client loaded it
+        current_dialogue = model.get_dialogue(dialogue_data.get('dialogue_id'))
+        if not current_dialogue or not check_dialogue_version(current_dialogue, dialogue_data):
+            return stale_dialogue_response(current_dialogue)
 
-    # Update the model with the new dialogue
-    model.set_dialogue(dialogue)
+        # Take the next version, unless another process has saved the dialogue first
+        if not current_users.claim_dialogue(user, current_dialogue):
+            return stale_dialogue_response(current_dialogue)
 
-    # Save to the users JSON file
-    model_dict = utils.model_to_dict(model)
+        # Convert dialogue JSON/Dict to dialogue object
+        dialogue = utils.dialogue_from_dict(dialogue_data)
+        dialogue.version = current_dialogue.version
 
-    success = utils.save_json_data(user_data_path, current_user.get_id(), model_dict)
+        # Update the model with the new dialogue
+        model.set_dialogue(dialogue)
 
-    return json.dumps({'success': success}), 200, {'ContentType': 'application/json'}
+        # Save the dialogue to the users JSON files
+        success = user_storage.save_dialogue(model, dialogue)
+        if success:
+            current_users.save_user(user)
 
+    return json.dumps({'success': success, 'version': dialogue.version}), 200, {'ContentType': 'application/json'}
 
-@app.route('/get_prev_dialogue.do', methods=['POST'])
-def get_prev_dialogue():
-    # Get the current users model
-    user = current_users[current_user.get_id()]
-    model = user.get_model()
 
-    # Parse the request JSON
-    dialogue_data = request.get_json()
+@app.route('/patch_dialogue.do', methods=['POST'])
+def patch_dialogue():
+    with current_users.user_lock(current_user.get_id()):
+        # Get the current users model
+        user = current_users.get_user(current_user.get_id())
+        model = user.get_model()
 
-    # Convert dialogue JSON/Dict to dialogue object
-    dialogue = utils.dialogue_from_dict(dialogue_data)
+        # Parse the request JSON, only changed utterances are sent
+        patch_data = request.get_json()
 
-    # Update the model with the new dialogue
-    model.set_dialogue(dialogue)
+        # Apply the changes to the current dialogue
+        dialogue = model.get_current_dialogue()
+        if not check_dialogue_version(dialogue, patch_data):
+            return stale_dialogue_response(dialogue)
+        updated_indexes = apply_dialogue_patch(model, dialogue, patch_data)
+        if updated_indexes is False:
+            return json.dumps({'success': False}), 200, {'ContentType': 'application/json'}
 
-    # Increment to models next dialogue
-    model.dec_current_dialogue()
+        # Take the next version, unless another process has saved the dialogue first
+        if not current_users.claim_dialogue(user, dialogue):
+            return stale_dialogue_response(dialogue)
 
-    # Save to the users JSON file
-    model_dict = utils.model_to_dict(model)
+        # Save only the changed utterances
+        success = user_storage.save_utterances(model, dialogue, updated_indexes)
+        if success:
+            current_users.save_user(user)
 
-    success = utils.save_json_data(user_data_path, current_user.get_id(), model_dict)
+    return json.dumps({'success': success, 'version': dialogue.version}), 200, {'ContentType': 'application/json'}
 
-    return json.dumps({'success': success}), 200, {'ContentType': 'application/json'}
+
+@app.route('/get_prev_dialogue.do', methods=['POST'])
+def get_prev_dialogue():
+    with current_users.user_lock(current_user.get_id()):
+        # Get the current users model
+        user = current_users.get_user(current_user.get_id())
+        model = user.get_model()
+
+        # Parse the request JSON, only changed utterances are sent
+        patch_data = request.get_json()
+
+        # Apply the changes to the current dialogue
+        dialogue = model.get_current_dialogue()
+        if not check_dialogue_version(dialogue, patch_data):
+            return stale_dialogue_response(dialogue)
+        updated_indexes = apply_dialogue_patch(model, dialogue, patch_data)
+        if updated_indexes is False:
+            return json.dumps({'success': False}), 200, {'ContentType': 'application/json'}
+
+        # Take the next version, unless another process has saved the dialogue first
+        if not current_users.claim_dialogue(user, dialogue):
+            return stale_dialogue_response(dialogue)
+
+        # Decrement to models previous dialogue
+        model.dec_current_dialogue()
+
+        # Save the changed utterances and new current dialogue
+        success = user_storage.save_utterances(model, dialogue, updated_indexes)
+        if success:
+            current_users.save_user(user)
+
+        # Return the new current dialogue, so the client does not need to request it
+        dialogue_data = get_dialogue_data(model, request.args.get('prefetch') == 'true')
+        dialogue_data['success'] = success
+
+    return json.dumps(dialogue_data), 200, {'ContentType': 'application/json'}
 
 
 @app.route('/get_next_dialogue.do', methods=['POST'])
 def get_next_dialogue():
-    # Get the current users model
-    user = current_users[current_user.get_id()]
-    model = user.get_model()
+    with current_users.user_lock(current_user.get_id()):
+        # Get the current users model
+        user = current_users.get_user(current_user.get_id())
+        model = user.get_model()
+
+        # Parse the request JSON, only changed utterances are sent
+        patch_data = request.get_json()
+
+        # Apply the changes to the current dialogue
+        dialogue = model.get_current_dialogue()
+        if not check_dialogue_version(dialogue, patch_data):
+            return stale_dialogue_response(dialogue)
+        updated_indexes = apply_dialogue_patch(model, dialogue, patch_data)
+        if updated_indexes is False:
+            return json.dumps({'success': False}), 200, {'ContentType': 'application/json'}
+
+        # Take the next version, unless another process has saved the dialogue first
+        if not current_users.claim_dialogue(user, dialogue):
+            return stale_dialogue_response(dialogue)
+
+        # Increment to models next dialogue
+        model.inc_current_dialogue()
+
+        # Save the changed utterances and new current dialogue
+        success = user_storage.save_utterances(model, dialogue, updated_indexes)
+        if success:
+            current_users.save_user(user)
+
+        # Return the new current dialogue, so the client does not need to request it
+        dialogue_data = get_dialogue_data(model, request.args.get('prefetch') == 'true')
+        dialogue_data['success'] = success
+
+    return json.dumps(dialogue_data), 200, {'ContentType': 'application/json'}
 
-    # Parse the request JSON
-    dialogue_data = request.get_json()
 
-    # Convert dialogue JSON/Dict to dialogue object
-    dialogue = utils.dialogue_from_dict(dialogue_data)
+# Builds the current dialogue and stats response object
+# If prefetch is True the previous and next dialogues are also included, so the client can show them straight away
+def get_dialogue_data(model, prefetch=False):
 
-    # Update the model with the new dialogue
-    model.set_dialogue(dialogue)
+    # Get the current dialogue from the model
+    dialogue = model.get_current_dialogue()
 
-    # Increment to models next dialogue
-    model.inc_current_dialogue()
+    # Build the response object
+    dialogue_data = dict({'dataset': model.dataset,
+                          'num_dialogues': model.num_dialogues,
+                          'num_complete': model.num_complete,
+                          'current_dialogue': get_versioned_dialogue_dict(dialogue),
+                          'current_dialogue_index': model.current_dialogue_index})
 
-    # Save to the users JSON file
-    model_dict = utils.model_to_dict(model)
+    if prefetch:
+        # Indexes of the dialogues the prev and next buttons go to
+        prev_index = (model.current_dialogue_index - 1) % model.num_dialogues
+        next_index = (model.current_dialogue_index + 1) % model.num_dialogues
+        dialogue_data['prefetch'] = {'prev': {'index': prev_index,
+                                              'dialogue': get_versioned_dialogue_dict(model.dialogues[prev_index])},
+                                     'next': {'index': next_index,
+                                              'dialogue': get_versioned_dialogue_dict(model.dialogues[next_index])}}
 
-    success = utils.save_json_data(user_data_path, current_user.get_id(), model_dict)
+    return dialogue_data
 
-    return json.dumps({'success': success}), 200, {'ContentType': 'application/json'}
+
+# Converts the dialogue to a dictionary, with the version the client must send back with any changes
+def get_versioned_dialogue_dict(dialogue):
+    dialogue_dict = utils.dialogue_to_dict(dialogue)
+    dialogue_dict['version'] = dialogue.version
+    return dialogue_dict
+
+
+# Checks the changes were made to the current version of the dialogue
+# Clients that do not send a version are always accepted
+def check_dialogue_version(dialogue, dialogue_data):
+    if dialogue_data and 'version' in dialogue_data.keys() and dialogue_data['version'] != dialogue.version:
+        print("Dialogue " + dialogue.dialogue_id + " has changed since version " + str(dialogue_data['version']) + "...")
+        return False
+    return True
+
+
+# Response for changes made to an old version of a dialogue, the client should reload it
+def stale_dialogue_response(dialogue):
+    version = dialogue.version if dialogue else None
+    return json.dumps({'success': False, 'stale': True, 'version': version}), 409, {'ContentType': 'application/json'}
+
+
+# Applies a patch of changed utterances to the dialogue and updates the models dialogue counts
+def apply_dialogue_patch(model, dialogue, patch_data):
+    # The patch must be for the given dialogue
+    if not patch_data or patch_data.get('dialogue_id') != dialogue.dialogue_id:
+        print("Patch does not match current dialogue " + dialogue.dialogue_id + "...")
+        return False
+
+    updated_indexes = utils.apply_dialogue_updates(dialogue, patch_data)
+    if updated_indexes is not False:
+        model.update_dialogue_counts(dialogue)
+
+    return updated_indexes
 
 
 @app.route('/get_labels.do')
 def get_labels():
-    # Load the labels files
-    labels = utils.load_json_data(label_data_path, "labels")
+    # Get the cached labels file
+    labels = utils.load_served_json_data(label_data_path, "labels")
 
     # If unable to load labels inform user
     if not labels:
         print("unable to load label lists...")
+        return json.dumps(labels), 200, {'ContentType': 'application/json'}
+
+    # Send the compressed labels if the browser accepts them
+    if 'gzip' in request.accept_encodings:
+        body, etag = labels['gzip_body'], labels['gzip_etag']
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+    else:
+        body, etag = labels['body'], labels['etag']
+        headers = {'Content-Type': 'application/json'}
+
+    # Browsers must check the labels are unchanged before using their copy
+    headers.update({'ETag': '"' + etag + '"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'})
+
+    # Nothing to send if the browser already has these labels
+    if request.if_none_match.contains(etag):
+        return '', 304, headers
+
+    return body, 200, headers
+
+
+@app.route('/get_storage_metrics.do')
+@login_required
+def get_storage_metrics():
+    # Background save queue depth and latency, if saving in the background
+    if isinstance(user_storage, WriteBehindStorage):
+        metrics = user_storage.get_metrics()
+    else:
+        metrics = dict()
 
-    # Return as json/dict
-    return json.dumps(labels), 200, {'ContentType': 'application/json'}
+    return json.dumps(metrics), 200, {'ContentType': 'application/json'}
 
 
 if __name__ == '__main__':
     # app.run(host='0.0.0.0', port=80)  # Default 0.0.0.0:80
-    app.run()
\ No newline at end of file
+    app.run(threaded=True)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import sys
+import json
+import tracemalloc
+import utilities as utils
+
+# Measures the memory each logged in user's dialogue model takes up in current_users
+# Usage: python memory_benchmark.py [num_users]
+
+# Data paths
+dialogue_data_path = "static/data/dialogues/"
+
+# Number of simulated users for each dialogue set
+num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+sets = ['set_1', 'set_2', 'set_3', 'set_4', 'set_5']
+
+# Load the set data first so only the models are measured
+set_data = {dataset: utils.load_corpus_data(dialogue_data_path, dataset)['data'] for dataset in sets}
+utils.load_corpus_data(dialogue_data_path, "practice")
+
+# Users saved data, as it would be loaded from storage by a returning user
+saved_data = {dataset: json.dumps(set_data[dataset]) for dataset in sets}
+
+
+def measure_models(user_data):
+    # Create the models, as if each user had just logged in
+    tracemalloc.start()
+    start_size = tracemalloc.get_traced_memory()[0]
+    models = dict()
+    for dataset in sets:
+        for i in range(num_users):
+            user_id = "usr" + dataset.split('_')[1] + "-" + str(i)
+            if user_data:
+                data = json.loads(saved_data[dataset])
+            else:
+                data = set_data[dataset]
+            models[user_id] = utils.create_model(dialogue_data_path, data, user_id, user_data=user_data)
+    model_size = tracemalloc.get_traced_memory()[0] - start_size
+    tracemalloc.stop()
+
+    num_utterances = sum(dialogue.num_utterances for model in models.values() for dialogue in model.dialogues)
+
+    print("Users: " + str(len(models)))
+    print("Utterances: " + str(num_utterances))
+    print("Total model memory: " + str(round(model_size / 1024, 1)) + " KiB")
+    print("Memory per user: " + str(round(model_size / len(models) / 1024, 1)) + " KiB")
+    print("Memory per utterance: " + str(round(model_size / num_utterances)) + " bytes")
+
+    return models
+
+
+print("New users:")
+new_models = measure_models(user_data=False)
+print("\nReturning users:")
+returning_models = measure_models(user_data=True)
+
+# Check the models still serialise to the same format as the dataset files
+for model in list(new_models.values()) + list(returning_models.values()):
+    for dialogue in model.dialogues:
+        if dialogue.dialogue_id == 'practice':
+            continue
+        dialogue_dict = utils.dialogue_to_dict(dialogue)
+        original = next(d for d in set_data[model.dataset]['dialogues'] if d['dialogue_id'] == dialogue.dialogue_id)
+        for utterance, original_utterance in zip(dialogue_dict['utterances'], original['utterances']):
+            if utterance['text'] != original_utterance['text'] or utterance['speaker'] != original_utterance['speaker']:
+                print("Error! Dialogue " + dialogue.dialogue_id + " does not match the dataset!")
+                sys.exit(1)
+print("\nSerialised dialogues match the dataset files.")
@@ -0,0 +1,209 @@
+import sqlite3
+import threading
+import time
+import utilities as utils
+from storage import WriteBehindStorage
+from user import User
+
+
+# Keeps logged in users and their models in this process, the server must run as a single process
+class LocalSessionStore:
+    def __init__(self):
+        self.users = dict()
+        self.lock = threading.Lock()
+
+        # Each users requests are handled one at a time, so their model is never changed by two threads at once
+        self.user_locks = dict()
+
+    def add_user(self, user):
+        with self.lock:
+            # Users can only be logged in once
+            if user.get_id() in self.users:
+                return False
+            self.users[user.get_id()] = user
+        return True
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def user_lock(self, user_id):
+        with self.lock:
+            return self.user_locks.setdefault(user_id, threading.Lock())
+
+    def claim_dialogue(self, user, dialogue):
+        # Requests are serialised by the users lock in this process, so the version can always be incremented
+        dialogue.version += 1
+        return True
+
+    def save_user(self, user):
+        # The model is only held in this process so there is nothing to share
+        return True
+
+    def remove_user(self, user_id):
+        with self.lock:
+            self.users.pop(user_id, None)
+            self.user_locks.pop(user_id, None)
+
+
+# Keeps logged in users in a SQLite database shared by every server process
+# Each process holds its own copy of a users model, with the version it was loaded at
+# When another process saves the user their version changes, and the model is reloaded from user_storage
+class SqliteSessionStore:
+    def __init__(self, path, user_storage, dialogue_data_path, file_name="sessions", session_timeout=3600):
+        self.user_storage = user_storage
+        self.dialogue_data_path = dialogue_data_path
+
+        # Users that have not made a request for this long (in seconds) can login again, e.g. if they lost their cookie
+        self.session_timeout = session_timeout
+
+        # User id -> (user, version) for users loaded in this process
+        self.users = dict()
+
+        # Each users requests are handled one at a time in this process, so their model is never changed by two threads
+        # Requests in different processes are checked against the dialogue versions saved in the database
+        self.user_locks = dict()
+
+        # Connection is shared between request threads, so access is serialised with a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path + file_name + ".db", check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    user_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    last_seen REAL NOT NULL)""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS dialogue_versions (
+                    user_id TEXT NOT NULL,
+                    dialogue_id TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, dialogue_id))""")
+
+    def add_user(self, user):
+        now = time.time()
+        with self.lock, self.connection:
+            # Only add the user if they are not logged in, or their session has expired
+            cursor = self.connection.execute("INSERT INTO sessions VALUES (?, 0, ?) "
+                                             "ON CONFLICT (user_id) DO UPDATE SET version = version + 1, "
+                                             "last_seen = excluded.last_seen WHERE last_seen < ?",
+                                             (user.get_id(), now, now - self.session_timeout))
+            if cursor.rowcount == 0:
+                return False
+
+            # Dialogue versions start again for the new login
+            self.connection.execute("DELETE FROM dialogue_versions WHERE user_id = ?", (user.get_id(),))
+
+            # The model is set and saved by the login request, which increments this version
+            version = self.connection.execute("SELECT version FROM sessions WHERE user_id = ?",
+                                              (user.get_id(),)).fetchone()[0]
+            self.users[user.get_id()] = (user, version)
+        return True
+
+    def get_user(self, user_id):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT version, last_seen FROM sessions WHERE user_id = ?",
+                                          (user_id,)).fetchone()
+
+            # If the user has logged out in any process remove them from this one too
+            if row is None:
+                self.users.pop(user_id, None)
+                self.user_locks.pop(user_id, None)
+                return None
+            version, last_seen = row
+
+            # Load the users model if it is not in this process, or has been saved by another process
+            user, loaded_version = self.users.get(user_id, (None, None))
+            if user is None or user.get_model() is None or loaded_version != version:
+                model = self.load_model(user_id)
+                if not model:
+                    return None
+
+                # Set the dialogue versions the other processes have saved
+                for dialogue_id, dialogue_version in self.connection.execute(
+                        "SELECT dialogue_id, version FROM dialogue_versions WHERE user_id = ?", (user_id,)):
+                    dialogue = model.get_dialogue(dialogue_id)
+                    if dialogue:
+                        dialogue.version = dialogue_version
+
+                user = User(user_id)
+                user.set_model(model)
+                self.users[user_id] = (user, version)
+
+            # Only record the users activity every minute, to avoid a write for every request
+            if now - last_seen > 60:
+                with self.connection:
+                    self.connection.execute("UPDATE sessions SET last_seen = ? WHERE user_id = ?", (now, user_id))
+
+        return user
+
+    def user_lock(self, user_id):
+        with self.lock:
+            return self.user_locks.setdefault(user_id, threading.Lock())
+
+    def claim_dialogue(self, user, dialogue):
+        # Another process may have saved the dialogue since this process loaded it, so in one transaction
+        # only increment the saved version if it is still the version this process has
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO dialogue_versions VALUES (?, ?, 0)",
+                                    (user.get_id(), dialogue.dialogue_id))
+            cursor = self.connection.execute("UPDATE dialogue_versions SET version = version + 1 "
+                                             "WHERE user_id = ? AND dialogue_id = ? AND version = ?",
+                                             (user.get_id(), dialogue.dialogue_id, dialogue.version))
+            if cursor.rowcount == 0:
+                # Reload the model on the next request, so it has the other processes changes
+                self.users[user.get_id()] = (user, None)
+                return False
+
+        dialogue.version += 1
+        return True
+
+    def save_user(self, user):
+        user_id = user.get_id()
+        with self.lock, self.connection:
+            # Increment the version so other processes know to reload the model
+            self.connection.execute("UPDATE sessions SET version = version + 1, last_seen = ? WHERE user_id = ?",
+                                    (time.time(), user_id))
+            row = self.connection.execute("SELECT version FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return False
+
+            # If another process also saved the user since this model was loaded, reload it on the next request
+            loaded_version = self.users.get(user_id, (None, None))[1]
+            if loaded_version is not None and row[0] == loaded_version + 1:
+                self.users[user_id] = (user, row[0])
+            else:
+                self.users[user_id] = (user, None)
+        return True
+
+    def remove_user(self, user_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self.connection.execute("DELETE FROM dialogue_versions WHERE user_id = ?", (user_id,))
+            self.users.pop(user_id, None)
+            self.user_locks.pop(user_id, None)
+
+    def load_model(self, user_id):
+        # Users are always saved at login, so their model can be loaded from storage
+        json_data = self.user_storage.load_user(user_id)
+        if not json_data:
+            return False
+        return utils.create_model(self.dialogue_data_path, json_data, user_id, user_data=True)
+
+
+def create_session_store(session_type, path, user_storage, dialogue_data_path):
+    if session_type == 'local':
+        session_store = LocalSessionStore()
+
+        # Background saves must not encode a users model while a request is changing it
+        if isinstance(user_storage, WriteBehindStorage):
+            user_storage.user_lock = session_store.user_lock
+        return session_store
+    elif session_type == 'sqlite':
+        # Other processes would load users before their background saves are written
+        if isinstance(user_storage, WriteBehindStorage):
+            raise ValueError("The \"sqlite\" session type cannot save users in the background, set flush_interval to 0.")
+        return SqliteSessionStore(path, user_storage, dialogue_data_path)
+    else:
+        raise ValueError("Invalid session type: \"" + session_type + "\". Must be one of \"local\" or \"sqlite\".")
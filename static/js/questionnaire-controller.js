@@ -69,6 +69,7 @@ function questionnaireLabelBtnClick() {
     } else if (btnType === 'da-btn') {
         utterance.da_flag = selected;
     }
+    markUttChanged(parseInt(index));
 }
 
 // Sets the current dialogue to completed and closes questionnaire
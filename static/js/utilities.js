@@ -154,25 +154,83 @@ function saveDialogue(dialogue) {
             endUtteranceTimer();
         }
 
+        // Only send the changed utterances, and keep their edit counts at the time they were sent
+        let patch = getDialoguePatch(dialogue);
+        let sentEditCounts = patch.utterances.map(function (utterance) {
+            return uttEditCounts.get(utterance.index);
+        });
+
         $.ajax({
             type: 'post',
-            url: "/save_current_dialogue.do",
-            data: JSON.stringify(dialogue),
+            url: "/patch_dialogue.do",
+            data: JSON.stringify(patch),
             dataType: "json",
             contentType: 'application/json;charset=UTF-8',
             success: function (result) {
 
                 if (result.success) {
+                    // Remove the saved utterances from the changed utterances
+                    // Unless they were changed again while saving, or another dialogue is now shown
+                    for (let i = 0; i < patch.utterances.length; i++) {
+                        let index = patch.utterances[i].index;
+                        if (dialogue === currentDialogue && uttEditCounts.get(index) === sentEditCounts[i]) {
+                            changedUttIndices.delete(index);
+                        }
+                    }
+                    // Keep the new version for the next save
+                    dialogue.version = result.version;
                     console.log("Saved dialogue: " + dialogue.dialogue_id);
                 } else {
                     console.log("Failed to save dialogue: " + dialogue.dialogue_id);
                 }
                 return result;
+            },
+            error: function (xhr) {
+
+                // If the dialogue was changed elsewhere, e.g. in another tab, reload it from the server
+                if (xhr.status === 409) {
+                    console.log("Dialogue changed on the server, reloading: " + dialogue.dialogue_id);
+                    reloadDialogueView();
+                }
             }
         });
     }
 }
 
+// Marks an utterance of the current dialogue as changed, so it is sent with the next save
+function markUttChanged(index) {
+    changedUttIndices.add(index);
+    uttEditCounts.set(index, (uttEditCounts.get(index) || 0) + 1);
+}
+
+// Gets the dialogue values and only the utterances that have changed since they were last saved
+function getDialoguePatch(dialogue) {
+
+    let patch = {
+        dialogue_id: dialogue.dialogue_id,
+        version: dialogue.version,
+        is_complete: dialogue.is_complete,
+        time: dialogue.time,
+        questions: dialogue.questions,
+        utterances: []
+    };
+
+    // Add each changed utterances labels, flags and time
+    changedUttIndices.forEach(function (index) {
+        let utterance = dialogue.utterances[index];
+        patch.utterances.push({
+            index: index,
+            ap_label: utterance.ap_label,
+            da_label: utterance.da_label,
+            ap_flag: utterance.ap_flag,
+            da_flag: utterance.da_flag,
+            time: utterance.time
+        });
+    });
+
+    return patch;
+}
+
 // Starts a timer for the current dialogue
 function startDialogueTimer() {
 
@@ -224,6 +282,7 @@ function endUtteranceTimer() {
 
         let timeDelta = Date.now() - utteranceStartTime;
         currentUtt.time = currentUtt.time + timeDelta;
+        markUttChanged(currentUttIndex);
         console.log("Timer ended @ " + new Date().toUTCString());
         console.log("Time taken: " + timeDelta);
         console.log("Current utterance time: " + currentUtt.time);
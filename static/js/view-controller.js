@@ -15,6 +15,14 @@ var currentDialogueIndex = null;
 var currentUtt = null;
 var currentUttIndex = null;
 
+// Indexes of the current dialogues utterances that have changed since they were last saved
+var changedUttIndices = new Set();
+// Number of times each utterance has been changed, so a save only clears utterances that were not changed again
+var uttEditCounts = new Map();
+
+// Previous and next dialogues sent with the current dialogue, so they can be shown before the server responds
+var prefetchedDialogues = null;
+
 // To keep track of when the dialogue/utterance labelling started
 var dialogueStartTime = null;
 var utteranceStartTime = null;
@@ -33,23 +41,8 @@ function prevBtnClick() {
     if (checkDialogueLabels(currentDialogue) && !currentDialogue.is_complete) {
         openQuestionnaire();
     } else {
-        // Clear the dialogue view
-        clearAllChildren(document.getElementById(dialogueViewUttNodeId));
-
-        // Call prev dialogue function
-        $.ajax({
-            type: 'post',
-            url: "/get_prev_dialogue.do",
-            data: JSON.stringify(currentDialogue),
-            dataType: "json",
-            contentType: 'application/json;charset=UTF-8',
-            success: function (result) {
-
-                // Rebuild dialogue view with new current dialogue
-                buildDialogueViewUtterances(document.getElementById(dialogueViewUttNodeId));
-                return result;
-            }
-        });
+        // Save the current dialogue and move to the prev dialogue
+        navigateDialogue("prev");
     }
 }
 
@@ -60,23 +53,8 @@ function nextBtnClick() {
     if (checkDialogueLabels(currentDialogue) && !currentDialogue.is_complete) {
         openQuestionnaire();
     } else {
-        // Clear the dialogue view
-        clearAllChildren(document.getElementById(dialogueViewUttNodeId));
-
-        // Call next dialogue function
-        $.ajax({
-            type: 'post',
-            url: "/get_next_dialogue.do",
-            data: JSON.stringify(currentDialogue),
-            dataType: "json",
-            contentType: 'application/json;charset=UTF-8',
-            success: function (result) {
-
-                // Rebuild dialogue view with new current dialogue
-                buildDialogueViewUtterances(document.getElementById(dialogueViewUttNodeId));
-                return result;
-            }
-        });
+        // Save the current dialogue and move to the next dialogue
+        navigateDialogue("next");
     }
 }
 
@@ -155,6 +133,7 @@ function uttClearBtnClick() {
     currentDialogue.utterances[index].da_label = defaultDaLabel;
     currentDialogue.utterances[index].is_labelled = false;
     currentDialogue.is_labelled = false;
+    markUttChanged(index);
 
 
     // Check if the timer is stopped i.e this dialogue was fully labelled before
@@ -185,6 +164,7 @@ function labelBtnClick() {
         } else if (labelType === "da-labels") {
             currentUtt.da_label = labelText;
         }
+        markUttChanged(currentUttIndex);
 
         // Check if this utterance is now completely labelled
         // If so then set it to labelled and increment to next utterance
@@ -234,56 +214,136 @@ function labelBtnClick() {
 }
 
 ///// Build Functions /////
+// Saves the current dialogues changes and moves to the prev or next dialogue in one request
+// If the dialogue was prefetched it is shown straight away, and only rebuilt if the server returns a different one
+function navigateDialogue(direction) {
+
+    let target = document.getElementById(dialogueViewUttNodeId);
+    let patch = getDialoguePatch(currentDialogue);
+
+    // Clear the dialogue view and show the prefetched dialogue if there is one
+    clearAllChildren(target);
+    let shownDialogue = null;
+    if (prefetchedDialogues !== null &&
+        prefetchedDialogues[direction].dialogue.dialogue_id !== currentDialogue.dialogue_id) {
+
+        let prefetched = prefetchedDialogues[direction];
+        renderDialogueView(target, {
+            num_dialogues: numDialogues,
+            num_complete: numCompleteDialogues,
+            current_dialogue: prefetched.dialogue,
+            current_dialogue_index: prefetched.index
+        });
+        shownDialogue = prefetched.dialogue;
+    }
+    prefetchedDialogues = null;
+
+    // Call prev/next dialogue function, which also returns the new current dialogue
+    $.ajax({
+        type: 'post',
+        url: "/get_" + direction + "_dialogue.do?prefetch=true",
+        data: JSON.stringify(patch),
+        dataType: "json",
+        contentType: 'application/json;charset=UTF-8',
+        success: function (dialogue_data) {
+
+            // If the changes were not applied there is no dialogue, so get the servers current dialogue
+            if (dialogue_data.current_dialogue === undefined) {
+                reloadDialogueView();
+                return dialogue_data;
+            }
+            prefetchedDialogues = dialogue_data.prefetch;
+
+            // If the shown dialogue is the same as the servers only the stats need updating
+            if (shownDialogue !== null &&
+                shownDialogue.dialogue_id === dialogue_data.current_dialogue.dialogue_id &&
+                shownDialogue.version === dialogue_data.current_dialogue.version) {
+
+                numCompleteDialogues = dialogue_data.num_complete;
+                updateCurrentStats();
+            } else {
+                // Rebuild dialogue view with new current dialogue
+                clearAllChildren(target);
+                renderDialogueView(target, dialogue_data);
+            }
+            return dialogue_data;
+        },
+        error: function () {
+
+            // Dialogue was changed elsewhere or not saved, so show the servers current dialogue
+            reloadDialogueView();
+        }
+    });
+}
+
+// Clears the dialogue view and rebuilds it with the servers current dialogue
+function reloadDialogueView() {
+
+    let target = document.getElementById(dialogueViewUttNodeId);
+    if (target !== null) {
+        clearAllChildren(target);
+        buildDialogueViewUtterances(target);
+    }
+}
+
 // Builds the dialogue view utterance list and updates the stats
 function buildDialogueViewUtterances(target) {
 
     // Make call for current dialogue
     $.ajax({
-        url: "/get_current_dialogue.do",
+        url: "/get_current_dialogue.do?prefetch=true",
         dataType: "json",
         success: function (dialogue_data) {
             console.log(dialogue_data);
 
-            // Get the current dialogue and stats from response
-            numDialogues = dialogue_data.num_dialogues;
-            numCompleteDialogues = dialogue_data.num_complete;
-            currentDialogue = dialogue_data.current_dialogue;
-            currentDialogueIndex = dialogue_data.current_dialogue_index;
+            prefetchedDialogues = dialogue_data.prefetch;
+            renderDialogueView(target, dialogue_data);
+            return dialogue_data;
+        }
+    });
+}
 
-            if (currentDialogue !== null) {
-                // Create button/labels list for current dialogue
-                let utteranceList = createUtteranceList(currentDialogue);
-                // Append to target
-                target.appendChild(utteranceList);
+// Shows the dialogue in the dialogue view and updates the stats
+function renderDialogueView(target, dialogue_data) {
 
-                // Update the stats
-                updateCurrentStats();
+    // Get the current dialogue and stats from response
+    numDialogues = dialogue_data.num_dialogues;
+    numCompleteDialogues = dialogue_data.num_complete;
+    currentDialogue = dialogue_data.current_dialogue;
+    currentDialogueIndex = dialogue_data.current_dialogue_index;
+    changedUttIndices.clear();
+    uttEditCounts.clear();
 
-                // Get the new current dialogues labelled state
-                let is_labelled = checkDialogueLabels(currentDialogue);
+    if (currentDialogue !== null) {
+        // Create button/labels list for current dialogue
+        let utteranceList = createUtteranceList(currentDialogue);
+        // Append to target
+        target.appendChild(utteranceList);
 
-                // Start the timer for this dialogue if it is not labelled or is_complete
-                if (!is_labelled && !currentDialogue.is_complete) {
-                    startDialogueTimer();
-                    // Also enable is_complete dialogue  button state
-                    toggleDialogueCompleteBtnState(false, true);
+        // Update the stats
+        updateCurrentStats();
 
-                } // If it is labelled and is_complete disable the buttons
-                else if (is_labelled && currentDialogue.is_complete) {
-                    toggleDialogueDisabledState(currentDialogue, true);
+        // Get the new current dialogues labelled state
+        let is_labelled = checkDialogueLabels(currentDialogue);
 
-                    // Also enable the revise dialogue button state
-                    toggleDialogueCompleteBtnState(true, false);
+        // Start the timer for this dialogue if it is not labelled or is_complete
+        if (!is_labelled && !currentDialogue.is_complete) {
+            startDialogueTimer();
+            // Also enable is_complete dialogue  button state
+            toggleDialogueCompleteBtnState(false, true);
 
-                } // Else just make sure is_complete dialogue button is enabled
-                else if (is_labelled && !currentDialogue.is_complete) {
-                    toggleDialogueCompleteBtnState(false, false);
-                }
-            }
+        } // If it is labelled and is_complete disable the buttons
+        else if (is_labelled && currentDialogue.is_complete) {
+            toggleDialogueDisabledState(currentDialogue, true);
 
-            return dialogue_data;
+            // Also enable the revise dialogue button state
+            toggleDialogueCompleteBtnState(true, false);
+
+        } // Else just make sure is_complete dialogue button is enabled
+        else if (is_labelled && !currentDialogue.is_complete) {
+            toggleDialogueCompleteBtnState(false, false);
         }
-    });
+    }
 }
 
 // Creates buttons for the utterances and DA/AP labels
@@ -0,0 +1,648 @@
+import os
+import json
+import atexit
+import sqlite3
+import threading
+import time
+import traceback
+import contextlib
+import utilities as utils
+
+
+# Stores each users model as a single JSON file, every save rewrites the whole file
+class JsonStorage:
+    def __init__(self, path):
+        self.path = path
+
+    def has_user(self, user_id):
+        return os.path.isfile(self.path + user_id + ".json")
+
+    def load_user(self, user_id):
+        return utils.load_json_data(self.path, user_id)
+
+    def save_model(self, model):
+        return utils.save_json_data(self.path, model.user_id, utils.model_to_json(model))
+
+    def save_dialogue(self, model, dialogue):
+        # Single file, so the whole model must be written
+        return self.save_model(model)
+
+    def save_utterances(self, model, dialogue, indexes):
+        # Changed utterances are saved with the rest of the dialogue
+        return self.save_dialogue(model, dialogue)
+
+    def close_user(self, user_id):
+        return True
+
+
+# Stores each users dialogues as separate JSON files, with a manifest for the model state and dialogue order
+# i.e. user_dialogues/<user_id>/manifest.json and user_dialogues/<user_id>/<dialogue_id>.json
+class DialogueStorage:
+    def __init__(self, path):
+        self.path = path
+
+    def get_user_path(self, user_id):
+        return os.path.join(self.path, user_id, "")
+
+    def has_user(self, user_id):
+        # Users with an old single file model are also valid, they are split on load
+        if os.path.isfile(self.get_user_path(user_id) + "manifest.json"):
+            return True
+        return os.path.isfile(self.path + user_id + ".json")
+
+    def load_user(self, user_id):
+        user_path = self.get_user_path(user_id)
+
+        # If there is no manifest try and migrate the users single file model
+        if not os.path.isfile(user_path + "manifest.json"):
+            return self.migrate_user(user_id)
+
+        manifest = utils.load_json_data(user_path, "manifest")
+        if not manifest:
+            return False
+
+        # Load the dialogues in the order they are listed in the manifest
+        dialogues = []
+        for dialogue_id in manifest['dialogue_ids']:
+            dialogue = utils.load_json_data(user_path, dialogue_id)
+            if not dialogue:
+                print("Unable to load dialogue " + dialogue_id + " for user " + user_id + "...")
+                return False
+            dialogues.append(dialogue)
+
+        # Rebuild the same dictionary as model_to_dict()
+        model_dict = dict(manifest)
+        del model_dict['dialogue_ids']
+        model_dict['dialogues'] = dialogues
+
+        return model_dict
+
+    def migrate_user(self, user_id):
+        model_dict = utils.load_json_data(self.path, user_id)
+        if not model_dict:
+            return False
+
+        # Write each dialogue and the manifest to the users directory
+        os.makedirs(self.get_user_path(user_id), exist_ok=True)
+        for dialogue in model_dict['dialogues']:
+            if not utils.save_json_data(self.get_user_path(user_id), dialogue['dialogue_id'], dialogue):
+                return False
+        dialogue_ids = [dialogue['dialogue_id'] for dialogue in model_dict['dialogues']]
+        if not self.save_manifest(model_dict, dialogue_ids):
+            return False
+
+        return model_dict
+
+    def save_manifest(self, model_dict, dialogue_ids):
+        # Manifest is the model dictionary with dialogue ids in place of the dialogues
+        manifest = {key: value for key, value in model_dict.items() if key != 'dialogues'}
+        manifest['dialogue_ids'] = dialogue_ids
+
+        return utils.save_json_data(self.get_user_path(model_dict['user_id']), "manifest", manifest)
+
+    def save_model(self, model):
+        os.makedirs(self.get_user_path(model.user_id), exist_ok=True)
+
+        # Save every dialogue, then the manifest
+        for dialogue in model.dialogues:
+            if not utils.save_json_data(self.get_user_path(model.user_id), dialogue.dialogue_id,
+                                        utils.dialogue_to_json(dialogue)):
+                return False
+
+        dialogue_ids = [tmp_dialogue.dialogue_id for tmp_dialogue in model.dialogues]
+        return self.save_manifest(utils.model_to_dict(model, include_dialogues=False), dialogue_ids)
+
+    def save_dialogue(self, model, dialogue):
+        os.makedirs(self.get_user_path(model.user_id), exist_ok=True)
+
+        # Only the changed dialogue and the manifest need to be written
+        if not utils.save_json_data(self.get_user_path(model.user_id), dialogue.dialogue_id,
+                                    utils.dialogue_to_json(dialogue)):
+            return False
+
+        dialogue_ids = [tmp_dialogue.dialogue_id for tmp_dialogue in model.dialogues]
+        return self.save_manifest(utils.model_to_dict(model, include_dialogues=False), dialogue_ids)
+
+    def save_utterances(self, model, dialogue, indexes):
+        # Changed utterances are saved with the rest of the dialogue
+        return self.save_dialogue(model, dialogue)
+
+    def close_user(self, user_id):
+        return True
+
+
+# Stores each users model as a JSON snapshot plus an append only journal of saved dialogues and navigation
+# i.e. user_dialogues/<user_id>.json and user_dialogues/<user_id>.journal
+# A background thread periodically folds journals into their snapshots
+class JournalStorage:
+    def __init__(self, path, compact_size=50, compact_interval=60):
+        self.path = path
+
+        # Number of records a journal can hold before it is compacted
+        self.compact_size = compact_size
+        self.journal_sizes = dict()
+
+        # Users whose journal has been checked for an incomplete last record since the server started
+        self.repaired_users = set()
+
+        # Appends and compaction must not interleave
+        self.lock = threading.Lock()
+
+        # Start the background compactor
+        if compact_interval:
+            self.compact_interval = compact_interval
+            self.compactor = threading.Thread(target=self.run_compactor, daemon=True)
+            self.compactor.start()
+
+    def has_user(self, user_id):
+        if os.path.isfile(self.path + user_id + ".json"):
+            return True
+        return os.path.isfile(self.path + user_id + ".journal")
+
+    def load_user(self, user_id):
+        with self.lock:
+            model_dict = utils.load_json_data(self.path, user_id)
+            records = utils.load_journal_data(self.path, user_id)
+        if not model_dict or records is False:
+            return False
+
+        # Rebuild the model from the snapshot plus the journal tail
+        self.journal_sizes[user_id] = len(records)
+        return utils.apply_journal_records(model_dict, records)
+
+    def save_model(self, model):
+        with self.lock:
+            # A full snapshot makes the journal redundant
+            if not utils.save_json_data(self.path, model.user_id, utils.model_to_json(model)):
+                return False
+            return self.clear_journal(model.user_id)
+
+    def save_dialogue(self, model, dialogue):
+        # Record the dialogue and the current index (navigation) as one batch
+        records = [b'{"dialogue":' + utils.dialogue_to_json(dialogue) + b'}',
+                   {'current_dialogue_index': model.current_dialogue_index}]
+        with self.lock:
+            # Before the first append remove any record left incomplete by a crash
+            if model.user_id not in self.repaired_users:
+                if not utils.repair_journal_data(self.path, model.user_id):
+                    return False
+                self.repaired_users.add(model.user_id)
+            success = utils.append_journal_data(self.path, model.user_id, records)
+            if success:
+                self.journal_sizes[model.user_id] = self.journal_sizes.get(model.user_id, 0) + len(records)
+
+        return success
+
+    def save_utterances(self, model, dialogue, indexes):
+        # Changed utterances are saved with the rest of the dialogue
+        return self.save_dialogue(model, dialogue)
+
+    def close_user(self, user_id):
+        return self.compact_user(user_id)
+
+    def clear_journal(self, user_id):
+        try:
+            os.remove(self.path + user_id + ".journal")
+        except FileNotFoundError:
+            pass
+        except IOError:
+            traceback.print_exc()
+            return False
+
+        self.journal_sizes[user_id] = 0
+        return True
+
+    def compact_user(self, user_id):
+        with self.lock:
+            model_dict = utils.load_json_data(self.path, user_id)
+            records = utils.load_journal_data(self.path, user_id)
+            if not model_dict or records is False:
+                return False
+            if not records:
+                return True
+
+            # Replay the journal and rebuild the model so the snapshot counts are correct
+            model_dict = utils.apply_journal_records(model_dict, records)
+            model = utils.create_model(None, model_dict, user_id, user_data=True)
+
+            # Write the new snapshot before removing the journal
+            if not utils.save_json_data(self.path, user_id, utils.model_to_json(model)):
+                return False
+            return self.clear_journal(user_id)
+
+    def run_compactor(self):
+        while True:
+            time.sleep(self.compact_interval)
+
+            # Compact any journals that have grown too large
+            for user_id, size in list(self.journal_sizes.items()):
+                if size >= self.compact_size:
+                    self.compact_user(user_id)
+
+
+# Stores all users in a SQLite database (in WAL mode) with tables for users, dialogues, utterances and labels
+# Utterance text is only written once, label updates are single row updates
+class SqliteStorage:
+    def __init__(self, path, file_name="user_dialogues"):
+        self.path = path
+
+        # Connection is shared between request threads, so access is serialised with a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path + file_name + ".db", check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id TEXT PRIMARY KEY,
+                    dataset TEXT NOT NULL,
+                    num_dialogues INTEGER NOT NULL,
+                    num_labelled INTEGER NOT NULL,
+                    num_unlabelled INTEGER NOT NULL,
+                    num_complete INTEGER NOT NULL,
+                    num_incomplete INTEGER NOT NULL,
+                    current_dialogue_index INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS dialogues (
+                    user_id TEXT NOT NULL,
+                    dialogue_id TEXT NOT NULL,
+                    dialogue_index INTEGER NOT NULL,
+                    is_labelled INTEGER NOT NULL,
+                    is_complete INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    questions TEXT NOT NULL,
+                    num_utterances INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, dialogue_id));
+                CREATE TABLE IF NOT EXISTS utterances (
+                    user_id TEXT NOT NULL,
+                    dialogue_id TEXT NOT NULL,
+                    utterance_index INTEGER NOT NULL,
+                    speaker TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (user_id, dialogue_id, utterance_index));
+                CREATE TABLE IF NOT EXISTS labels (
+                    user_id TEXT NOT NULL,
+                    dialogue_id TEXT NOT NULL,
+                    utterance_index INTEGER NOT NULL,
+                    ap_label TEXT NOT NULL,
+                    da_label TEXT NOT NULL,
+                    is_labelled INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    ap_flag INTEGER NOT NULL,
+                    da_flag INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, dialogue_id, utterance_index));
+                CREATE INDEX IF NOT EXISTS dialogues_dialogue_id ON dialogues (dialogue_id);
+                CREATE INDEX IF NOT EXISTS users_dataset ON users (dataset);
+                """)
+
+    def has_user(self, user_id):
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row:
+            return True
+
+        # Users with an old single file model are also valid, they are added to the database on load
+        return os.path.isfile(self.path + user_id + ".json")
+
+    def load_user(self, user_id):
+        with self.lock:
+            model_dict = load_database_user(self.connection, user_id)
+        if model_dict:
+            return model_dict
+
+        # If they are not in the database try and migrate the users single file model
+        model_dict = utils.load_json_data(self.path, user_id)
+        if not model_dict:
+            return False
+        model = utils.create_model(None, model_dict, user_id, user_data=True)
+        if not self.save_model(model):
+            return False
+
+        return model_dict
+
+    def save_model(self, model):
+        model_dict = utils.model_to_dict(model, include_dialogues=False)
+        try:
+            with self.lock, self.connection:
+                # Replace any existing rows for this user
+                for table in ['users', 'dialogues', 'utterances', 'labels']:
+                    self.connection.execute("DELETE FROM " + table + " WHERE user_id = ?", (model.user_id,))
+
+                self.connection.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (model_dict['user_id'], model_dict['dataset'], model_dict['num_dialogues'],
+                                         model_dict['num_labelled'], model_dict['num_unlabelled'],
+                                         model_dict['num_complete'], model_dict['num_incomplete'],
+                                         model_dict['current_dialogue_index']))
+
+                for i, dialogue in enumerate(model.dialogues):
+                    self.connection.execute("INSERT INTO dialogues VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                            (model.user_id, dialogue.dialogue_id, i) + dialogue_row(dialogue))
+                    self.connection.executemany("INSERT INTO utterances VALUES (?, ?, ?, ?, ?)",
+                                                [(model.user_id, dialogue.dialogue_id, j, utt.speaker, utt.text)
+                                                 for j, utt in enumerate(dialogue.utterances)])
+                    self.connection.executemany("INSERT INTO labels VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                                [(model.user_id, dialogue.dialogue_id, j) + label_row(utt)
+                                                 for j, utt in enumerate(dialogue.utterances)])
+
+        except sqlite3.Error:
+            traceback.print_exc()
+            return False
+
+        return True
+
+    def save_dialogue(self, model, dialogue):
+        # Update the dialogue and its utterance labels
+        indexes = range(len(dialogue.utterances))
+        return self.save_utterances(model, dialogue, indexes)
+
+    def save_utterances(self, model, dialogue, indexes):
+        model_dict = utils.model_to_dict(model, include_dialogues=False)
+        try:
+            with self.lock, self.connection:
+                cursor = self.connection.execute("UPDATE users SET num_labelled = ?, num_unlabelled = ?, "
+                                                 "num_complete = ?, num_incomplete = ?, current_dialogue_index = ? "
+                                                 "WHERE user_id = ?",
+                                                 (model_dict['num_labelled'], model_dict['num_unlabelled'],
+                                                  model_dict['num_complete'], model_dict['num_incomplete'],
+                                                  model_dict['current_dialogue_index'], model.user_id))
+                # The save fails if the users rows were never stored, rather than updating nothing
+                if cursor.rowcount == 0:
+                    return False
+                cursor = self.connection.execute("UPDATE dialogues SET is_labelled = ?, is_complete = ?, time = ?, "
+                                                 "questions = ?, num_utterances = ? "
+                                                 "WHERE user_id = ? AND dialogue_id = ?",
+                                                 dialogue_row(dialogue) + (model.user_id, dialogue.dialogue_id))
+                if cursor.rowcount == 0:
+                    self.connection.rollback()
+                    return False
+
+                # Each utterance is a single row update
+                self.connection.executemany("UPDATE labels SET ap_label = ?, da_label = ?, is_labelled = ?, "
+                                            "time = ?, ap_flag = ?, da_flag = ? "
+                                            "WHERE user_id = ? AND dialogue_id = ? AND utterance_index = ?",
+                                            [label_row(dialogue.utterances[i]) +
+                                             (model.user_id, dialogue.dialogue_id, i) for i in indexes])
+
+        except sqlite3.Error:
+            traceback.print_exc()
+            return False
+
+        return True
+
+    def close_user(self, user_id):
+        return True
+
+
+# Wraps another storage type and saves users in a background thread, so requests return once their model is updated
+# Saves for the same user are combined and written at most once every flush_interval seconds
+# Other processes only see the changes once they are written, so only use with the 'local' session type
+class WriteBehindStorage:
+    def __init__(self, storage, flush_interval=2):
+        self.storage = storage
+        self.flush_interval = flush_interval
+
+        # Function that returns the lock request threads hold while changing a users model (set by the session store)
+        # Users are only written while holding it, so a change is never saved half applied
+        self.user_lock = None
+
+        # User id -> [model, time first queued, dialogue id -> [dialogue, changed utterance indexes]]
+        # The indexes are None if the whole dialogue must be saved
+        self.pending = dict()
+        self.lock = threading.Lock()
+
+        # Only one thread writes to the wrapped storage at a time
+        self.flush_lock = threading.Lock()
+
+        # Flush counts and timings (in seconds)
+        self.num_queued = 0
+        self.num_coalesced = 0
+        self.num_flushes = 0
+        self.num_failed = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.last_flush_latency = 0.0
+        self.last_write_time = 0.0
+
+        # Start the background writer, and write anything left when the server stops
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def has_user(self, user_id):
+        if user_id in self.pending:
+            return True
+        return self.storage.has_user(user_id)
+
+    def load_user(self, user_id):
+        # Make sure the stored user is up to date first
+        self.flush_user(user_id)
+        return self.storage.load_user(user_id)
+
+    def save_model(self, model):
+        with self.flush_lock:
+            # The whole model replaces any queued changes
+            with self.lock:
+                self.pending.pop(model.user_id, None)
+            return self.storage.save_model(model)
+
+    def save_dialogue(self, model, dialogue):
+        self.queue(model, dialogue, None)
+        return True
+
+    def save_utterances(self, model, dialogue, indexes):
+        self.queue(model, dialogue, indexes)
+        return True
+
+    def close_user(self, user_id):
+        # Write the users changes before closing them in the wrapped storage
+        self.flush_user(user_id)
+        return self.storage.close_user(user_id)
+
+    def queue(self, model, dialogue, indexes):
+        with self.lock:
+            self.num_queued += 1
+            if model.user_id in self.pending:
+                self.num_coalesced += 1
+            entry = self.pending.setdefault(model.user_id, [model, time.time(), dict()])
+
+            # Keep the latest model, it has the current dialogue index and counts
+            entry[0] = model
+
+            # Combine the changed utterances, unless the whole dialogue is being saved
+            if dialogue.dialogue_id not in entry[2]:
+                entry[2][dialogue.dialogue_id] = [dialogue, None if indexes is None else set(indexes)]
+            else:
+                queued = entry[2][dialogue.dialogue_id]
+                queued[0] = dialogue
+                if indexes is None or queued[1] is None:
+                    queued[1] = None
+                else:
+                    queued[1].update(indexes)
+
+    def flush_user(self, user_id):
+        user_lock = self.user_lock(user_id) if self.user_lock is not None else contextlib.nullcontext()
+        with user_lock, self.flush_lock:
+            with self.lock:
+                entry = self.pending.pop(user_id, None)
+            if entry is None:
+                return True
+            model, queued_time, dialogues = entry
+
+            # Save each changed dialogue
+            write_start = time.time()
+            failed = []
+            for dialogue, indexes in dialogues.values():
+                if indexes is None:
+                    success = self.storage.save_dialogue(model, dialogue)
+                else:
+                    success = self.storage.save_utterances(model, dialogue, sorted(indexes))
+                if not success:
+                    failed.append((dialogue, indexes))
+            now = time.time()
+
+            # Queue any failed saves again so they are retried
+            for dialogue, indexes in failed:
+                self.queue(model, dialogue, indexes)
+
+            # Latency is the time from the first queued change until it was written
+            with self.lock:
+                self.num_flushes += 1
+                self.num_failed += len(failed)
+                self.last_flush_latency = now - queued_time
+                self.total_flush_latency += self.last_flush_latency
+                self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+                self.last_write_time = now - write_start
+
+        return not failed
+
+    def flush_all(self):
+        with self.lock:
+            user_ids = list(self.pending.keys())
+        success = True
+        for user_id in user_ids:
+            success = self.flush_user(user_id) and success
+        return success
+
+    def run_writer(self):
+        # Check twice an interval, so changes are never waiting much longer than flush_interval
+        while not self.stopped.wait(self.flush_interval / 2):
+            # Write every user with changes that have waited at least flush_interval
+            now = time.time()
+            with self.lock:
+                user_ids = [user_id for user_id, entry in self.pending.items()
+                            if now - entry[1] >= self.flush_interval]
+            for user_id in user_ids:
+                try:
+                    self.flush_user(user_id)
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self):
+        self.stopped.set()
+        return self.flush_all()
+
+    def get_metrics(self):
+        with self.lock:
+            return {'queue_depth': len(self.pending),
+                    'queued_dialogues': sum(len(entry[2]) for entry in self.pending.values()),
+                    'oldest_queued_age': max([time.time() - entry[1] for entry in self.pending.values()], default=0),
+                    'num_queued': self.num_queued,
+                    'num_coalesced': self.num_coalesced,
+                    'num_flushes': self.num_flushes,
+                    'num_failed': self.num_failed,
+                    'last_flush_latency': self.last_flush_latency,
+                    'mean_flush_latency': self.total_flush_latency / self.num_flushes if self.num_flushes else 0,
+                    'max_flush_latency': self.max_flush_latency,
+                    'last_write_time': self.last_write_time}
+
+
+# Converts a dialogues state to a row of the dialogues table (excluding keys)
+def dialogue_row(dialogue):
+    return (dialogue.is_labelled, dialogue.is_complete, dialogue.time, json.dumps(dialogue.questions),
+            dialogue.num_utterances)
+
+
+# Converts an utterances labels to a row of the labels table (excluding keys)
+def label_row(utterance):
+    return (utterance.ap_label, utterance.da_label, utterance.is_labelled, utterance.time,
+            utterance.ap_flag, utterance.da_flag)
+
+
+# Gets the ids of the users in the database, or only the users annotating one of the datasets if given
+def load_database_user_ids(connection, datasets=None):
+    if datasets is None:
+        return [row[0] for row in connection.execute("SELECT user_id FROM users")]
+    return [row[0] for row in connection.execute("SELECT user_id FROM users WHERE dataset IN (" +
+                                                 ",".join("?" * len(datasets)) + ")", list(datasets))]
+
+
+# Loads a user from the database into the same dictionary as model_to_dict()
+# If dialogue_ids are given only those dialogues are loaded, e.g. for analysing a subset of the data
+def load_database_user(connection, user_id, dialogue_ids=None):
+    user = connection.execute("SELECT user_id, dataset, num_dialogues, num_labelled, num_unlabelled, num_complete, "
+                              "num_incomplete, current_dialogue_index FROM users WHERE user_id = ?",
+                              (user_id,)).fetchone()
+    if not user:
+        return False
+
+    model_dict = dict(zip(['user_id', 'dataset', 'num_dialogues', 'num_labelled', 'num_unlabelled', 'num_complete',
+                           'num_incomplete', 'current_dialogue_index'], user))
+
+    dialogue_filter, dialogue_params = "", []
+    if dialogue_ids is not None:
+        dialogue_filter = " AND dialogue_id IN (" + ",".join("?" * len(dialogue_ids)) + ")"
+        dialogue_params = list(dialogue_ids)
+
+    # Get the dialogues in order, then all of the utterances with their labels
+    dialogues = connection.execute("SELECT dialogue_id, is_labelled, is_complete, time, questions, num_utterances "
+                                   "FROM dialogues WHERE user_id = ?" + dialogue_filter + " ORDER BY dialogue_index",
+                                   [user_id] + dialogue_params).fetchall()
+    utterances = connection.execute("SELECT u.dialogue_id, u.speaker, u.text, l.ap_label, l.da_label, "
+                                    "l.is_labelled, l.time, l.ap_flag, l.da_flag "
+                                    "FROM utterances u JOIN labels l ON u.user_id = l.user_id "
+                                    "AND u.dialogue_id = l.dialogue_id AND u.utterance_index = l.utterance_index "
+                                    "WHERE u.user_id = ?" + dialogue_filter.replace("dialogue_id", "u.dialogue_id") +
+                                    " ORDER BY u.dialogue_id, u.utterance_index",
+                                    [user_id] + dialogue_params).fetchall()
+
+    # Group the utterances by dialogue
+    dialogue_utterances = dict()
+    for row in utterances:
+        dialogue_utterances.setdefault(row[0], []).append({'speaker': row[1],
+                                                           'text': row[2],
+                                                           'ap_label': row[3],
+                                                           'da_label': row[4],
+                                                           'is_labelled': bool(row[5]),
+                                                           'time': row[6],
+                                                           'ap_flag': bool(row[7]),
+                                                           'da_flag': bool(row[8])})
+
+    model_dict['dialogues'] = []
+    for row in dialogues:
+        model_dict['dialogues'].append({'dialogue_id': row[0],
+                                        'is_labelled': bool(row[1]),
+                                        'is_complete': bool(row[2]),
+                                        'time': row[3],
+                                        'questions': json.loads(row[4]),
+                                        'num_utterances': row[5],
+                                        'utterances': dialogue_utterances.get(row[0], [])})
+
+    return model_dict
+
+
+# Creates one of the user storage types
+def create_storage(storage_type, path):
+    if storage_type == 'json':
+        return JsonStorage(path)
+    elif storage_type == 'dialogue':
+        return DialogueStorage(path)
+    elif storage_type == 'journal':
+        return JournalStorage(path)
+    elif storage_type == 'sqlite':
+        return SqliteStorage(path)
+    else:
+        raise ValueError("Invalid storage type: \"" + storage_type + "\". "
+                         "Must be one of \"json\", \"dialogue\", \"journal\" or \"sqlite\".")
@@ -0,0 +1,68 @@
+import utilities as utils
+from storage import JournalStorage, SqliteStorage
+
+# Usage: python -m pytest test_storage.py
+
+# Data paths
+user_data_path = "static/data/user_dialogues/"
+user_id = "usr1-1"
+
+
+def test_journal_incomplete_record(tmp_path):
+    path = str(tmp_path) + "/"
+
+    # Save the bundled user as the snapshot and journal their first dialogue
+    model = utils.create_model(None, utils.load_json_data(user_data_path, user_id), user_id, user_data=True)
+    assert utils.save_json_data(path, user_id, utils.model_to_json(model))
+    storage = JournalStorage(path, compact_interval=0)
+    assert storage.save_dialogue(model, model.dialogues[0])
+
+    # A crash during the next append leaves a partial record without a newline
+    with open(path + user_id + ".journal", 'ab') as file:
+        file.write(b'{"dialogue":{"dialogue_id":')
+
+    # After a restart the next save must not be joined on to the partial record
+    model.dialogues[1].utterances[0].set_ap_label("Test-AP")
+    model.set_current_dialogue(1)
+    storage = JournalStorage(path, compact_interval=0)
+    assert storage.save_dialogue(model, model.dialogues[1])
+
+    # Both saves load, and the partial record is gone
+    records = utils.load_journal_data(path, user_id)
+    assert len(records) == 4
+    assert records[2]['dialogue']['dialogue_id'] == model.dialogues[1].dialogue_id
+    assert records[2]['dialogue']['utterances'][0]['ap_label'] == "Test-AP"
+    assert records[3]['current_dialogue_index'] == 1
+
+    # Compaction keeps the changes
+    assert storage.compact_user(user_id)
+    model_dict = storage.load_user(user_id)
+    assert model_dict['current_dialogue_index'] == 1
+    assert model_dict['dialogues'][1]['utterances'][0]['ap_label'] == "Test-AP"
+
+
+def test_journal_skips_bad_record(tmp_path):
+    path = str(tmp_path) + "/"
+
+    # An unreadable record in the middle of the journal only loses that record
+    with open(path + user_id + ".journal", 'wb') as file:
+        file.write(b'{"current_dialogue_index":1}\n{"current_dia\n{"current_dialogue_index":2}\n')
+
+    records = utils.load_journal_data(path, user_id)
+    assert records == [{'current_dialogue_index': 1}, {'current_dialogue_index': 2}]
+
+
+def test_sqlite_save_missing_user(tmp_path):
+    path = str(tmp_path) + "/"
+    model = utils.create_model(None, utils.load_json_data(user_data_path, user_id), user_id, user_data=True)
+    storage = SqliteStorage(path)
+
+    # Saving the labels of a user that was never stored fails, so the save is not silently lost
+    assert not storage.save_dialogue(model, model.dialogues[0])
+    assert not storage.has_user(user_id)
+
+    # Once stored their saves succeed
+    assert storage.save_model(model)
+    model.dialogues[0].utterances[0].set_ap_label("Test-AP")
+    assert storage.save_utterances(model, model.dialogues[0], [0])
+    assert storage.load_user(user_id)['dialogues'][0]['utterances'][0]['ap_label'] == "Test-AP"
@@ -1,13 +1,39 @@
 from random import shuffle
 import traceback
+import threading
 import json
+import gzip
+import hashlib
+import os
 from dialogue_model import *
 
+# Use the faster orjson codec if it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Encodes data as JSON bytes, compact by default or indented if pretty is True
+def to_json_bytes(data, pretty=False):
+    if pretty:
+        return json.dumps(data, sort_keys=False, indent=4, separators=(',', ': ')).encode('utf-8')
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# Decodes JSON bytes or string
+def from_json_bytes(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 def load_json_data(path, file_name):
     try:
-        with open(path + file_name + ".json") as file:
-            data = json.load(file)
+        with open(path + file_name + ".json", 'rb') as file:
+            data = from_json_bytes(file.read())
 
     except (IOError, ValueError):
         traceback.print_exc()
@@ -16,10 +42,137 @@ def load_json_data(path, file_name):
     return data
 
 
-def save_json_data(path, file_name, data):
+# Process wide cache of the static JSON files (dialogue sets and labels), shared by every user
+# Each entry holds the parsed data, which should not be modified, and is reloaded if the file changes on disk
+json_cache = dict()
+json_cache_lock = threading.Lock()
+
+
+def load_cached_json_data(path, file_name):
     try:
-        with open(path + file_name + '.json', 'w+') as file:
-            json.dump(data, file, sort_keys=False, indent=4, separators=(',', ': '))
+        mtime = os.stat(path + file_name + ".json").st_mtime_ns
+
+    except OSError:
+        traceback.print_exc()
+        return False
+
+    with json_cache_lock:
+        # Only read the file again if it has changed
+        entry = json_cache.get(path + file_name)
+        if entry is None or entry['mtime'] != mtime:
+            data = load_json_data(path, file_name)
+            if data is False:
+                return False
+            entry = {'mtime': mtime, 'data': data}
+            json_cache[path + file_name] = entry
+
+    return entry
+
+
+# Gets a cached JSON file with its serialised and compressed bytes, so it can be sent without re-encoding
+def load_served_json_data(path, file_name):
+    entry = load_cached_json_data(path, file_name)
+    if not entry:
+        return False
+
+    with json_cache_lock:
+        # Only encode the file the first time it is served
+        if 'body' not in entry:
+            body = to_json_bytes(entry['data'])
+            entry['body'] = body
+            # No timestamp in the gzip header, and both ETags come from the body,
+            # so they are the same after a reload and in every server process
+            entry['gzip_body'] = gzip.compress(body, mtime=0)
+            entry['etag'] = hashlib.sha256(body).hexdigest()
+            entry['gzip_etag'] = entry['etag'] + "-gzip"
+
+    return entry
+
+
+def load_corpus_data(path, file_name):
+    entry = load_cached_json_data(path, file_name)
+    if not entry:
+        return False
+
+    with json_cache_lock:
+        # Add a dialogue_id -> dialogue lookup the first time the file is used as a corpus
+        if 'dialogues' not in entry:
+            data = entry['data']
+            # Practice has a single dialogue instead of a list
+            dialogues = data['dialogues'] if 'dialogues' in data.keys() else [data]
+            entry['dialogues'] = {dialogue['dialogue_id']: dialogue for dialogue in dialogues}
+
+    return entry
+
+
+# Saves data as compact JSON, or indented if pretty is True, data can also be already encoded JSON bytes
+def save_json_data(path, file_name, data, pretty=False):
+    try:
+        body = data if isinstance(data, bytes) else to_json_bytes(data, pretty)
+
+        # Write to a temporary file and then replace, so a crash mid-write never truncates the existing file
+        with open(path + file_name + '.json.tmp', 'wb') as file:
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + file_name + '.json.tmp', path + file_name + '.json')
+
+    except (IOError, ValueError, TypeError):
+        traceback.print_exc()
+        return False
+
+    return True
+
+
+def load_journal_data(path, file_name):
+    records = []
+    try:
+        with open(path + file_name + ".journal", 'rb') as file:
+            for line in file:
+                # A crash during an append can leave a record incomplete, so skip it and keep the later records
+                try:
+                    records.append(from_json_bytes(line))
+                except ValueError:
+                    print("Ignoring incomplete journal record in " + file_name + "...")
+
+    except FileNotFoundError:
+        return records
+    except IOError:
+        traceback.print_exc()
+        return False
+
+    return records
+
+
+# Removes an incomplete last record, left by a crash during an append, so new records are not joined on to it
+def repair_journal_data(path, file_name):
+    try:
+        with open(path + file_name + ".journal", 'r+b') as file:
+            data = file.read()
+            if data and not data.endswith(b"\n"):
+                print("Removing incomplete journal record from " + file_name + "...")
+                file.truncate(data.rfind(b"\n") + 1)
+                file.flush()
+                os.fsync(file.fileno())
+
+    except FileNotFoundError:
+        return True
+    except IOError:
+        traceback.print_exc()
+        return False
+
+    return True
+
+
+# Records can be dictionaries or already encoded JSON bytes
+def append_journal_data(path, file_name, records):
+    try:
+        # Write all of the records with a single write and fsync
+        lines = b"".join((record if isinstance(record, bytes) else to_json_bytes(record)) + b"\n" for record in records)
+        with open(path + file_name + ".journal", 'ab') as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
 
     except (IOError, ValueError):
         traceback.print_exc()
@@ -28,6 +181,20 @@ def save_json_data(path, file_name, data):
     return True
 
 
+# Applies journal records (saved dialogues and navigation) to a model dictionary/json
+def apply_journal_records(data, records):
+    # Index the dialogues so each record only replaces its own dialogue
+    dialogue_indexes = {dialogue['dialogue_id']: i for i, dialogue in enumerate(data['dialogues'])}
+
+    for record in records:
+        if 'dialogue' in record:
+            data['dialogues'][dialogue_indexes[record['dialogue']['dialogue_id']]] = record['dialogue']
+        if 'current_dialogue_index' in record:
+            data['current_dialogue_index'] = record['current_dialogue_index']
+
+    return data
+
+
 def load_txt_data(path, file_name):
     try:
         with open(path + "/" + file_name + ".txt", "r") as file:
@@ -44,12 +211,20 @@ def load_txt_data(path, file_name):
 # Creates a dialogue model from the specified dialogue dataset file
 def create_model(dialogue_data_path, data, user_id, user_data=False):
 
+    # Get the shared corpus dialogues, so utterance text and speakers are not copied for each user
+    corpus_dialogues = dict()
+    if dialogue_data_path is not None:
+        for file_name in ["practice", data['dataset']]:
+            corpus = load_corpus_data(dialogue_data_path, file_name)
+            if corpus:
+                corpus_dialogues.update(corpus['dialogues'])
+
     # Create dialogue objects
-    dialogues = dialogues_from_dict(data)
+    dialogues = dialogues_from_dict(data, corpus_dialogues)
 
     # If we are not using existing user data add practice and shuffle
     if not user_data:
-        practice_data = load_json_data(dialogue_data_path, "practice")
+        practice_data = load_corpus_data(dialogue_data_path, "practice")['data']
         practice_dialogue = dialogue_from_dict(practice_data)
 
         # Shuffle the actual dialogues and insert the practice at the start
@@ -71,7 +246,7 @@ def create_model(dialogue_data_path, data, user_id, user_data=False):
     return model
 
 
-def model_to_dict(model):
+def model_to_dict(model, include_dialogues=True):
 
     # Convert model to dictionary
     model_dict = dict()
@@ -83,20 +258,41 @@ def model_to_dict(model):
     model_dict['num_complete'] = model.num_complete
     model_dict['num_incomplete'] = model.num_incomplete
     model_dict['current_dialogue_index'] = model.current_dialogue_index
-    model_dict['dialogues'] = dialogues_to_dict(model.dialogues)
+    if include_dialogues:
+        model_dict['dialogues'] = dialogues_to_dict(model.dialogues)
 
     return model_dict
 
 
+# Encodes the model as JSON bytes in the same format as model_to_dict()
+# When compact, each dialogues cached bytes are used, so only changed dialogues are encoded again
+def model_to_json(model, pretty=False):
+    if pretty:
+        return to_json_bytes(model_to_dict(model), pretty=True)
+
+    # Add the dialogues to the end of the encoded model values
+    model_json = to_json_bytes(model_to_dict(model, include_dialogues=False))
+    return model_json[:-1] + b',"dialogues":[' + b','.join(dialogue_to_json(dialogue) for dialogue in model.dialogues) + b']}'
+
+
+# Encodes the dialogue as compact JSON bytes in the same format as dialogue_to_dict()
+# The bytes are kept until the dialogue is changed
+def dialogue_to_json(dialogue):
+    if dialogue.json_bytes is None:
+        dialogue.json_bytes = to_json_bytes(dialogue_to_dict(dialogue))
+    return dialogue.json_bytes
+
+
 # Creates dialogue objects from dataset dictionary/json
-def dialogues_from_dict(data):
+def dialogues_from_dict(data, corpus_dialogues=None):
     try:
         # Loop over the dialogues in the data
         dialogues = []
         for dialogue in data['dialogues']:
 
-            # Create the dialogue
-            tmp_dialogue = dialogue_from_dict(dialogue)
+            # Create the dialogue, sharing the corpus text if there is a matching dialogue
+            corpus_dialogue = corpus_dialogues.get(dialogue['dialogue_id']) if corpus_dialogues else None
+            tmp_dialogue = dialogue_from_dict(dialogue, corpus_dialogue)
 
             # Add to dialogue list
             dialogues.append(tmp_dialogue)
@@ -109,15 +305,22 @@ def dialogues_from_dict(data):
 
 
 # Creates a dialogue object and its utterances from dictionary/json
-def dialogue_from_dict(dialogue):
+# If the matching corpus dialogue is given its text and speakers are used, so they are shared between users
+def dialogue_from_dict(dialogue, corpus_dialogue=None):
     tmp_dialogue = None
     try:
         # Loop over the utterances in the dialogue
         utterances = []
-        for utterance in dialogue['utterances']:
+        for i, utterance in enumerate(dialogue['utterances']):
+
+            # Use the corpus utterance if it has the same text
+            text = utterance['text']
+            if corpus_dialogue is not None and i < len(corpus_dialogue['utterances']) and \
+                    corpus_dialogue['utterances'][i]['text'] == text:
+                text = corpus_dialogue['utterances'][i]['text']
 
             # Create a new utterance
-            tmp_utterance = Utterance(utterance['text'], utterance['speaker'])
+            tmp_utterance = Utterance(text, utterance['speaker'])
 
             # Set utterance labels if not blank
             if utterance['ap_label'] is not "":
@@ -162,6 +365,57 @@ def dialogue_from_dict(dialogue):
     return tmp_dialogue
 
 
+# Applies changed utterances and dialogue values from dictionary/json to an existing dialogue object
+# Utterances are matched on 'index', or their position if it is missing, so a full dialogue can also be applied
+def apply_dialogue_updates(dialogue, data):
+    updated_indexes = []
+    try:
+        # Check all of the utterance indexes before changing anything
+        utterances = data.get('utterances', [])
+        indexes = [utterance.get('index', i) for i, utterance in enumerate(utterances)]
+        for index in indexes:
+            if not isinstance(index, int) or not 0 <= index < len(dialogue.utterances):
+                print("Error! " + str(index) + " is not a valid utterance index!")
+                return False
+
+        # Update the changed utterances in place
+        for index, utterance in zip(indexes, utterances):
+            tmp_utterance = dialogue.utterances[index]
+
+            # Set utterance labels if not blank
+            if utterance.get('ap_label', "") != "":
+                tmp_utterance.set_ap_label(utterance['ap_label'])
+            if utterance.get('da_label', "") != "":
+                tmp_utterance.set_da_label(utterance['da_label'])
+
+            # Set utterance flags and time if set
+            if 'ap_flag' in utterance.keys():
+                tmp_utterance.set_ap_flag(utterance['ap_flag'])
+            if 'da_flag' in utterance.keys():
+                tmp_utterance.set_da_flag(utterance['da_flag'])
+            if 'time' in utterance.keys():
+                tmp_utterance.set_time(utterance['time'])
+
+            updated_indexes.append(index)
+
+        # Update the dialogue values if set
+        if 'is_complete' in data.keys():
+            dialogue.set_is_complete(data['is_complete'])
+        if 'time' in data.keys():
+            dialogue.set_time(data['time'])
+        if 'questions' in data.keys():
+            dialogue.set_questions(data['questions'])
+
+    except (AttributeError, TypeError):
+        traceback.print_exc()
+        return False
+
+    # Check if the dialogue is labelled or not
+    dialogue.check_labels()
+
+    return updated_indexes
+
+
 # Converts dialogue objects to a dictionary/list
 def dialogues_to_dict(dialogues):
     dialogues_list = []